@@ -0,0 +1,422 @@
+"""
+Benchmark harness for watchdog_h265.
+
+  python benchmark.py generate LIBRARY [--files 40]
+      Build a synthetic media library with FFmpeg (lavfi testsrc2): mixed codecs,
+      resolutions, durations and containers in nested Show/Season/Movie folders.
+
+  python benchmark.py run LIBRARY [--encode 5] [--preset ultrafast]
+      Time scan_folder (cold and warm), get_video_info, estimate_hevc_size and
+      end-to-end worker_loop throughput on a copy of LIBRARY (real FFmpeg).
+
+  python benchmark.py simulate [--files 1000000] [--encode 1000]
+      Offline load test: stand-in ffprobe/ffmpeg shell scripts are put first on
+      PATH and a tree of sparse fake files is scanned, scheduled, "encoded" and
+      persisted - no media, no FFmpeg, almost no disk space.
+
+Every command runs in its own work directory (config.json, stats, probe cache,
+logs) so real watchdog state is never touched. Add --json FILE for
+machine-readable results.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import importlib
+import subprocess
+import tempfile
+import threading
+
+# (encoder, extra args, container, audio codec) - hevc/vp9 sources exercise the skip paths
+SYNTHETIC_CODECS = [
+    ("libx264", ["-crf", "18", "-preset", "veryfast"], ".mkv", "aac"),
+    ("libx264", ["-crf", "23", "-preset", "veryfast"], ".mp4", "aac"),
+    ("mpeg2video", ["-b:v", "8M"], ".mkv", "ac3"),
+    ("mpeg4", ["-q:v", "3"], ".avi", "ac3"),
+    ("libx265", ["-crf", "28", "-preset", "ultrafast"], ".mkv", "aac"),
+    ("libvpx-vp9", ["-b:v", "1M", "-deadline", "realtime", "-cpu-used", "8"], ".mkv", "libopus"),
+]
+SYNTHETIC_SIZES = [(640, 360), (1280, 720), (1920, 1080)]
+
+FAKE_FFPROBE = r"""#!/bin/sh
+# Stand-in ffprobe: codec from the [tag] in the file name (encode outputs are HEVC), fixed 1080p / 45 min
+for f; do :; done
+case "$f" in
+    *.hevc.mkv) codec=hevc ;;
+    *"[hevc]"*) codec=hevc ;;
+    *"[av1]"*) codec=av1 ;;
+    *"[mpeg2video]"*) codec=mpeg2video ;;
+    *"[mpeg4]"*) codec=mpeg4 ;;
+    *) codec=h264 ;;
+esac
+printf '{"streams":[{"codec_type":"video","codec_name":"%s","profile":"Main","pix_fmt":"yuv420p","width":1920,"height":1080,"avg_frame_rate":"24000/1001","r_frame_rate":"24000/1001"},{"codec_type":"audio","codec_name":"ac3"},{"codec_type":"subtitle","codec_name":"subrip"}],"format":{"duration":"2700.0","bit_rate":"8000000"}}\n' "$codec"
+"""
+
+FAKE_FFMPEG = r"""#!/bin/sh
+# Stand-in ffmpeg: instant "encode" to a sparse file half the input size;
+# verification decodes (-f null) always succeed
+input=""
+previous=""
+for arg; do
+    [ "$previous" = "-i" ] && input="$arg"
+    previous="$arg"
+done
+output="$arg"
+if [ "$output" = "-" ]; then
+    printf 'frame=1000000\nprogress=end\n'
+    exit 0
+fi
+printf 'frame=64800\nfps=500.0\nbitrate=4000.0kbits/s\nout_time_us=2700000000\nspeed=20.8x\nprogress=end\n'
+size=$(wc -c < "$input")
+truncate -s $((size / 2)) "$output" 2>/dev/null || : > "$output"
+"""
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Results:
+    """Collects timings, prints them as they come and optionally dumps JSON"""
+
+    def __init__(self):
+        self.data = {}
+
+    def add(self, name, seconds, count=None, unit="files", **extra):
+        entry = {"seconds": round(seconds, 4), **extra}
+        line = f"{name:<32} {seconds:>10.3f} s"
+        if count:
+            entry["count"] = count
+            entry["per_second"] = round(count / seconds, 2) if seconds > 0 else None
+            line += f"  {count:>9} {unit}  {count / seconds if seconds > 0 else 0:>10.1f} {unit}/s"
+        for key, value in extra.items():
+            line += f"  {key}={value}"
+        self.data[name] = entry
+        print(line, flush=True)
+
+    def save(self, path):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+
+
+def load_watchdog(workdir, config):
+    """Import watchdog_h265 with config.json written to (and cwd set to) workdir"""
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "config.json"), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    watchdog = importlib.import_module("watchdog_h265")
+    return watchdog
+
+
+def quiet_logging(verbose):
+    """Only warnings reach stdout/log file; the root logger stays at INFO for BatchDone"""
+    if not verbose:
+        for handler in logging.getLogger().handlers:
+            handler.setLevel(logging.WARNING)
+
+
+class BatchDone(logging.Handler):
+    """Set when worker_loop logs the end of a scan + encode batch"""
+
+    MESSAGES = ("Processing complete", "No files need transcoding")
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.event = threading.Event()
+
+    def emit(self, record):
+        if record.getMessage().startswith(self.MESSAGES):
+            self.event.set()
+
+
+def bench_config(library, overrides=None):
+    """Config for benchmark runs: everything in the work dir, no waiting or sampling"""
+    config = {
+        "SOURCE_DIRS": [{"path": library, "name": os.path.basename(library.rstrip("/")) or library}],
+        "MIN_SAVINGS_GB": 0,           # Synthetic files are tiny - don't skip them as "too small"
+        "WATCH_FOLDERS": False,
+        "STABLE_SECONDS": 0,
+        "SAMPLE_PRECHECK": False,
+        "FREE_SPACE_HEADROOM_GB": 0,
+    }
+    config.update(overrides or {})
+    return config
+
+
+# --- generate ---
+def generate_library(library, files, seconds, seed):
+    rng = random.Random(seed)
+    os.makedirs(library, exist_ok=True)
+    created = 0
+    for i in range(files):
+        encoder, args, ext, audio = SYNTHETIC_CODECS[i % len(SYNTHETIC_CODECS)]
+        width, height = rng.choice(SYNTHETIC_SIZES)
+        duration = rng.choice([seconds // 2 or 1, seconds, seconds * 2])
+        if i % 3 == 2:
+            folder = os.path.join(library, "Movies", f"Movie {i:03d}")
+            name = f"Movie {i:03d}{ext}"
+        else:
+            show, season = i % 4, 1 + i % 2
+            folder = os.path.join(library, "TV", f"Show {show}", f"Season {season:02d}")
+            name = f"Show {show} S{season:02d}E{i:02d}{ext}"
+        os.makedirs(folder, exist_ok=True)
+        output = os.path.join(folder, name)
+        if os.path.exists(output):
+            continue
+        cmd = ["ffmpeg", "-v", "error", "-y",
+               "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=24:duration={duration}",
+               "-f", "lavfi", "-i", f"sine=frequency={200 + i * 10}:duration={duration}",
+               "-c:v", encoder, *args, "-pix_fmt", "yuv420p", "-c:a", audio, "-shortest", output]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            print(f"skipped {name} ({encoder} unavailable?): {result.stderr.strip()[:200]}")
+            if os.path.exists(output):
+                os.remove(output)
+            continue
+        created += 1
+    return created
+
+
+def cmd_generate(args):
+    results = Results()
+    created, seconds = timed(generate_library, os.path.abspath(args.library),
+                             args.files, args.seconds, args.seed)
+    results.add("generate", seconds, created)
+    results.save(args.json)
+
+
+# --- run ---
+def cmd_run(args):
+    library = os.path.abspath(args.library)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="watchdog_bench_"))
+    print(f"work dir: {workdir}")
+    # worker_loop replaces files - run it on a copy
+    copy = os.path.join(workdir, "library")
+    shutil.rmtree(copy, ignore_errors=True)
+    shutil.copytree(library, copy)
+    overrides = {"ENCODE_SETTINGS": {"preset": args.preset}}
+    if args.workers > 1:
+        overrides.update({"PARALLEL_PROCESSING": True, "ENCODE_WORKERS": args.workers})
+    watchdog = load_watchdog(workdir, bench_config(copy, overrides))
+    quiet_logging(args.verbose)
+    from watchdog_core import get_video_info, estimate_hevc_size, scan_video_files
+    results = Results()
+
+    files, _, _ = scan_video_files(copy)
+    videos = [path for path, _ in files]
+    total_gb = sum(st.st_size for _, st in files) / (1024**3)
+    print(f"library: {len(videos)} files, {total_gb:.2f} GB")
+
+    # scan_folder: cold (empty probe cache / scan index) then warm
+    watchdog.init_workers()
+    candidates, seconds = timed(watchdog.scan_folder, copy)
+    results.add("scan_folder (cold)", seconds, len(videos), candidates=len(candidates))
+    watchdog.state['processed_files'].clear()
+    _, seconds = timed(watchdog.scan_folder, copy)
+    results.add("scan_folder (warm)", seconds, len(videos))
+    watchdog.state['processed_files'].clear()
+
+    latencies = []
+    infos = []
+    for path in videos:
+        info, seconds = timed(get_video_info, path)
+        infos.append((path, info or {}))
+        latencies.append(seconds)
+    results.add("get_video_info", sum(latencies), len(videos),
+                p50_ms=round(percentile(latencies, 50) * 1000, 1),
+                p95_ms=round(percentile(latencies, 95) * 1000, 1))
+
+    rounds = 100
+
+    def estimate_all():
+        for _ in range(rounds):
+            for path, info in infos:
+                estimate_hevc_size(path, info.get("codec", ""), info, watchdog.state['compression_model'])
+    _, seconds = timed(estimate_all)
+    results.add("estimate_hevc_size", seconds, len(infos) * rounds, unit="calls")
+
+    # End-to-end: worker_loop scans the copy and encodes up to --encode files
+    if args.encode:
+        encodable = sorted(path for path, info in infos if info.get("codec") not in ("hevc", "h265", "av1"))
+        keep = set(encodable[:args.encode])
+        for path in videos:
+            if path not in keep:
+                watchdog.state['processed_files'].add(path)
+        source_gb = sum(os.path.getsize(p) for p in keep) / (1024**3)
+        for schedule in watchdog.scan_schedule.values():
+            schedule["last_scan"] = 0
+        processed_before = watchdog.state['stats']['processed']
+        batch_done = BatchDone()
+        logging.getLogger().addHandler(batch_done)
+        started = time.perf_counter()
+        threading.Thread(target=watchdog.worker_loop, daemon=True).start()
+        finished = batch_done.event.wait(args.timeout)
+        seconds = time.perf_counter() - started
+        done = watchdog.state['stats']['processed'] - processed_before
+        results.add("worker_loop end-to-end", seconds, len(keep), encoded=done,
+                    gb_per_hour=round(source_gb / seconds * 3600, 3) if seconds > 0 else None,
+                    timed_out=not finished)
+    results.save(args.json)
+
+
+# --- simulate ---
+def create_fake_library(library, files, per_dir, size_gb, seed):
+    """Sparse files in nested dirs, codec tag in the name for the fake ffprobe"""
+    rng = random.Random(seed)
+    tags = ["h264"] * 6 + ["mpeg2video", "mpeg4", "hevc", "av1"]
+    exts = [".mkv", ".mkv", ".mp4", ".avi"]
+    for i in range(files):
+        directory = os.path.join(library, f"d{i // (per_dir * per_dir):04d}", f"d{(i // per_dir) % per_dir:04d}")
+        if i % per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"file {i:07d} [{rng.choice(tags)}]{rng.choice(exts)}")
+        with open(path, 'wb') as f:
+            f.truncate(int(rng.uniform(size_gb[0], size_gb[1]) * 1024**3))
+
+
+def install_fake_binaries(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in (("ffprobe", FAKE_FFPROBE), ("ffmpeg", FAKE_FFMPEG)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+def cmd_simulate(args):
+    if os.name == 'nt':
+        sys.exit("simulate needs a POSIX shell for the stand-in binaries")
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="watchdog_sim_"))
+    print(f"work dir: {workdir}")
+    install_fake_binaries(os.path.join(workdir, "bin"))
+    library = os.path.join(workdir, "library")
+    results = Results()
+
+    if not os.path.isdir(library):
+        _, seconds = timed(create_fake_library, library, args.files, args.per_dir,
+                           (args.min_gb, args.max_gb), args.seed)
+        results.add("create fake files", seconds, args.files)
+
+    watchdog = load_watchdog(workdir, bench_config(library, {
+        "PROBE_WORKERS": args.probe_workers,
+        "PARALLEL_PROCESSING": args.workers > 1,
+        "ENCODE_WORKERS": args.workers,
+        "CHECK_OPEN_WRITERS": False,       # /proc walk per job would dominate the measurement
+        "FREE_SPACE_HEADROOM_GB": -1e9,    # Sparse fake outputs use no real space
+    }))
+    quiet_logging(args.verbose)
+    from watchdog_core import load_processed_files
+    watchdog.init_workers()
+
+    candidates, seconds = timed(watchdog.scan_folder, library)
+    results.add("scan_folder (cold)", seconds, args.files, candidates=len(candidates))
+    skipped = set(watchdog.state['processed_files'])
+    _, seconds = timed(watchdog.scan_folder, library)
+    results.add("scan_folder (warm)", seconds, args.files)
+
+    folder_config = watchdog.CONFIG["SOURCE_DIRS"][0]
+
+    def queue_all():
+        for candidate in candidates:
+            watchdog.queue_candidate(folder_config, candidate)
+    _, seconds = timed(queue_all)
+    results.add("queue_candidate", seconds, len(candidates), unit="jobs")
+    _, seconds = timed(watchdog.job_queue.snapshot)
+    results.add("queue snapshot", seconds, len(candidates), unit="jobs")
+
+    # Encode the first --encode jobs through the real worker path (fake ffmpeg)
+    pending = []
+    while not watchdog.job_queue.empty():
+        pending.append(watchdog.job_queue.get_nowait())
+        watchdog.job_queue.task_done()
+    watchdog.queued_files.clear()
+    encode = pending[:args.encode]
+    for candidate in encode:
+        watchdog.queue_candidate(folder_config, candidate)
+    started = time.perf_counter()
+    for worker in watchdog.state['workers']:
+        threading.Thread(target=watchdog.encode_worker, args=(worker['id'],), daemon=True).start()
+    watchdog.job_queue.join()
+    results.add("encode_worker (fake ffmpeg)", time.perf_counter() - started, len(encode), unit="jobs",
+                processed=watchdog.state['stats']['processed'])
+
+    # State persistence at library scale
+    journal = watchdog.journal
+    marked = [candidate[0] for candidate in pending[args.encode:]]
+
+    def mark_all():
+        for path in marked:
+            journal.add_processed(path)
+        journal.flush()
+    _, seconds = timed(mark_all)
+    results.add("journal add+flush", seconds, len(marked))
+    _, seconds = timed(journal.compact)
+    results.add("journal compact", seconds, len(watchdog.state['processed_files']))
+    loaded, seconds = timed(load_processed_files, watchdog.CONFIG["PROCESSED_FILES"])
+    results.add("load_processed_files", seconds, len(loaded),
+                file_mb=round(os.path.getsize(watchdog.CONFIG["PROCESSED_FILES"]) / 1024**2, 1))
+    print(f"skipped during scan: {len(skipped)}")
+    results.save(args.json)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("generate", help="create a synthetic media library with FFmpeg")
+    p.add_argument("library")
+    p.add_argument("--files", type=int, default=40)
+    p.add_argument("--seconds", type=int, default=10, help="typical clip length")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_generate)
+
+    p = sub.add_parser("run", help="time scan/probe/estimate and end-to-end encodes on a library")
+    p.add_argument("library")
+    p.add_argument("--encode", type=int, default=5, help="files to encode end-to-end (0 = skip)")
+    p.add_argument("--preset", default="ultrafast", help="x265 preset for the end-to-end encodes")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--timeout", type=int, default=3600)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("simulate", help="offline load test with fake ffprobe/ffmpeg and sparse files")
+    p.add_argument("--files", type=int, default=100000)
+    p.add_argument("--per-dir", type=int, default=100, help="files per directory (and dirs per level)")
+    p.add_argument("--min-gb", type=float, default=0.5)
+    p.add_argument("--max-gb", type=float, default=8.0)
+    p.add_argument("--encode", type=int, default=1000, help="jobs to run through encode_worker")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--probe-workers", type=int, default=16)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_simulate)
+
+    for name, p in sub.choices.items():
+        if name != "generate":
+            p.add_argument("--workdir", help="work directory (default: new temp dir)")
+            p.add_argument("--verbose", action="store_true", help="keep watchdog INFO logging")
+        p.add_argument("--json", help="write results as JSON to this file")
+
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,30 @@ import subprocess
 import logging
 import platform
 import signal
+import sqlite3
+import threading
+import time
+import heapq
+import hashlib
+import math
+import shutil
+import ctypes
+import ctypes.util
+import struct
+import re
+from collections import deque, namedtuple
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi')
+
+# Per-source temp directory (created inside a source folder); never scanned or watched
+SOURCE_TEMP_DIR = ".watchdog_temp"
+
+# Minimal stat record (what the scanner and probe cache need from os.stat)
+FileStat = namedtuple('FileStat', ['st_size', 'st_mtime_ns', 'st_ino'])
+
+SKIP_REASONS = ("av1", "hevc", "vp9", "too_small", "sample", "verify")
 
 def load_stats(stats_file):
     stats = {
@@ -13,12 +37,7 @@ def load_stats(stats_file):
         "gb_saved": 0.0,
         "files_skipped": 0,
         "gb_skipped": 0.0,
-        "skip_reasons": {
-            "av1": 0,
-            "hevc": 0,
-            "vp9": 0,
-            "too_small": 0
-        }
+        "skip_reasons": {reason: 0 for reason in SKIP_REASONS}
     }
     if os.path.exists(stats_file):
         try:
@@ -26,17 +45,27 @@ def load_stats(stats_file):
                 loaded = json.load(f)
                 # Merge with defaults (backward compatible)
                 stats.update(loaded)
-                # Ensure skip_reasons exists
-                if "skip_reasons" not in stats:
-                    stats["skip_reasons"] = {"av1": 0, "hevc": 0, "vp9": 0, "too_small": 0}
+                # Ensure skip_reasons has every category (older files lack newer ones)
+                if not isinstance(stats.get("skip_reasons"), dict):
+                    stats["skip_reasons"] = {}
+                for reason in SKIP_REASONS:
+                    stats["skip_reasons"].setdefault(reason, 0)
         except:
             pass
     return stats
 
+def _atomic_write_json(path, data, indent=None):
+    """Write JSON to temp file, fsync, then rename over target (no torn files on crash)"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
 def save_stats(stats_file, stats):
     try:
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats, f)
+        _atomic_write_json(stats_file, stats)
     except:
         pass
 
@@ -49,22 +78,484 @@ def push_kuma(kuma_url):
 
 def get_video_codec(filepath):
     """Get video codec using ffprobe (cross-platform)"""
+    info = get_video_info(filepath)
+    return info["codec"] if info else None
+
+def is_gpu_codec(codec):
+    return "nvenc" in codec or "qsv" in codec or "amf" in codec
+
+def build_encode_cmd(input_file, output_file, enc, threads=0, start=None, length=None,
+                     video_only=False):
+    """
+    Build FFmpeg transcode command from ENCODE_SETTINGS.
+    threads > 0 limits decoder threads (-threads) and the x265 thread pool (pools=N)
+    so several encodes can share one machine.
+    start/length (seconds) encode only a time range; video_only maps just the
+    first video stream (used for chunks - audio/subs are muxed in at concat).
+    """
+    codec = enc["codec"]
+    is_gpu = is_gpu_codec(codec)
+    
+    # Machine-readable progress on stdout (key=value blocks), no human stats line
+    cmd = ["ffmpeg", "-nostats", "-progress", "pipe:1"]
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    if start:
+        cmd.extend(["-ss", f"{start:.3f}"])  # Input seek (accurate when re-encoding)
+    cmd.extend(["-i", input_file])
+    if length:
+        cmd.extend(["-t", f"{length:.3f}"])
+    cmd.extend(["-c:v", codec])
+    
+    # GPU encoders use different parameter names
+    if is_gpu:
+        # GPU encoding (NVIDIA/Intel/AMD)
+        if "nvenc" in codec:
+            # NVIDIA NVENC
+            cmd.extend(["-cq", str(enc["crf"])])  # CQ for NVENC
+            cmd.extend(["-preset", enc["preset"]])  # p1-p7 for NVENC
+            if enc.get("gpu_device") is not None:
+                cmd.extend(["-gpu", str(enc["gpu_device"])])
+        elif "qsv" in codec:
+            # Intel Quick Sync
+            cmd.extend(["-global_quality", str(enc["crf"])])
+            cmd.extend(["-preset", enc["preset"]])
+        elif "amf" in codec:
+            # AMD AMF
+            cmd.extend(["-qp", str(enc["crf"])])
+            cmd.extend(["-quality", enc["preset"]])
+    else:
+        # CPU encoding (libx265/libx264)
+        cmd.extend(["-crf", str(enc["crf"])])
+        cmd.extend(["-preset", enc["preset"]])
+    
+    # Common parameters
+    if video_only:
+        cmd.extend(["-map", "0:v:0", "-an", "-sn"])
+    else:
+        cmd.extend(["-c:a", "copy", "-c:s", "copy", "-map", "0"])
+    cmd.extend(["-max_muxing_queue_size", "1024"])
+    
+    # Add x265-specific params if specified (CPU only)
+    x265_params = enc.get("x265_params") if not is_gpu else None
+    if threads and not is_gpu and codec == "libx265":
+        x265_params = ":".join(p for p in [x265_params, f"pools={threads}"] if p)
+    elif threads and not is_gpu:
+        cmd.extend(["-threads", str(threads)])
+    if x265_params:
+        cmd.extend(["-x265-params", x265_params])
+    
+    cmd.extend(["-y", output_file])
+    return cmd
+
+# Keys emitted by ffmpeg -progress (one key=value per line, block ends with "progress=")
+PROGRESS_KEYS = {"frame", "fps", "bitrate", "total_size", "out_time_us", "out_time_ms",
+                 "out_time", "dup_frames", "drop_frames", "speed", "progress"}
+
+def parse_progress_line(line, progress):
+    """
+    Parse one line of ffmpeg -progress output into the progress dict.
+    Keeps: frame, fps, bitrate_kbps, total_size (bytes), out_time (seconds), speed (x realtime).
+    Returns the key that was parsed, or None if the line is not a progress line
+    (e.g. a warning/error merged from stderr).
+    """
+    key, sep, value = line.strip().partition("=")
+    if not sep or key not in PROGRESS_KEYS:
+        return None
+    value = value.strip()
     try:
-        cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", 
-               "-show_entries", "stream=codec_name", 
-               "-of", "default=noprint_wrappers=1:nokey=1", filepath]
+        if key == "frame":
+            progress["frame"] = int(value)
+        elif key == "fps":
+            progress["fps"] = float(value)
+        elif key == "bitrate":
+            # "1234.5kbits/s" or "N/A"
+            progress["bitrate_kbps"] = float(value.replace("kbits/s", ""))
+        elif key == "total_size":
+            progress["total_size"] = int(value)
+        elif key in ("out_time_us", "out_time_ms"):
+            # Both are microseconds (out_time_ms is misnamed in ffmpeg)
+            progress["out_time"] = max(0.0, int(value) / 1e6)
+        elif key == "speed":
+            progress["speed"] = float(value.rstrip("x"))
+        elif key == "progress":
+            progress["state"] = value  # "continue" or "end"
+    except ValueError:
+        pass  # "N/A" values early in the encode
+    return key
+
+def estimate_remaining_seconds(progress, duration, elapsed):
+    """
+    Remaining encode time from ffmpeg progress and known source duration.
+    Uses reported speed, falling back to average rate so far. None if unknown.
+    """
+    out_time = progress.get("out_time", 0)
+    if not duration or out_time <= 0:
+        return None
+    remaining_media = max(0.0, duration - out_time)
+    speed = progress.get("speed", 0)
+    if speed > 0:
+        return remaining_media / speed
+    if elapsed > 0:
+        return remaining_media * elapsed / out_time
+    return None
+
+def build_concat_cmd(list_file, source_file, output_file):
+    """
+    Join encoded video chunks (concat demuxer, stream copy) and take every
+    non-video stream, chapters and metadata from the source.
+    """
+    return [
+        "ffmpeg", "-nostats", "-progress", "pipe:1",
+        "-f", "concat", "-safe", "0", "-i", list_file,
+        "-i", source_file,
+        "-map", "0:v:0", "-map", "1", "-map", "-1:v",
+        "-map_metadata", "1", "-map_chapters", "1",
+        "-c", "copy", "-max_muxing_queue_size", "1024",
+        "-y", output_file
+    ]
+
+def ffmpeg_popen_kwargs(cpu_set=None, nice=0):
+    """
+    Cross-platform Popen kwargs for FFmpeg: merged text output, own process group
+    (Linux) for clean kill, optional CPU pinning (Linux sched_setaffinity) and
+    lower CPU priority (nice; Windows priority class).
+    """
+    popen_kwargs = {
+        'stdout': subprocess.PIPE,
+        'stderr': subprocess.STDOUT,
+        'text': True,
+        'encoding': 'utf-8',
+        'errors': 'replace'
+    }
+    if platform.system() == 'Windows':
+        popen_kwargs['creationflags'] = 0x08000000 | _priority_class(nice)  # CREATE_NO_WINDOW
+    elif hasattr(os, 'setpgrp'):
+        # Linux: create new process group for easier cleanup
+        def _setup():
+            os.setpgrp()
+            if nice > 0:
+                os.nice(nice)
+            if cpu_set and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpu_set)
+        popen_kwargs['preexec_fn'] = _setup
+    return popen_kwargs
+
+def _priority_class(nice):
+    """Windows priority class for a nice value (IDLE at 19, BELOW_NORMAL above 0)"""
+    if nice >= 19:
+        return 0x00000040  # IDLE_PRIORITY_CLASS
+    return 0x00004000 if nice > 0 else 0  # BELOW_NORMAL_PRIORITY_CLASS
+
+IONICE_CLASSES = {"best-effort": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]}
+
+def with_io_priority(cmd, ionice=""):
+    """
+    Prefix cmd with util-linux `ionice` ("best-effort" = lowest best-effort level,
+    "idle" = only when the disk is otherwise idle). Unchanged where unavailable.
+    """
+    if ionice not in IONICE_CLASSES or platform.system() != 'Linux' or not shutil.which("ionice"):
+        return cmd
+    return ["ionice"] + IONICE_CLASSES[ionice] + cmd
+
+def split_cpu_budget(workers, cpu_budget=0):
+    """
+    Split CPU budget across encode workers.
+    Returns (threads_per_worker, [cpu_set per worker]) - cpu sets are contiguous
+    slices of the CPUs this process may run on (for optional pinning).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    budget = min(cpu_budget, len(cpus)) if cpu_budget and cpu_budget > 0 else len(cpus)
+    workers = max(1, workers)
+    threads = max(1, budget // workers)
+    cpu_sets = []
+    for i in range(workers):
+        chunk = cpus[(i * threads) % len(cpus):][:threads]
+        cpu_sets.append(set(chunk or cpus[:threads]))
+    return threads, cpu_sets
+
+# --- METRICS (Prometheus text exposition, no client library needed) ---
+class Histogram:
+    """Thread-safe cumulative histogram, optionally split by one label"""
+    
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., count, sum]
+    
+    def observe(self, value, label_value=""):
+        with self._lock:
+            series = self._series.setdefault(label_value, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            labels = f'{self.label}="{metric_label(label_value)}",' if self.label else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {values[-2]}')
+            suffix = "{" + labels.rstrip(",") + "}" if labels else ""
+            lines.append(f"{self.name}_count{suffix} {values[-2]}")
+            lines.append(f"{self.name}_sum{suffix} {values[-1]:g}")
+        return lines
+
+def metric_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metric(name, metric_type, help_text, samples):
+    """Counter/gauge lines; samples is a list of (labels dict, value)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{k}="{metric_label(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+    return lines
+
+FFPROBE_SECONDS = Histogram("watchdog_ffprobe_seconds", "FFprobe call latency",
+                            [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15])
+
+def _parse_frame_rate(rate):
+    """Parse ffprobe rational frame rate ("24000/1001") to float"""
+    try:
+        num, _, den = rate.partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return 0.0
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _stream_duration(stream):
+    """Video stream duration in seconds: "duration", else the Matroska DURATION tag ("00:42:10.125000000")"""
+    duration = _to_float(stream.get("duration"))
+    if duration:
+        return duration
+    tag = (stream.get("tags") or {}).get("DURATION", "")
+    try:
+        hours, minutes, seconds = tag.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+def _bit_depth(stream):
+    """Bits per sample from bits_per_raw_sample, else from pix_fmt (yuv420p10le -> 10)"""
+    try:
+        return int(stream["bits_per_raw_sample"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    pix_fmt = stream.get("pix_fmt") or ""
+    for depth in (16, 14, 12, 10, 9):
+        if f"p{depth}" in pix_fmt:
+            return depth
+    return 8 if pix_fmt else 0
+
+def _hdr_format(stream):
+    """"Dolby Vision", "HDR10", "HLG" or "" (SDR / unknown)"""
+    side_data = [d.get("side_data_type", "") for d in stream.get("side_data_list") or []]
+    if any("DOVI" in d or "Dolby Vision" in d for d in side_data):
+        return "Dolby Vision"
+    transfer = stream.get("color_transfer") or ""
+    if transfer == "smpte2084":
+        return "HDR10"
+    if transfer == "arib-std-b67":
+        return "HLG"
+    return ""
+
+def parse_probe(data):
+    """
+    Compact metadata record from ffprobe -show_streams -show_format JSON.
+    Video fields describe the first real video stream (cover art is ignored);
+    bitrate_kbps is the container bitrate, video_duration the video stream's own
+    length (audio or subtitles may run longer) and vfr is set when the stream's
+    frame rate varies (r_frame_rate != avg_frame_rate, e.g. soft telecine).
+    Returns None if there is no video stream.
+    """
+    streams = data.get("streams") or []
+    video = [s for s in streams if s.get("codec_type") == "video"
+             and not (s.get("disposition") or {}).get("attached_pic")]
+    if not video:
+        return None
+    stream = video[0]
+    fmt = data.get("format") or {}
+    # r_frame_rate is the timebase guess (e.g. 90000/1 for some MP4s); avg_frame_rate is real
+    fps = _parse_frame_rate(stream.get("avg_frame_rate"))
+    base_fps = _parse_frame_rate(stream.get("r_frame_rate"))
+    vfr = bool(fps and base_fps and abs(fps - base_fps) > 0.01)
+    if not 0 < fps <= 240:
+        fps = base_fps
+    return {
+        "codec": stream.get("codec_name", ""),
+        "profile": stream.get("profile", ""),
+        "bit_depth": _bit_depth(stream),
+        "pix_fmt": stream.get("pix_fmt", ""),
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "fps": fps,
+        "duration": _to_float(fmt.get("duration")) or _to_float(stream.get("duration")),
+        "video_duration": _stream_duration(stream),
+        "vfr": vfr,
+        "bitrate_kbps": _to_float(fmt.get("bit_rate")) / 1000,
+        "hdr": _hdr_format(stream),
+        "audio_streams": sum(1 for s in streams if s.get("codec_type") == "audio"),
+        "subtitle_streams": sum(1 for s in streams if s.get("codec_type") == "subtitle")
+    }
+
+def get_video_info(filepath):
+    """
+    Probe a file once (ffprobe -show_streams -show_format) and return its
+    metadata record (see parse_probe), or None on failure.
+    """
+    try:
+        cmd = ["ffprobe", "-v", "error", "-show_streams", "-show_format",
+               "-of", "json", filepath]
         
-        # Windows-specific flag to prevent console window
         kwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 
                   'text': True, 'timeout': 15}
         if platform.system() == 'Windows':
             kwargs['creationflags'] = 0x08000000  # CREATE_NO_WINDOW
         
-        result = subprocess.run(cmd, **kwargs)
-        return result.stdout.strip()
+        started = time.time()
+        try:
+            result = subprocess.run(cmd, **kwargs)
+        finally:
+            FFPROBE_SECONDS.observe(time.time() - started)
+        return parse_probe(json.loads(result.stdout or "{}"))
     except:
         return None
 
+def describe_video(info):
+    """Short description for log lines: "1920x1080, 10-bit, HDR10" """
+    info = info or {}
+    parts = []
+    if info.get("width") and info.get("height"):
+        parts.append(f"{info['width']}x{info['height']}")
+    if info.get("bit_depth", 8) > 8:
+        parts.append(f"{info['bit_depth']}-bit")
+    if info.get("hdr"):
+        parts.append(info["hdr"])
+    return ", ".join(parts)
+
+def predict_encode_hours(info, size_gb, mpixels_per_sec):
+    """
+    Predict encode wall time (hours) from resolution, frame rate and duration.
+    mpixels_per_sec is the encoder throughput in megapixels/second.
+    Falls back to file size when stream info is missing.
+    """
+    width = info.get("width") or 0
+    height = info.get("height") or 0
+    duration = info.get("duration") or 0
+    if width and height and duration and mpixels_per_sec > 0:
+        fps = info.get("fps") or 24.0
+        pixels = width * height * fps * duration
+        return pixels / (mpixels_per_sec * 1e6) / 3600
+    # No stream info: assume ~4 Mbps source (≈0.5 h of video per GB) encoded at ~1x realtime
+    return size_gb * 0.5
+
+def run_ffmpeg(cmd, progress, check_interrupt, cpu_set=None, on_progress=None, on_start=None,
+               suspend_on_pause=False, pause_kill_seconds=0, on_suspend=None, nice=0, ionice=""):
+    """
+    Run FFmpeg, parsing -progress output into the `progress` dict.
+    check_interrupt() is polled for every output line; when it returns a reason
+    (e.g. "skip", "pause") the process tree is killed.
+    With suspend_on_pause (Linux/macOS), "pause" suspends the process group
+    instead (SIGSTOP) and resumes it (SIGCONT) once check_interrupt() clears;
+    a pause longer than pause_kill_seconds (0 = never) falls back to killing.
+    Other output (warnings/errors) is logged. nice/ionice lower FFmpeg's CPU and
+    disk priority.
+    Returns (returncode, reason) - reason is None when FFmpeg ran to completion.
+    """
+    logger = logging.getLogger()
+    process = subprocess.Popen(with_io_priority(cmd, ionice), **ffmpeg_popen_kwargs(cpu_set, nice))
+    if on_start:
+        on_start(process)
+    can_suspend = suspend_on_pause and platform.system() != 'Windows'
+    
+    reason = None
+    for line in process.stdout:
+        reason = check_interrupt()
+        if reason == "pause" and can_suspend:
+            reason = _suspend_while_paused(process, check_interrupt, pause_kill_seconds, on_suspend)
+        if reason:
+            logger.info(f"{reason.capitalize()} requested - stopping FFmpeg (PID: {process.pid})...")
+            kill_process_tree(process.pid)
+            resume_process_tree(process.pid)  # Stopped processes only die once continued
+            break
+        
+        # -progress key=value lines update live state; anything else is FFmpeg output
+        key = parse_progress_line(line, progress)
+        if key == "progress" and on_progress:
+            on_progress()
+        elif key is None:
+            clean_line = line.strip()
+            if clean_line:
+                logger.info(f"FFmpeg: {clean_line}")
+    
+    process.wait() # Wait for the process to complete
+    return process.returncode, reason
+
+def _suspend_while_paused(process, check_interrupt, pause_kill_seconds, on_suspend):
+    """
+    SIGSTOP the FFmpeg process group until check_interrupt() stops returning "pause".
+    Returns None when resumed, or the reason to kill ("skip", or "pause" on timeout).
+    """
+    logger = logging.getLogger()
+    if not suspend_process_tree(process.pid):
+        return "pause"
+    logger.info(f"Paused - FFmpeg suspended (PID: {process.pid})")
+    if on_suspend:
+        on_suspend(True)
+    
+    suspended_at = time.time()
+    reason = "pause"
+    while reason == "pause":
+        if pause_kill_seconds and time.time() - suspended_at >= pause_kill_seconds:
+            logger.info(f"Pause exceeded {pause_kill_seconds / 60:.0f} min - giving up on this encode")
+            break
+        time.sleep(1)
+        reason = check_interrupt()
+    
+    if reason is None:
+        resume_process_tree(process.pid)
+        logger.info(f"Resumed - FFmpeg continued (PID: {process.pid})")
+    if on_suspend:
+        on_suspend(False)
+    return reason
+
+def suspend_process_tree(pid):
+    """Suspend process group with SIGSTOP (Linux/macOS). Returns True on success"""
+    if platform.system() == 'Windows':
+        return False
+    try:
+        os.killpg(os.getpgid(pid), signal.SIGSTOP)
+        return True
+    except:
+        return False
+
+def resume_process_tree(pid):
+    """Resume process group suspended with SIGSTOP"""
+    if platform.system() == 'Windows':
+        return
+    try:
+        os.killpg(os.getpgid(pid), signal.SIGCONT)
+    except:
+        pass
+
 def kill_process_tree(pid):
     """Kill process tree (cross-platform)"""
     try:
@@ -82,82 +573,1624 @@ def kill_process_tree(pid):
     except:
         pass
 
+# --- FILE STABILITY ---
+def file_quiet_for(filepath, quiet_seconds, observed):
+    """
+    True once file size and mtime have not changed for quiet_seconds.
+    An mtime older than quiet_seconds counts as quiet immediately; otherwise the
+    (size, mtime) seen first is remembered in `observed` (path -> (key, since))
+    and the file is quiet once that observation has held for quiet_seconds
+    (covers clock skew on network shares). Raises OSError if the file is gone.
+    """
+    st = os.stat(filepath)
+    now = time.time()
+    key = (st.st_size, st.st_mtime_ns)
+    if now - st.st_mtime >= quiet_seconds:
+        observed.pop(filepath, None)
+        return True
+    previous = observed.get(filepath)
+    if previous is None or previous[0] != key:
+        observed[filepath] = (key, now)
+        return False
+    if now - previous[1] >= quiet_seconds:
+        observed.pop(filepath, None)
+        return True
+    return False
+
+def open_writers(filepath):
+    """
+    PIDs of processes holding filepath open for writing (Linux, via /proc/*/fd).
+    Processes we may not inspect are ignored. Returns [] on other platforms.
+    """
+    if platform.system() != 'Linux':
+        return []
+    target = os.path.realpath(filepath)
+    writers = []
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return []
+    for pid in pids:
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue  # Exited or not ours to inspect
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) != target:
+                    continue
+                with open(f"/proc/{pid}/fdinfo/{fd}", 'r') as f:
+                    flags = next((int(line.split()[1], 8) for line in f if line.startswith("flags:")), 0)
+            except (OSError, ValueError):
+                continue
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                writers.append(int(pid))
+                break
+    return writers
+
+def tail_lines(log_file, n=120, block_size=64 * 1024):
+    """
+    Last n lines of a file, read backwards in blocks from the end - cost depends
+    on n, not on the file size. Returns list of lines without line endings.
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # n lines need n+1 newlines unless the start of the file is reached
+        while position > 0 and data.count(b"\n") <= n:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    return lines[-n:] if n else []
+
 def get_last_logs(log_file, n=120):
     if not os.path.exists(log_file):
         return ""
     try:
-        with open(log_file, "r", encoding='utf-8') as f:
-            lines = f.readlines()
-            return "".join(lines[-n:])
+        return "\n".join(tail_lines(log_file, n)) + "\n"
     except:
         return "Błąd odczytu logów..."
 
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` formatted log records in memory (for dashboard/API)"""
+    
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self._lines = deque(maxlen=capacity)
+    
+    def seed(self, lines):
+        """Pre-fill with older lines (e.g. tail of the log file after a restart)"""
+        self.acquire()
+        try:
+            self._lines.extend(lines)
+        finally:
+            self.release()
+    
+    def emit(self, record):
+        try:
+            self._lines.append(self.format(record))  # Called with the handler lock held
+        except Exception:
+            self.handleError(record)
+    
+    def lines(self, n=None):
+        """Most recent n lines (all if n is None), oldest first"""
+        self.acquire()
+        try:
+            lines = list(self._lines)
+        finally:
+            self.release()
+        return lines[-n:] if n else lines
+
+def dict_diff(old, new):
+    """
+    Changed part of `new` relative to `old` (for pushing state updates).
+    Nested dicts are diffed recursively, removed keys map to None and any other
+    changed value (lists included) is sent whole. Empty dict = no change.
+    """
+    diff = {}
+    for key, value in new.items():
+        if key not in old:
+            diff[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub = dict_diff(old[key], value)
+            if sub:
+                diff[key] = sub
+        elif old[key] != value:
+            diff[key] = value
+    for key in old:
+        if key not in new:
+            diff[key] = None
+    return diff
+
 def load_processed_files(processed_file):
-    """Load list of already processed files"""
+    """Load list of already processed files (snapshot + journal replay)"""
+    processed = set()
     if os.path.exists(processed_file):
         try:
             with open(processed_file, 'r', encoding='utf-8') as f:
-                return set(json.load(f))
+                processed = set(json.load(f))
         except:
-            return set()
-    return set()
+            processed = set()
+    processed.update(read_journal(processed_file + ".journal"))
+    return processed
 
 def save_processed_files(processed_file, processed_set):
     """Save list of processed files"""
     try:
-        with open(processed_file, 'w', encoding='utf-8') as f:
-            json.dump(list(processed_set), f, indent=2)
+        _atomic_write_json(processed_file, list(processed_set), indent=2)
+    except:
+        pass
+
+def read_journal(journal_file):
+    """Read paths from append-only journal (one JSON string per line, torn last line ignored)"""
+    paths = []
+    if not os.path.exists(journal_file):
+        return paths
+    try:
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    paths.append(json.loads(line))
+                except ValueError:
+                    continue  # Partial write from a crash
     except:
         pass
+    return paths
+
+class WriteBehindJournal:
+    """
+    Write-behind persistence for processed_files.json and stats.json.
+    
+    New processed paths are appended to <processed_file>.journal in batches
+    (every `flush_count` entries or `flush_interval` seconds) instead of
+    rewriting the whole list for every file. Once the journal grows past
+    `compact_lines` it is folded into a fresh snapshot (atomic rename) and
+    truncated. Stats are written atomically on the same schedule.
+    """
+    
+    def __init__(self, processed_file, stats_file, processed_set, stats,
+                 flush_interval=10, flush_count=200, compact_lines=5000):
+        self.processed_file = processed_file
+        self.journal_file = processed_file + ".journal"
+        self.stats_file = stats_file
+        self.processed = processed_set
+        self.stats = stats
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self.compact_lines = compact_lines
+        self._lock = threading.RLock()
+        self._pending = []
+        self._stats_dirty = False
+        self._journal_lines = len(read_journal(self.journal_file))
+        self._stop = threading.Event()
+        
+        # Fold leftovers from previous run into the snapshot
+        if self._journal_lines:
+            self.compact()
+    
+    def start(self):
+        """Start background timer flush"""
+        t = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        t.start()
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+    
+    def add_processed(self, path):
+        """Mark file as processed (persisted on next flush)"""
+        with self._lock:
+            if path in self.processed:
+                return
+            self.processed.add(path)
+            self._pending.append(path)
+            if len(self._pending) >= self.flush_count:
+                self.flush()
+    
+    def stats_changed(self):
+        """Mark stats as dirty (persisted on next flush)"""
+        with self._lock:
+            self._stats_dirty = True
+    
+    def flush(self):
+        """Append pending paths to journal and write stats if changed"""
+        with self._lock:
+            if self._pending:
+                try:
+                    with open(self.journal_file, 'a', encoding='utf-8') as f:
+                        for path in self._pending:
+                            f.write(json.dumps(path) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._journal_lines += len(self._pending)
+                    self._pending = []
+                except Exception as e:
+                    logging.getLogger().warning(f"Journal write failed (will retry): {e}")
+            
+            if self._stats_dirty:
+                try:
+                    _atomic_write_json(self.stats_file, self.stats)
+                    self._stats_dirty = False
+                except Exception:
+                    pass  # Retry on next flush
+            
+            if self._journal_lines >= self.compact_lines:
+                self.compact()
+    
+    def compact(self):
+        """Write full snapshot atomically, then truncate journal"""
+        with self._lock:
+            try:
+                _atomic_write_json(self.processed_file, list(self.processed), indent=2)
+                # Pending entries are in the snapshot now
+                self._pending = []
+                # Crash before truncate is harmless: replay is idempotent
+                with open(self.journal_file, 'w', encoding='utf-8'):
+                    pass
+                self._journal_lines = 0
+            except Exception as e:
+                logging.getLogger().warning(f"Journal compaction failed: {e}")
+    
+    def close(self):
+        """Stop timer and flush everything"""
+        self._stop.set()
+        self.flush()
+
+# Compression ratios (estimated output size as % of input)
+# Values >1.0 = conversion would increase size (skip these!)
+# Used as-is until enough encode history exists, then as the prior for the learned model.
+DEFAULT_COMPRESSION_RATIOS = {
+    # Already efficient - DON'T convert
+    'hevc': 1.00,       # Already HEVC
+    'h265': 1.00,       # Already HEVC
+    'av1': 1.15,        # AV1 better than HEVC - conversion = worse quality + bigger
+    'vp9': 0.95,        # VP9 comparable to HEVC - minimal benefit
+    
+    # Old/inefficient - GOOD candidates
+    'mpeg2': 0.25,      # DVD/old broadcasts - huge savings
+    'mpeg4': 0.50,      # DivX/XviD era
+    'xvid': 0.50,
+    'vc1': 0.50,        # WMV/VC-1 (Blu-ray, old Xbox)
+    'vp8': 0.60,        # Old YouTube
+    
+    # H.264 - depends on source quality (conservative estimate)
+    'h264': 0.55,       # Assumes decent quality source (CRF 18-23)
+    'avc': 0.55,        # High-CRF H.264 (28+) may not save space!
+}
+DEFAULT_RATIO = 0.60  # Conservative default for unknown codecs
 
-def estimate_hevc_size(filepath, codec):
+def estimate_hevc_size(filepath, codec, info=None, model=None, min_savings=0.5, size_bytes=None):
     """
     Estimate potential file size after HEVC conversion.
     Returns (estimated_size_gb, worth_converting: bool)
     
-    Compression ratios based on real-world testing:
+    Ratios come from the learned compression model (see fit_compression_model)
+    when it has data for the codec, otherwise from DEFAULT_COMPRESSION_RATIOS:
     - Modern codecs (AV1, VP9, HEVC) = DON'T convert (already efficient or better)
     - Old codecs (MPEG2, VC1) = Large savings
     - H.264 = Moderate savings (depends on source quality)
     
-    Note: Ratios assume CRF 26 output. High-CRF sources (28+) may not save space.
+    Note: Table ratios assume CRF 26 output. High-CRF sources (28+) may not save space.
     """
     try:
-        original_size = os.path.getsize(filepath) / (1024**3)  # GB
+        if size_bytes is None:
+            size_bytes = os.path.getsize(filepath)
+        original_size = size_bytes / (1024**3)  # GB
         
-        # Compression ratios (estimated output size as % of input)
-        # Values >1.0 = conversion would increase size (skip these!)
-        compression_ratios = {
-            # Already efficient - DON'T convert
-            'hevc': 1.00,       # Already HEVC
-            'h265': 1.00,       # Already HEVC
-            'av1': 1.15,        # AV1 better than HEVC - conversion = worse quality + bigger
-            'vp9': 0.95,        # VP9 comparable to HEVC - minimal benefit
-            
-            # Old/inefficient - GOOD candidates
-            'mpeg2': 0.25,      # DVD/old broadcasts - huge savings
-            'mpeg4': 0.50,      # DivX/XviD era
-            'xvid': 0.50,
-            'vc1': 0.50,        # WMV/VC-1 (Blu-ray, old Xbox)
-            'vp8': 0.60,        # Old YouTube
-            
-            # H.264 - depends on source quality (conservative estimate)
-            'h264': 0.55,       # Assumes decent quality source (CRF 18-23)
-            'avc': 0.55,        # High-CRF H.264 (28+) may not save space!
-        }
-        
-        ratio = compression_ratios.get(codec.lower(), 0.60)  # Conservative default
+        codec = codec.lower()
+        table_ratio = DEFAULT_COMPRESSION_RATIOS.get(codec, DEFAULT_RATIO)
+        bpp = source_features(info or {}, size_bytes)["bpp"]
+        ratio = predict_ratio(model or {}, codec, bpp)
         estimated_size = original_size * ratio
         
         # Only worth converting if we save at least MIN_SAVINGS_GB
-        min_savings = 0.5  # GB (configurable via CONFIG)
         potential_savings = original_size - estimated_size
         
         # Don't convert if ratio >= 0.95 (less than 5% savings)
-        if ratio >= 0.95:
+        if ratio >= 0.95 or table_ratio >= 0.95:
             return estimated_size, False
         
         return estimated_size, potential_savings >= min_savings
         
     except:
-        return 0, True  # If estimation fails, proceed with conversion
\ No newline at end of file
+        return 0, True  # If estimation fails, proceed with conversion
+
+# --- COMPRESSION MODEL ---
+# Learned from finished encodes: per source codec, output/input ratio regressed on
+# log(bits per pixel) and shrunk toward the static table while data is scarce.
+MODEL_PRIOR_WEIGHT = 3    # Table ratio counts as this many samples
+MODEL_MIN_SLOPE_SAMPLES = 8  # Samples needed before fitting the bpp slope
+MODEL_HOLDOUT = 20          # Accuracy report: newest encodes kept out of the fit
+
+def source_features(info, size_bytes):
+    """Source bitrate (kbps) and bits per pixel from stream info and file size"""
+    duration = info.get("duration") or 0
+    pixels_per_sec = (info.get("width") or 0) * (info.get("height") or 0) * (info.get("fps") or 0)
+    bitrate_kbps = size_bytes * 8 / duration / 1000 if duration else 0.0
+    bpp = bitrate_kbps * 1000 / pixels_per_sec if pixels_per_sec else 0.0
+    return {"bitrate_kbps": bitrate_kbps, "bpp": bpp}
+
+def load_encode_history(history_file):
+    """Load finished-encode records (JSON lines)"""
+    return read_journal(history_file)
+
+def append_encode_history(history_file, record):
+    """Append one finished-encode record"""
+    try:
+        with open(history_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    except:
+        pass
+
+def usable_history(history):
+    """(codec, record) for every well-formed history record, in file order"""
+    usable = []
+    for record in history:
+        try:
+            if record["size_gb"] > 0 and record["actual_gb"] > 0:
+                usable.append((record["codec"].lower(), record))
+        except (KeyError, TypeError, AttributeError):
+            continue
+    return usable
+
+def fit_compression_model(history):
+    """
+    Fit per-codec compression model from encode history records.
+    Returns {codec: {"n", "mean_ratio", "slope", "x_mean"}}; predicted ratio is
+    mean_ratio + slope * (ln(bpp) - x_mean).
+    """
+    by_codec = {}
+    for codec, record in usable_history(history):
+        by_codec.setdefault(codec, []).append(record)
+    
+    model = {}
+    for codec, records in by_codec.items():
+        ratios = [r["actual_gb"] / r["size_gb"] for r in records]
+        n = len(ratios)
+        prior = DEFAULT_COMPRESSION_RATIOS.get(codec, DEFAULT_RATIO)
+        mean_ratio = (sum(ratios) + MODEL_PRIOR_WEIGHT * prior) / (n + MODEL_PRIOR_WEIGHT)
+        
+        slope, x_mean = 0.0, 0.0
+        points = [(math.log(r["bpp"]), y) for r, y in zip(records, ratios) if r.get("bpp", 0) > 0]
+        if len(points) >= MODEL_MIN_SLOPE_SAMPLES:
+            x_mean = sum(x for x, _ in points) / len(points)
+            y_mean = sum(y for _, y in points) / len(points)
+            sxx = sum((x - x_mean) ** 2 for x, _ in points)
+            if sxx > 1e-6:
+                slope = sum((x - x_mean) * (y - y_mean) for x, y in points) / sxx
+        model[codec] = {"n": n, "mean_ratio": mean_ratio, "slope": slope, "x_mean": x_mean}
+    return model
+
+def predict_ratio(model, codec, bpp):
+    """Predicted output/input size ratio for a source codec and bits per pixel"""
+    entry = model.get(codec.lower())
+    if not entry:
+        return DEFAULT_COMPRESSION_RATIOS.get(codec.lower(), DEFAULT_RATIO)
+    ratio = entry["mean_ratio"]
+    if entry["slope"] and bpp > 0:
+        ratio += entry["slope"] * (math.log(bpp) - entry["x_mean"])
+    return min(1.5, max(0.05, ratio))
+
+def model_accuracy_report(history, holdout=MODEL_HOLDOUT):
+    """
+    Compare static table vs learned model on the recorded encodes.
+    The model is refitted without the newest `holdout` encodes and scored on them;
+    with too little history it is scored on its own training data (labelled in-sample).
+    Returns list of report lines (mean absolute error of predicted output size, GB).
+    """
+    usable = usable_history(history)
+    if len(usable) >= 2 * holdout:
+        train, test = usable[:-holdout], usable[-holdout:]
+        lines = [f"held-out check on the newest {holdout} encodes:"]
+    else:
+        train, test = usable, usable
+        lines = ["in-sample check (too few encodes to hold any out):"]
+    model = fit_compression_model(record for _, record in train)
+    by_codec = {}
+    for codec, record in test:
+        by_codec.setdefault(codec, []).append(record)
+    for codec, records in sorted(by_codec.items()):
+        table_ratio = DEFAULT_COMPRESSION_RATIOS.get(codec, DEFAULT_RATIO)
+        table_err = sum(abs(r["size_gb"] * table_ratio - r["actual_gb"]) for r in records) / len(records)
+        model_err = sum(abs(r["size_gb"] * predict_ratio(model, codec, r.get("bpp", 0)) - r["actual_gb"])
+                        for r in records) / len(records)
+        ratio = model[codec]["mean_ratio"] if codec in model else table_ratio
+        lines.append(f"{codec}: n={len(records)}, table error {table_err:.2f} GB, "
+                     f"model error {model_err:.2f} GB (ratio {ratio:.2f})")
+    return lines
+
+# --- PROBE CACHE ---
+# ffprobe results keyed by (path, size, mtime_ns, inode) so unchanged files are
+# never probed twice. Any change to the file invalidates its entry.
+_probe_cache_lock = threading.Lock()
+PROBE_CACHE_VERSION = 5  # Bump when the cached info format changes (cache is rebuilt)
+
+def open_probe_cache(cache_file):
+    """Open (or create) the SQLite probe cache. Returns connection or None"""
+    try:
+        conn = sqlite3.connect(cache_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != PROBE_CACHE_VERSION:
+            conn.execute("DROP TABLE IF EXISTS probes")
+            conn.execute(f"PRAGMA user_version = {PROBE_CACHE_VERSION}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                info TEXT NOT NULL,
+                probed_at REAL NOT NULL
+            )""")
+        conn.commit()
+        return conn
+    except Exception as e:
+        logging.getLogger().warning(f"Probe cache disabled ({cache_file}): {e}")
+        return None
+
+def probe_cache_get(conn, filepath, st):
+    """Return cached stream info dict if file is unchanged, else None"""
+    if conn is None:
+        return None
+    try:
+        with _probe_cache_lock:
+            row = conn.execute(
+                "SELECT size, mtime_ns, inode, info "
+                "FROM probes WHERE path = ?", (filepath,)).fetchone()
+    except:
+        return None
+    if row is None:
+        return None
+    size, mtime_ns, inode, info = row
+    if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+        return None  # File changed since last probe
+    try:
+        return json.loads(info)
+    except ValueError:
+        return None
+
+def probe_cache_put(conn, filepath, st, info):
+    """Store probe result for file (replaces any stale entry)"""
+    if conn is None:
+        return
+    try:
+        with _probe_cache_lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO probes "
+                "(path, size, mtime_ns, inode, info, probed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (filepath, st.st_size, st.st_mtime_ns, st.st_ino, json.dumps(info), time.time()))
+            conn.commit()
+    except:
+        pass
+
+def probe_cache_entries(conn):
+    """All cached (path, info) pairs (may include files that changed since)"""
+    if conn is None:
+        return []
+    try:
+        with _probe_cache_lock:
+            rows = conn.execute("SELECT path, info FROM probes").fetchall()
+    except:
+        return []
+    entries = []
+    for path, info in rows:
+        try:
+            entries.append((path, json.loads(info)))
+        except ValueError:
+            continue
+    return entries
+
+def probe_video(conn, filepath, st, model=None, min_savings=0.5):
+    """
+    Get codec, stream info and size estimate for a file, using the probe cache when possible.
+    Returns (codec, estimated_size_gb, worth_converting: bool, info: dict).
+    Only the probe is cached - the estimate is recomputed (cheap) so it follows
+    the compression model as it learns. Failed probes are not cached
+    (NAS timeouts are usually transient).
+    """
+    info = probe_cache_get(conn, filepath, st)
+    if info is None:
+        info = get_video_info(filepath)
+        if not info or not info.get("codec"):
+            return None, 0, False, {}
+        probe_cache_put(conn, filepath, st, info)
+    
+    codec = info["codec"]
+    estimated_size, worth_it = estimate_hevc_size(filepath, codec, info, model, min_savings,
+                                                  size_bytes=st.st_size)
+    return codec, estimated_size, worth_it, info
+
+# --- JOB STORE ---
+JOB_STATES = ("pending", "running", "done", "failed", "skipped")
+
+class JobStore:
+    """
+    Durable job queue state (SQLite): one row per queued file with its probe
+    result and state (pending/running/done/failed/skipped), the last scan time
+    of each folder, failed verifications and the coordinator's leases to remote workers. Lets a
+    restart resume the queue without rescanning or losing remote encodes.
+    All methods are no-ops if the database can't be opened.
+    """
+    
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.conn = None
+        try:
+            conn = sqlite3.connect(db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    codec TEXT NOT NULL,
+                    estimated_gb REAL NOT NULL,
+                    info TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    queued_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    folder TEXT PRIMARY KEY,
+                    last_scan REAL NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS failures (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    count INTEGER NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    job_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    worker TEXT NOT NULL,
+                    claimed_at REAL NOT NULL
+                )""")
+            conn.commit()
+            self.conn = conn
+        except Exception as e:
+            logging.getLogger().warning(f"Job store disabled ({db_file}): {e}")
+    
+    def _execute(self, sql, params=(), fetch=False):
+        if self.conn is None:
+            return []
+        try:
+            with self.lock:
+                rows = self.conn.execute(sql, params).fetchall() if fetch else self.conn.execute(sql, params)
+                if not fetch:
+                    self.conn.commit()
+                return rows
+        except sqlite3.Error as e:
+            logging.getLogger().warning(f"Job store error: {e}")
+            return []
+    
+    def put(self, path, folder, codec, estimated_gb, info, st):
+        """Record a queued job (pending); re-queueing keeps its attempt count"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (path, folder, codec, estimated_gb, info, size, mtime_ns, state, queued_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET folder = excluded.folder, codec = excluded.codec, "
+            "estimated_gb = excluded.estimated_gb, info = excluded.info, size = excluded.size, "
+            "mtime_ns = excluded.mtime_ns, state = 'pending', message = '', updated_at = excluded.updated_at",
+            (path, folder, codec, estimated_gb, json.dumps(info or {}), st.st_size, st.st_mtime_ns, now, now))
+    
+    def set_state(self, path, state, message=""):
+        """Move a job to another state (entering "running" counts an attempt)"""
+        self._execute(
+            "UPDATE jobs SET state = ?, message = ?, updated_at = ?, "
+            "attempts = attempts + (CASE WHEN ? = 'running' THEN 1 ELSE 0 END) WHERE path = ?",
+            (state, message, time.time(), state, path))
+    
+    def remove(self, path):
+        self._execute("DELETE FROM jobs WHERE path = ?", (path,))
+    
+    def unfinished(self):
+        """Pending and running jobs, oldest first, as dicts"""
+        rows = self._execute(
+            "SELECT path, folder, codec, estimated_gb, info, size, mtime_ns, state "
+            "FROM jobs WHERE state IN ('pending', 'running') ORDER BY queued_at", fetch=True)
+        jobs = []
+        for path, folder, codec, estimated_gb, info, size, mtime_ns, state in rows:
+            try:
+                info = json.loads(info)
+            except ValueError:
+                info = {}
+            jobs.append({"path": path, "folder": folder, "codec": codec, "estimated_gb": estimated_gb,
+                         "info": info, "size": size, "mtime_ns": mtime_ns, "state": state})
+        return jobs
+    
+    def counts(self):
+        """{state: number of jobs} for every state"""
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for state, n in self._execute("SELECT state, COUNT(*) FROM jobs GROUP BY state", fetch=True):
+            counts[state] = n
+        return counts
+    
+    def last_scans(self):
+        """{folder: last scan time}"""
+        return dict(self._execute("SELECT folder, last_scan FROM scans", fetch=True))
+    
+    def save_scan(self, folder, last_scan):
+        self._execute("INSERT OR REPLACE INTO scans (folder, last_scan) VALUES (?, ?)", (folder, last_scan))
+    
+    def add_failure(self, path, st):
+        """Count a failed verification of this version of the file (size, mtime). Returns the count"""
+        self._execute(
+            "INSERT INTO failures (path, size, mtime_ns, count) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT(path) DO UPDATE SET count = CASE WHEN size = excluded.size AND "
+            "mtime_ns = excluded.mtime_ns THEN count + 1 ELSE 1 END, "
+            "size = excluded.size, mtime_ns = excluded.mtime_ns",
+            (path, st.st_size, st.st_mtime_ns))
+        rows = self._execute("SELECT count FROM failures WHERE path = ?", (path,), fetch=True)
+        return rows[0][0] if rows else 0
+    
+    def save_lease(self, job_id, path, worker, claimed_at):
+        self._execute("INSERT OR REPLACE INTO leases (job_id, path, worker, claimed_at) VALUES (?, ?, ?, ?)",
+                      (job_id, path, worker, claimed_at))
+    
+    def drop_lease(self, job_id):
+        self._execute("DELETE FROM leases WHERE job_id = ?", (job_id,))
+    
+    def leases(self):
+        """Leases held by remote workers, as dicts"""
+        rows = self._execute("SELECT job_id, path, worker, claimed_at FROM leases", fetch=True)
+        return [{"job_id": job_id, "path": path, "worker": worker, "claimed_at": claimed_at}
+                for job_id, path, worker, claimed_at in rows]
+
+def recover_interrupted_replace(file_path):
+    """
+    Undo a file replacement cut short by a crash. A leftover .tmp_replace may be
+    a partial copy, so the original wins whenever it still exists; a leftover
+    .backup is always the complete original. Returns what was done, or None.
+    """
+    temp_replace = file_path + ".tmp_replace"
+    backup_path = file_path + ".backup"
+    if os.path.exists(backup_path):
+        os.replace(backup_path, file_path)
+        if os.path.exists(temp_replace):
+            os.remove(temp_replace)
+        return "restored original from .backup"
+    if os.path.exists(temp_replace):
+        if os.path.exists(file_path):
+            os.remove(temp_replace)
+            return "removed partial .tmp_replace"
+        os.replace(temp_replace, file_path)
+        return "completed replace from .tmp_replace"
+    return None
+
+def clean_temp_dir(temp_dir, output_suffix, keep_sources=()):
+    """
+    Remove encode leftovers from a temp directory: outputs (*output_suffix),
+    sample/calibration clips and chunk checkpoints - except chunk dirs whose
+    source is in keep_sources (they resume). Returns number of entries removed.
+    """
+    removed = 0
+    try:
+        entries = list(os.scandir(temp_dir))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.name.endswith(output_suffix):
+                os.remove(entry.path)
+            elif entry.is_dir() and entry.name in ("samples", "calibration"):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.is_dir() and entry.name.endswith(".chunks"):
+                try:
+                    with open(os.path.join(entry.path, "manifest.json"), 'r', encoding='utf-8') as f:
+                        source = json.load(f).get("source")
+                except (OSError, ValueError):
+                    source = None
+                if source in keep_sources:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                continue
+            removed += 1
+        except OSError:
+            continue
+    return removed
+
+# --- INCREMENTAL SCANNER ---
+def load_scan_index(index_file):
+    """Load directory index {root: {dirpath: {mtime_ns, dirs, files}}}"""
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            return {}
+    return {}
+
+def save_scan_index(index_file, index):
+    """Save directory index (atomic: write temp file, then rename)"""
+    tmp_file = index_file + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, index_file)
+    except:
+        pass
+
+def _is_scan_target(name, extra_suffix):
+    return name.lower().endswith(VIDEO_EXTENSIONS) or (extra_suffix and name.endswith(extra_suffix))
+
+def scan_video_files(root, dir_index=None, extra_suffix=None):
+    """
+    Walk root with os.scandir, reusing DirEntry stat data.
+    Returns (files, new_dir_index, dirs_listed):
+    - files: list of (path, FileStat) for video files (and files ending with extra_suffix)
+    - new_dir_index: {dirpath: {"mtime_ns", "dirs", "files"}} for this root
+    - dirs_listed: how many directories actually had to be read
+    
+    Directories whose mtime matches dir_index are not listed again - their cached
+    file names are reused and only their subdirectories are checked. Directory
+    mtime changes when entries are added, removed or renamed, but not when a file
+    is rewritten in place, so cached files are still stat'ed (much cheaper than
+    listing the directory on a network share).
+    """
+    dir_index = dir_index or {}
+    new_index = {}
+    files = []
+    dirs_listed = 0
+    stack = [root]
+    
+    while stack:
+        dirpath = stack.pop()
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        
+        cached = dir_index.get(dirpath)
+        if cached is None or cached.get("mtime_ns") != mtime_ns:
+            subdirs = []
+            entries = []
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name != SOURCE_TEMP_DIR:
+                                    subdirs.append(entry.name)
+                            elif entry.is_file() and _is_scan_target(entry.name, extra_suffix):
+                                st = entry.stat()
+                                entries.append([entry.name, st.st_size, st.st_mtime_ns, st.st_ino])
+                        except OSError:
+                            continue  # Entry vanished or unreadable
+            except OSError as e:
+                logging.getLogger().warning(f"Cannot list {dirpath}: {e}")
+                continue
+            cached = {"mtime_ns": mtime_ns, "dirs": subdirs, "files": entries}
+            dirs_listed += 1
+        else:
+            # Same names, but sizes/mtimes may have changed (appended or rewritten in place)
+            entries = []
+            for name, *_ in cached["files"]:
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue  # Gone since the listing
+                entries.append([name, st.st_size, st.st_mtime_ns, st.st_ino])
+            cached = dict(cached, files=entries)
+        
+        new_index[dirpath] = cached
+        for name, size, file_mtime_ns, inode in cached["files"]:
+            files.append((os.path.join(dirpath, name), FileStat(size, file_mtime_ns, inode)))
+        for name in cached["dirs"]:
+            stack.append(os.path.join(dirpath, name))
+    
+    return files, new_index, dirs_listed
+
+
+# --- SCHEDULER ---
+class FairPriorityQueue(Queue):
+    """
+    Job queue ordered by priority within each folder, with weighted fairness
+    between folders (start-time fair queuing).
+    
+    Each folder has a virtual time that advances by encode_hours / weight
+    whenever one of its jobs is taken; the next job always comes from the
+    non-empty folder with the lowest virtual time. A heavily weighted or busy
+    folder therefore can't starve the others. Within a folder, jobs with the
+    highest score (e.g. GB saved per encode hour) go first.
+    
+    Use put_job(); get() returns the job item as passed in.
+    """
+    
+    def _init(self, maxsize):
+        self._lanes = {}      # folder -> heap of (-score, seq, hours, item)
+        self._vtime = {}      # folder -> virtual time
+        self._weights = {}    # folder -> weight
+        self._seq = 0
+    
+    def _qsize(self):
+        return sum(len(lane) for lane in self._lanes.values())
+    
+    def _put(self, entry):
+        folder, weight, score, hours, item = entry
+        lane = self._lanes.setdefault(folder, [])
+        if not lane:
+            # Folder (re)joins: don't let it bank credit from idle time
+            active = [self._vtime[f] for f, l in self._lanes.items() if l and f != folder]
+            self._vtime[folder] = max(self._vtime.get(folder, 0.0), min(active, default=0.0))
+        self._weights[folder] = weight if weight and weight > 0 else 1.0
+        self._seq += 1
+        heapq.heappush(lane, (-score, self._seq, hours, item))
+    
+    def _get(self):
+        folder = min((f for f, lane in self._lanes.items() if lane),
+                     key=lambda f: (self._vtime[f], f))
+        _, _, hours, item = heapq.heappop(self._lanes[folder])
+        self._vtime[folder] += max(hours, 0.0) / self._weights[folder]
+        return item
+    
+    def put_job(self, item, folder="", weight=1.0, score=0.0, hours=0.0):
+        """Queue item in folder lane with given priority score and predicted cost"""
+        self.put((folder, weight, score, hours, item))
+    
+    def snapshot(self):
+        """Pending items in approximate dispatch order (for dashboard/API)"""
+        with self.mutex:
+            lanes = {f: sorted(lane) for f, lane in self._lanes.items() if lane}
+            vtime = dict(self._vtime)
+            weights = dict(self._weights)
+        order = []
+        while lanes:
+            folder = min(lanes, key=lambda f: (vtime[f], f))
+            _, _, hours, item = lanes[folder].pop(0)
+            vtime[folder] += max(hours, 0.0) / weights[folder]
+            order.append(item)
+            if not lanes[folder]:
+                del lanes[folder]
+        return order
+
+
+# --- CHUNKED ENCODING ---
+def plan_chunks(temp_folder, source_file, st, duration, chunk_seconds, settings):
+    """
+    Prepare checkpoint directory for a chunked encode.
+    Returns (chunk_dir, [(index, start, length, chunk_path), ...]); length is None
+    for the last chunk (runs to end of file). Finished chunks already on disk are
+    kept when source file, chunk length and encode settings match the manifest -
+    otherwise the directory is reset.
+    """
+    key = hashlib.sha1(source_file.encode('utf-8')).hexdigest()[:8]
+    chunk_dir = os.path.join(temp_folder, f"{os.path.basename(source_file)}.{key}.chunks")
+    manifest_file = os.path.join(chunk_dir, "manifest.json")
+    manifest = {
+        "source": source_file,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "chunk_seconds": chunk_seconds,
+        "settings": settings
+    }
+    
+    existing = None
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+        except:
+            existing = None
+    if existing != manifest:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        os.makedirs(chunk_dir, exist_ok=True)
+        _atomic_write_json(manifest_file, manifest)
+    
+    count = max(1, int(math.ceil(duration / chunk_seconds)))
+    chunks = []
+    for i in range(count):
+        start = i * chunk_seconds
+        length = chunk_seconds if i < count - 1 else None
+        chunks.append((i, start, length, os.path.join(chunk_dir, f"chunk_{i:04d}.mkv")))
+    return chunk_dir, chunks
+
+def write_concat_list(list_file, chunk_paths):
+    """Write concat demuxer list (paths quoted for the demuxer)"""
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+# --- OUTPUT VERIFICATION ---
+def plan_verify_segments(duration, count, seconds):
+    """
+    Start times for `count` decode checks of `seconds`, spread from the start to
+    the very end of the file (a truncated tail is the most common corruption).
+    """
+    if count < 1 or seconds <= 0:
+        return []
+    if not duration or duration <= seconds:
+        return [0.0]
+    last = duration - seconds
+    if count == 1:
+        return [last]
+    return [i * last / (count - 1) for i in range(count)]
+
+def decode_segment(filepath, start, seconds, fps=0, threads=0, nice=0, ionice=""):
+    """
+    Decode one segment of the first video stream to nowhere (-f null).
+    Returns None if it decoded cleanly, else a description of the problem.
+    """
+    cmd = ["ffmpeg", "-v", "error", "-nostats", "-progress", "pipe:1"]
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    cmd.extend(["-ss", f"{start:.3f}", "-i", filepath, "-t", f"{seconds:.3f}",
+                "-map", "0:v:0", "-f", "null", "-"])
+    kwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 'text': True,
+              'encoding': 'utf-8', 'errors': 'replace', 'timeout': max(120, seconds * 20)}
+    if platform.system() == 'Windows':
+        kwargs['creationflags'] = 0x08000000 | _priority_class(nice)  # CREATE_NO_WINDOW
+    elif nice > 0:
+        kwargs['preexec_fn'] = lambda: os.nice(nice)
+    try:
+        result = subprocess.run(with_io_priority(cmd, ionice), **kwargs)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return f"decode at {start:.0f}s: {e}"
+    
+    progress = {}
+    for line in result.stdout.splitlines():
+        parse_progress_line(line, progress)
+    errors = [line for line in result.stderr.splitlines() if line.strip()]
+    if result.returncode != 0 or errors:
+        detail = errors[0] if errors else f"exit code {result.returncode}"
+        return f"decode at {start:.0f}s: {detail}"
+    if fps and progress.get("frame", 0) < seconds * fps * 0.9:
+        return f"decode at {start:.0f}s: {progress.get('frame', 0)} frames, expected {seconds * fps:.0f}"
+    return None
+
+def verify_output(source_info, output_file, samples=4, seconds=5, duration_tolerance=2.0, threads=0,
+                  nice=0, ionice=""):
+    """
+    Check an encode before it replaces the source: the output must probe as HEVC
+    with the source's duration (+- duration_tolerance seconds) and the same number
+    of audio and subtitle streams, and `samples` segments of `seconds` spread
+    across its video stream (including the end) must decode without errors.
+    Segments are decoded in parallel, sharing `threads` (0 = all CPUs). The
+    frame count of a segment is only checked for constant frame rate video.
+    Returns list of problems (empty = OK).
+    """
+    source_info = source_info or {}
+    output_info = get_video_info(output_file)
+    if not output_info:
+        return ["output has no readable video stream"]
+    
+    problems = []
+    if output_info["codec"] not in ("hevc", "h265"):
+        problems.append(f"output video is {output_info['codec']}, not HEVC")
+    source_duration = source_info.get("duration") or 0
+    if source_duration and abs(output_info["duration"] - source_duration) > duration_tolerance:
+        problems.append(f"duration {output_info['duration']:.1f}s, source {source_duration:.1f}s")
+    for key, label in (("audio_streams", "audio"), ("subtitle_streams", "subtitle")):
+        if key in source_info and output_info[key] != source_info[key]:
+            problems.append(f"{output_info[key]} {label} streams, source {source_info[key]}")
+    if problems:
+        return problems  # No point decoding a file that is already rejected
+    
+    # Audio/subtitles can outlast the video: the last segment must end where the video does
+    video_duration = output_info.get("video_duration") or output_info["duration"]
+    starts = plan_verify_segments(video_duration, samples, seconds)
+    if starts:
+        length = min(seconds, video_duration) if video_duration else seconds
+        fps = 0 if output_info.get("vfr") else output_info["fps"]
+        # Segments share the worker's threads instead of each taking all of them
+        segment_threads = max(1, (threads or os.cpu_count() or 1) // len(starts))
+        with ThreadPoolExecutor(max_workers=len(starts), thread_name_prefix="verify") as pool:
+            results = pool.map(lambda start: decode_segment(output_file, start, length, fps,
+                                                            segment_threads, nice, ionice), starts)
+            problems.extend(r for r in results if r)
+    return problems
+
+# --- SAMPLE PRE-CHECK ---
+def plan_samples(duration, count, seconds):
+    """
+    Start times for `count` clips of `seconds` spread evenly across the file
+    (clip i sits in the middle of the i-th equal slice, avoiding intro/credits).
+    Returns [] when the file is too short for sampling to be worthwhile.
+    """
+    if count < 1 or seconds <= 0 or duration < count * seconds * 3:
+        return []
+    slice_len = duration / count
+    return [i * slice_len + (slice_len - seconds) / 2 for i in range(count)]
+
+def sample_encode(input_file, sample_dir, enc, duration, size_bytes, count=3, seconds=20,
+                  threads=0, cpu_set=None, check_interrupt=None, nice=0, ionice=""):
+    """
+    Encode a few short clips with the real encode settings and extrapolate.
+    Returns {"estimated_gb", "ratio", "speed"} (speed = media seconds per wall
+    second) or None if the file is too short, a clip failed or sampling was
+    interrupted.
+    """
+    starts = plan_samples(duration, count, seconds)
+    if not starts:
+        return None
+    
+    os.makedirs(sample_dir, exist_ok=True)
+    key = hashlib.sha1(input_file.encode('utf-8')).hexdigest()[:8]
+    out_bytes = 0
+    wall = 0.0
+    try:
+        for i, start in enumerate(starts):
+            clip = os.path.join(sample_dir, f"sample_{key}_{i}.mkv")
+            cmd = build_encode_cmd(input_file, clip, enc, threads=threads,
+                                   start=start, length=seconds)
+            began = time.time()
+            returncode, reason = run_ffmpeg(cmd, {}, check_interrupt or (lambda: None),
+                                            cpu_set=cpu_set, nice=nice, ionice=ionice)
+            wall += time.time() - began
+            if reason or returncode != 0 or not os.path.exists(clip):
+                return None
+            out_bytes += os.path.getsize(clip)
+            os.remove(clip)
+    finally:
+        for i in range(len(starts)):
+            clip = os.path.join(sample_dir, f"sample_{key}_{i}.mkv")
+            if os.path.exists(clip):
+                os.remove(clip)
+    
+    sampled = len(starts) * seconds
+    estimated_bytes = out_bytes / sampled * duration
+    return {
+        "estimated_gb": estimated_bytes / (1024**3),
+        "ratio": estimated_bytes / size_bytes if size_bytes else 1.0,
+        "speed": sampled / wall if wall > 0 else 0.0
+    }
+
+
+# --- PRESET CALIBRATION ---
+# libx265 presets, fastest first
+X265_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast",
+                "medium", "slow", "slower", "veryslow")
+
+def calibrate_encoder(input_file, info, work_dir, enc, presets, crfs, seconds=30,
+                      target_gb_per_day=0, threads=0, check_interrupt=None, on_result=None):
+    """
+    Encode a clip from the middle of input_file with each preset/CRF and measure
+    throughput. Presets are tried fastest first; once a preset misses
+    target_gb_per_day at every CRF, slower ones are not tried (they would miss it too).
+    Returns list of {"preset", "crf", "fps", "speed", "mpixels_per_sec",
+    "gb_per_day", "ratio"} or None if an encode failed or was interrupted.
+    gb_per_day is source GB (at the clip's bitrate) encoded per day; ratio is
+    output/source size.
+    """
+    duration = info.get("duration") or 0
+    bitrate_kbps = info.get("bitrate_kbps") or 0
+    if not bitrate_kbps and duration:
+        bitrate_kbps = os.path.getsize(input_file) * 8 / duration / 1000
+    if duration < seconds or not bitrate_kbps:
+        return None
+    start = (duration - seconds) / 2
+    pixels_per_sec = (info.get("width") or 0) * (info.get("height") or 0) * (info.get("fps") or 0)
+    source_bytes = bitrate_kbps * 1000 / 8 * seconds
+    
+    os.makedirs(work_dir, exist_ok=True)
+    clip = os.path.join(work_dir, "calibration.mkv")
+    results = []
+    try:
+        for preset in sorted(presets, key=lambda p: X265_PRESETS.index(p) if p in X265_PRESETS else len(X265_PRESETS)):
+            fast_enough = False
+            for crf in crfs:
+                settings = dict(enc, preset=preset, crf=crf)
+                cmd = build_encode_cmd(input_file, clip, settings, threads=threads,
+                                       start=start, length=seconds, video_only=True)
+                began = time.time()
+                returncode, reason = run_ffmpeg(cmd, {}, check_interrupt or (lambda: None))
+                wall = time.time() - began
+                if reason or returncode != 0 or not os.path.exists(clip) or wall <= 0:
+                    return None
+                speed = seconds / wall
+                result = {
+                    "preset": preset,
+                    "crf": crf,
+                    "fps": round(speed * (info.get("fps") or 0), 2),
+                    "speed": round(speed, 3),
+                    "mpixels_per_sec": round(speed * pixels_per_sec / 1e6, 2),
+                    "gb_per_day": round(speed * source_bytes / seconds * 86400 / (1024**3), 1),
+                    "ratio": round(os.path.getsize(clip) / source_bytes, 3)
+                }
+                os.remove(clip)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+                fast_enough = fast_enough or result["gb_per_day"] >= target_gb_per_day
+            if target_gb_per_day and not fast_enough:
+                break
+    finally:
+        if os.path.exists(clip):
+            os.remove(clip)
+    return results
+
+def choose_preset(results, crf, target_gb_per_day):
+    """
+    Slowest preset (best compression) that still meets target_gb_per_day at the
+    calibrated CRF closest to crf; the fastest one if none does.
+    Returns a calibration result dict or None.
+    """
+    if not results:
+        return None
+    nearest = min({r["crf"] for r in results}, key=lambda c: abs(c - crf))
+    at_crf = [r for r in results if r["crf"] == nearest]
+    order = lambda r: X265_PRESETS.index(r["preset"]) if r["preset"] in X265_PRESETS else -1
+    meeting = [r for r in at_crf if r["gb_per_day"] >= target_gb_per_day]
+    if meeting:
+        return max(meeting, key=order)
+    return max(at_crf, key=lambda r: r["gb_per_day"])
+
+def host_fingerprint(enc, threads=0):
+    """Identifies the machine/encoder a calibration is valid for"""
+    return {
+        "host": platform.node(),
+        "cpus": os.cpu_count() or 1,
+        "threads": threads,
+        "encoder": enc["codec"]
+    }
+
+def load_host_profile(profile_file, fingerprint):
+    """Load calibrated host profile; None if missing or made on another host/encoder"""
+    try:
+        with open(profile_file, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        if profile.get("fingerprint") == fingerprint and profile.get("preset"):
+            return profile
+    except:
+        pass
+    return None
+
+def save_host_profile(profile_file, profile):
+    """Save host profile (atomic: write temp file, then rename)"""
+    tmp_file = profile_file + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+        os.replace(tmp_file, profile_file)
+    except:
+        pass
+
+
+# --- FOLDER WATCHER (inotify) ---
+# Filesystems where inotify only sees local changes (remote writes are invisible)
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph",
+                       "glusterfs", "lustre", "davfs", "sshfs", "virtiofs"}
+
+def filesystem_type(path):
+    """Filesystem type of the mount containing path (from /proc/mounts), or "" if unknown"""
+    try:
+        path = os.path.realpath(path)
+        best, fstype = "", ""
+        with open("/proc/mounts", 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+                if inside and len(mount) >= len(best):
+                    best, fstype = mount, fields[2]
+        return fstype
+    except:
+        return ""
+
+def is_network_filesystem(path):
+    fstype = filesystem_type(path)
+    return fstype in NETWORK_FILESYSTEMS or fstype.startswith("fuse.")
+
+# --- LOAD POLICY ---
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def read_pressure(resource):
+    """
+    Linux PSI: "some avg10" of /proc/pressure/<resource> (cpu, io) - % of the last
+    10 s in which at least one task was waiting. None if unavailable.
+    """
+    try:
+        with open(f"/proc/pressure/{resource}", 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith("some "):
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition("=")
+                        if key == "avg10":
+                            return float(value)
+    except:
+        pass
+    return None
+
+def system_load():
+    """1-minute load average per CPU and PSI cpu/io pressure (None where unavailable)"""
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        load = None
+    return {"load": load, "cpu": read_pressure("cpu"), "io": read_pressure("io")}
+
+def _clock_minutes(text):
+    """"HH:MM" -> minutes since midnight ("24:00" allowed)"""
+    hours, _, minutes = str(text).partition(":")
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(f"invalid time {text!r}")
+    return value
+
+def active_window(windows, now=None):
+    """
+    First window {"start": "HH:MM", "end": "HH:MM", "days": ["mon", ...]} containing
+    `now` (local time; default current time), or None. A window ending before it
+    starts crosses midnight - its days are the days it starts on. No days = every day.
+    Raises ValueError for a malformed window.
+    """
+    t = time.localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    for window in windows:
+        start, end = _clock_minutes(window.get("start", "")), _clock_minutes(window.get("end", ""))
+        days = set()
+        for day in window.get("days") or WEEKDAYS:
+            if str(day).lower()[:3] not in WEEKDAYS:
+                raise ValueError(f"invalid day {day!r}")
+            days.add(WEEKDAYS.index(str(day).lower()[:3]))
+        if start <= end:
+            inside = start <= minute < end and t.tm_wday in days
+        else:
+            inside = ((minute >= start and t.tm_wday in days)
+                      or (minute < end and (t.tm_wday - 1) % 7 in days))
+        if inside:
+            return window
+    return None
+
+class InotifyWatcher:
+    """
+    Recursive inotify watcher (Linux, libc via ctypes).
+    Video files that are created, written, moved in or closed after writing are
+    collected per watched root; drain() hands them out once they have been quiet
+    for a few seconds (every write restarts that timer, so a slow copy is not
+    handed out half-written). A kernel queue overflow marks the root for a full rescan.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len (name follows)
+    
+    def __init__(self, extensions=VIDEO_EXTENSIONS):
+        self.extensions = extensions
+        self._lock = threading.Lock()
+        self._watches = {}   # wd -> (root, directory)
+        self._pending = {}   # path -> (root, last event time)
+        self._overflow = False
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._thread = threading.Thread(target=self._read_loop, name="inotify", daemon=True)
+    
+    @staticmethod
+    def available():
+        """inotify usable on this platform"""
+        if platform.system() != 'Linux':
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+            return hasattr(libc, "inotify_init1")
+        except OSError:
+            return False
+    
+    def start(self):
+        self._thread.start()
+    
+    def _add_watch(self, root, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}", directory)
+        with self._lock:
+            self._watches[wd] = (root, directory)
+    
+    def add_tree(self, root, directory=None):
+        """
+        Watch directory (default: root) and all subdirectories.
+        Returns video files already present (relevant for directories moved in).
+        Raises OSError when a watch can't be added (e.g. max_user_watches reached).
+        """
+        found = []
+        stack = [directory or root]
+        while stack:
+            current = stack.pop()
+            self._add_watch(root, current)
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name != SOURCE_TEMP_DIR:
+                                    stack.append(entry.path)
+                            elif entry.name.lower().endswith(self.extensions):
+                                found.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+    
+    def _note(self, root, path):
+        with self._lock:
+            self._pending[path] = (root, time.time())
+    
+    def _read_loop(self):
+        logger = logging.getLogger()
+        header = self.EVENT_HEADER
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                logger.error(f"inotify read failed: {e}")
+                return
+            offset = 0
+            while offset + header.size <= len(buf):
+                wd, mask, _, length = header.unpack_from(buf, offset)
+                name = buf[offset + header.size:offset + header.size + length].rstrip(b"\0")
+                offset += header.size + length
+                
+                if mask & self.IN_Q_OVERFLOW:
+                    with self._lock:
+                        self._overflow = True
+                    continue
+                with self._lock:
+                    watch = self._watches.get(wd)
+                    if mask & self.IN_IGNORED:
+                        self._watches.pop(wd, None)  # Directory deleted or moved away
+                if watch is None or not name:
+                    continue
+                root, directory = watch
+                path = os.path.join(directory, os.fsdecode(name))
+                
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO) and os.fsdecode(name) != SOURCE_TEMP_DIR:
+                        try:
+                            for found in self.add_tree(root, path):
+                                self._note(root, found)
+                        except OSError as e:
+                            logger.warning(f"Watcher: cannot watch {path}: {e}")
+                            with self._lock:
+                                self._overflow = True
+                elif path.lower().endswith(self.extensions):
+                    self._note(root, path)
+    
+    def drain(self, settle_seconds):
+        """
+        Pop files with no events for settle_seconds.
+        Returns ([(root, path), ...], overflowed) - overflowed means events were
+        lost and watched roots need a full rescan.
+        """
+        cutoff = time.time() - settle_seconds
+        with self._lock:
+            ready = [(root, path) for path, (root, seen) in self._pending.items() if seen <= cutoff]
+            for _, path in ready:
+                del self._pending[path]
+            overflowed, self._overflow = self._overflow, False
+        return sorted(ready), overflowed
+
+
+# --- LIBRARY AUDIT ---
+# Matroska is EBML: [ID][size][data]. A complete file starts with the EBML header
+# and one Segment whose size covers the rest of the file; the SeekHead at the
+# start of the Segment points at the Cues (seek index), which muxers write last.
+EBML_HEADER_ID = 0x1A45DFA3
+EBML_DOCTYPE_ID = 0x4282
+SEGMENT_ID = 0x18538067
+SEEKHEAD_ID = 0x114D9B74
+SEEK_ID = 0x4DBB
+SEEK_ID_ID = 0x53AB
+SEEK_POSITION_ID = 0x53AC
+CUES_ID = 0x1C53BB6B
+CLUSTER_ID = 0x1F43B675
+MATROSKA_EXTENSIONS = ('.mkv', '.mka', '.webm')
+AUDIT_HEAD_BYTES = 16 * 1024
+AUDIT_TAIL_BYTES = 64 * 1024
+EPISODE_PATTERN = re.compile(r'[sS](\d{1,2})[eE](\d{1,3})')
+
+def _pread(f, length, offset):
+    """Read length bytes at offset without moving a shared file position (pread where available)"""
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), length, offset)
+    f.seek(offset)
+    return f.read(length)
+
+def _read_vint(buf, pos, keep_marker=False):
+    """
+    EBML variable-length integer at buf[pos]. IDs keep their length marker bits,
+    sizes don't. Returns (value, next_pos, unknown) - unknown is set for the
+    all-ones size ("unknown length", used while a file is still being written).
+    """
+    if pos >= len(buf):
+        raise ValueError("unexpected end of data")
+    first = buf[pos]
+    length, mask = 1, 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8 or pos + length > len(buf):
+        raise ValueError("invalid EBML number")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in buf[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, pos + length, unknown
+
+def _read_element(buf, pos):
+    """EBML element header at pos. Returns (id, size or None if unknown, data_pos)"""
+    element_id, pos, _ = _read_vint(buf, pos, keep_marker=True)
+    size, pos, unknown = _read_vint(buf, pos)
+    return element_id, None if unknown else size, pos
+
+def _seek_entries(buf, pos, end):
+    """{element id: segment-relative position} from a SeekHead's Seek entries"""
+    entries = {}
+    while pos < end:
+        element_id, size, data = _read_element(buf, pos)
+        if size is None:
+            break
+        if element_id == SEEK_ID:
+            target, position = None, None
+            child = data
+            while child < data + size:
+                child_id, child_size, child_data = _read_element(buf, child)
+                if child_size is None:
+                    break
+                value = int.from_bytes(buf[child_data:child_data + child_size], "big")
+                if child_id == SEEK_ID_ID:
+                    target = value
+                elif child_id == SEEK_POSITION_ID:
+                    position = value
+                child = child_data + child_size
+            if target is not None and position is not None:
+                entries.setdefault(target, position)
+        pos = data + size
+    return entries
+
+def audit_matroska(filepath):
+    """
+    Structural check of a Matroska/WebM file from a few KB at each end.
+    Returns (status, problems): status is "ok", "warning" (playable but e.g. no
+    seek index or unfinalized) or "corrupt" (no EBML header, not Matroska,
+    truncated, index pointing nowhere).
+    """
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return "corrupt", ["empty file"]
+        head = _pread(f, AUDIT_HEAD_BYTES, 0)
+        try:
+            element_id, header_size, pos = _read_element(head, 0)
+            if element_id != EBML_HEADER_ID or header_size is None:
+                return "corrupt", ["no EBML header (not a Matroska file)"]
+            doctype = ""
+            child = pos
+            while child < pos + header_size:
+                child_id, child_size, child_data = _read_element(head, child)
+                if child_id == EBML_DOCTYPE_ID:
+                    doctype = head[child_data:child_data + child_size].rstrip(b"\0").decode('ascii', 'replace')
+                child = child_data + (child_size or 0)
+            if doctype not in ("matroska", "webm"):
+                return "corrupt", [f"EBML doctype {doctype or 'missing'}, not Matroska"]
+            
+            element_id, segment_size, segment_start = _read_element(head, pos + header_size)
+            if element_id != SEGMENT_ID:
+                return "corrupt", ["no Segment after EBML header"]
+            problems = []
+            if segment_size is None:
+                problems.append("unknown Segment size (muxing never finished)")
+            elif segment_start + segment_size > size:
+                return "corrupt", [f"truncated: {size} of {segment_start + segment_size} bytes"]
+            
+            # Top-level elements up to the first Cluster: find the SeekHead
+            seeks = {}
+            child = segment_start
+            while child < len(head):
+                child_id, child_size, child_data = _read_element(head, child)
+                if child_id == CLUSTER_ID or child_size is None:
+                    break
+                if child_id == SEEKHEAD_ID:
+                    seeks = _seek_entries(head, child_data, min(child_data + child_size, len(head)))
+                    break
+                child = child_data + child_size
+        except ValueError as e:
+            return "corrupt", [f"malformed header: {e}"]
+        
+        if CUES_ID in seeks:
+            cues_at = segment_start + seeks[CUES_ID]
+            if cues_at + 4 > size:
+                return "corrupt", [f"truncated: seek index (Cues) at {cues_at} is past end of file ({size} bytes)"]
+            if _pread(f, 4, cues_at) != CUES_ID.to_bytes(4, "big"):
+                return "corrupt", [f"no Cues at indexed position {cues_at}"]
+        else:
+            tail = _pread(f, AUDIT_TAIL_BYTES, max(0, size - AUDIT_TAIL_BYTES))
+            if CUES_ID.to_bytes(4, "big") not in tail:
+                problems.append("no seek index (Cues) - seeking may not work")
+    return ("warning" if problems else "ok"), problems
+
+def audit_deep(filepath):
+    """FFprobe the file and decode its last seconds. Returns list of problems"""
+    info = get_video_info(filepath)
+    if not info:
+        return ["ffprobe: no readable video stream"]
+    seconds = 5
+    problem = decode_segment(filepath, max(0.0, info["duration"] - seconds), seconds) if info["duration"] else None
+    return [problem] if problem else []
+
+def audit_file(filepath, deep=False):
+    """Audit one file: {"path", "size", "status", "problems"} (status "skipped" for non-Matroska)"""
+    result = {"path": filepath, "size": 0, "status": "skipped", "problems": []}
+    try:
+        result["size"] = os.path.getsize(filepath)
+        if not filepath.lower().endswith(MATROSKA_EXTENSIONS):
+            return result
+        result["status"], result["problems"] = audit_matroska(filepath)
+    except OSError as e:
+        result["status"], result["problems"] = "corrupt", [f"read error: {e}"]
+    if deep and result["status"] in ("warning", "corrupt"):
+        # Only suspects get the (slower) FFprobe + tail decode
+        deep_problems = audit_deep(filepath)
+        result["problems"].extend(deep_problems)
+        if deep_problems:
+            result["status"] = "corrupt"
+    return result
+
+def audit_library(roots, workers=16, deep=False, on_progress=None):
+    """
+    Audit every video file under roots with a thread pool (I/O bound - a few
+    small reads per file). Returns report dict: summary counts, corrupt files
+    per folder and every file that is not OK (with sXXeYY episode if found).
+    """
+    started = time.time()
+    paths = []
+    for root in roots:
+        files, _, _ = scan_video_files(root)
+        paths.extend(path for path, _ in files)
+    
+    summary = {"ok": 0, "warning": 0, "corrupt": 0, "skipped": 0}
+    by_folder = {}
+    findings = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="audit") as pool:
+        for done, result in enumerate(pool.map(lambda p: audit_file(p, deep), paths), 1):
+            summary[result["status"]] += 1
+            if result["status"] in ("warning", "corrupt"):
+                match = EPISODE_PATTERN.search(os.path.basename(result["path"]))
+                if match:
+                    result["episode"] = f"s{int(match.group(1)):02d}e{int(match.group(2)):02d}"
+                findings.append(result)
+                if result["status"] == "corrupt":
+                    folder = os.path.dirname(result["path"])
+                    by_folder[folder] = by_folder.get(folder, 0) + 1
+            if on_progress:
+                on_progress(done, len(paths))
+    
+    findings.sort(key=lambda r: (r["status"] != "corrupt", r["path"]))
+    return {
+        "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "roots": list(roots),
+        "deep": deep,
+        "files": len(paths),
+        "seconds": round(time.time() - started, 1),
+        "summary": summary,
+        "corrupt_by_folder": dict(sorted(by_folder.items(), key=lambda item: -item[1])),
+        "findings": findings
+    }
+
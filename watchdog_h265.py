@@ -2,17 +2,38 @@ import os
 import time
 import json
 import threading
-import subprocess
 import logging
 import requests
 import sys
 import shutil
+import atexit
+import hmac
+import socket
+import uuid
 import platform
-from queue import Queue, Empty
-from flask import Flask, redirect, url_for
-from watchdog_core import (load_stats, save_stats, push_kuma, get_video_codec, 
-                           kill_process_tree, get_last_logs, load_processed_files, 
-                           save_processed_files, estimate_hevc_size)
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, redirect, request, url_for
+from watchdog_core import (load_stats, push_kuma, describe_video, 
+                           load_processed_files, 
+                           WriteBehindJournal,
+                           open_probe_cache, probe_video, load_scan_index,
+                           save_scan_index, scan_video_files, VIDEO_EXTENSIONS,
+                           build_encode_cmd, split_cpu_budget,
+                           is_gpu_codec, predict_encode_hours, FairPriorityQueue,
+                           estimate_remaining_seconds, run_ffmpeg, plan_chunks,
+                           write_concat_list, build_concat_cmd, source_features,
+                           load_encode_history, append_encode_history,
+                           fit_compression_model, model_accuracy_report, sample_encode,
+                           InotifyWatcher, is_network_filesystem, filesystem_type, FileStat,
+                           file_quiet_for, open_writers, SOURCE_TEMP_DIR, dict_diff,
+                           RingBufferHandler, tail_lines, Histogram, render_metric,
+                           FFPROBE_SECONDS, get_video_info, probe_cache_entries,
+                           probe_cache_get, probe_cache_put,
+                           calibrate_encoder, choose_preset, host_fingerprint,
+                           load_host_profile, save_host_profile, JobStore,
+                           recover_interrupted_replace, clean_temp_dir, verify_output,
+                           audit_library, system_load, read_pressure, active_window)
 
 __version__ = "2.1.0"
 
@@ -54,16 +75,70 @@ STRINGS = {
 DEFAULT_CONFIG = {
     "SOURCE_DIRS": [],
     "TEMP_FOLDER": "watchdog_temp",
+    "SOURCE_TEMP_DIRS": True,      # Encode into a temp dir on the source's filesystem (final replace = rename)
+    "FREE_SPACE_HEADROOM_GB": 5,   # Keep this much free beyond the expected output before starting a job
     "STATS_FILE": "stats.json",
     "LOG_FILE": "watchdog.log",
     "PROCESSED_FILES": "processed_files.json",
+    "PROBE_CACHE": "probe_cache.db",
+    "SCAN_INDEX": "scan_index.json",
+    "ENCODE_HISTORY": "encode_history.jsonl",
+    "JOB_STORE": "jobs.db",
+    "AUDIT_REPORT": "audit_report.json",
     "OUTPUT_SUFFIX": ".hevc.mkv",
     "PORT": 8085,
     "KUMA_URL": "",
     "MIN_SAVINGS_GB": 0.5,
     "LANGUAGE": "PL",
     "SCAN_INTERVAL_MINUTES": 60,
-    "PARALLEL_PROCESSING": False,
+    "PARALLEL_PROCESSING": False,  # Run ENCODE_WORKERS encodes at once
+    "ENCODE_WORKERS": 2,           # Parallel mode: number of simultaneous encodes
+    "CPU_BUDGET": 0,               # Parallel mode: CPUs to split across workers (0 = all)
+    "PIN_WORKERS": False,          # Parallel mode: pin each worker to its own CPU set (Linux)
+    "PRIORITY_SCHEDULING": True,   # Biggest savings per encode hour first, fair across folders
+    "ENCODE_MPIXELS_PER_SEC": 20,  # Encoder throughput estimate (megapixels/s) for encode time prediction
+    "CHUNKED_ENCODING": False,     # Split long files into chunks encoded in parallel (resumable)
+    "CHUNK_SECONDS": 300,          # Chunk length
+    "CHUNK_MIN_MINUTES": 30,       # Only chunk files at least this long
+    "CHUNK_WORKERS": 0,            # Chunks encoded at once per file (0 = auto from CPU budget)
+    "SUSPEND_ON_PAUSE": True,      # Pause suspends FFmpeg (SIGSTOP/SIGCONT) instead of killing it (Linux/macOS)
+    "PAUSE_KILL_MINUTES": 0,       # Kill a suspended encode after this long (0 = never)
+    "NICE": 10,                    # FFmpeg CPU priority: 0 = normal ... 19 = lowest (Windows: below normal / idle)
+    "IONICE": "best-effort",       # Linux: FFmpeg disk priority - "" (normal), "best-effort" (lowest level) or "idle"
+    "LOAD_MAX": 0,                 # Suspend encodes while 1-min load average per CPU is above this (0 = off)
+    "PRESSURE_MAX": 0,             # Linux PSI: suspend encodes while cpu or io pressure (some avg10, %) is above this (0 = off)
+    "THROTTLE_RESUME_SECONDS": 120,  # Resume once load and pressure stayed below the limits this long
+    "QUIET_HOURS": [],             # [{"start": "18:00", "end": "23:30", "days": ["fri"], "action": "pause" or "threads", "threads": 2}]
+    "INCREMENTAL_SCAN": True,      # Skip re-listing directories whose mtime is unchanged
+    "PROBE_WORKERS": 4,            # Concurrent ffprobe processes during scan
+    "FLUSH_INTERVAL_SECONDS": 10,  # Write-behind: persist stats/processed files at most this often...
+    "FLUSH_BATCH_SIZE": 200,       # ...or after this many new processed files
+    "WATCH_FOLDERS": True,         # Linux: pick up new files via inotify instead of rescanning (local disks)
+    "STABLE_SECONDS": 60,          # File size/mtime must be unchanged this long before encoding starts
+    "CHECK_OPEN_WRITERS": True,    # Linux: wait while another process has the file open for writing
+    "VERIFY_OUTPUT": True,         # Check output streams/duration and decode samples before replacing
+    "VERIFY_SAMPLES": 4,           # Verify: segments decoded (spread over the file, last one at the end)
+    "VERIFY_SAMPLE_SECONDS": 5,    # Verify: segment length
+    "VERIFY_DURATION_TOLERANCE": 2,  # Verify: allowed duration difference (seconds)
+    "AUDIT_WORKERS": 16,           # --audit: files checked at once
+    "AUDIT_DEEP": False,           # --audit: also FFprobe + decode the end of suspect files
+    "SAMPLE_PRECHECK": False,      # Encode short sample clips before queueing to predict real savings
+    "SAMPLE_COUNT": 3,             # Pre-check: clips per file
+    "SAMPLE_SECONDS": 20,          # Pre-check: clip length
+    "AUTO_PRESET": False,          # Pick the libx265 preset from a calibration run on this host
+    "TARGET_GB_PER_DAY": 200,      # Auto preset: slowest preset that still encodes this much source per day
+    "HOST_PROFILE": "host_profile.json",  # Auto preset: cached calibration result
+    "CALIBRATION_FILE": "",        # Auto preset: reference video (empty = typical file from the probe cache)
+    "CALIBRATION_SECONDS": 30,     # Auto preset: reference clip length
+    "CALIBRATION_PRESETS": ["veryfast", "faster", "fast", "medium", "slow", "slower"],
+    "CALIBRATION_CRFS": [],        # Auto preset: CRFs to measure (empty = ENCODE_SETTINGS crf)
+    "ROLE": "standalone",          # standalone, coordinator (scans, hands out jobs) or worker (encodes jobs)
+    "COORDINATOR_URL": "",         # Worker: coordinator dashboard URL, e.g. http://nas:8085
+    "COORDINATOR_ENCODES": True,   # Coordinator: also encode with its own workers
+    "CLUSTER_TOKEN": "",           # Shared secret for the job API (empty = no check)
+    "WORKER_NAME": "",             # Worker: name shown on the coordinator (empty = hostname)
+    "LEASE_SECONDS": 120,          # Remote job lease; workers renew it every third of this
+    "PATH_MAP": {},                # Worker: {"coordinator path prefix": "local path prefix"}
     
     # Encoding settings (advanced)
     "ENCODE_SETTINGS": {
@@ -90,17 +165,26 @@ def normalize_source_dirs(source_dirs, default_interval):
             normalized.append({
                 "path": item,
                 "scan_interval_minutes": default_interval,
-                "name": os.path.basename(item) or item
+                "name": os.path.basename(item) or item,
+                "weight": 1.0,
+                "temp_folder": ""
             })
         elif isinstance(item, dict):
             # New format: dict with config
             if "path" not in item:
                 logger.warning(f"Skipping invalid SOURCE_DIR entry (no path): {item}")
                 continue
+            try:
+                weight = float(item.get("weight", 1.0))
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid weight for SOURCE_DIR {item['path']}: {item.get('weight')!r} - using 1.0")
+                weight = 1.0
             normalized.append({
                 "path": item["path"],
                 "scan_interval_minutes": item.get("scan_interval_minutes", default_interval),
-                "name": item.get("name", os.path.basename(item["path"]) or item["path"])
+                "name": item.get("name", os.path.basename(item["path"]) or item["path"]),
+                "weight": weight,
+                "temp_folder": item.get("temp_folder", "")
             })
         else:
             logger.warning(f"Skipping invalid SOURCE_DIR entry: {item}")
@@ -168,6 +252,15 @@ sh = logging.StreamHandler(sys.stdout)
 sh.setFormatter(formatter)
 logger.addHandler(sh)
 
+# Recent lines for the dashboard/API, seeded from the end of the existing log file
+log_buffer = RingBufferHandler(capacity=1000)
+log_buffer.setFormatter(formatter)
+try:
+    log_buffer.seed(tail_lines(CONFIG["LOG_FILE"], 120))
+except OSError:
+    pass
+logger.addHandler(log_buffer)
+
 try:
     fh = logging.FileHandler(CONFIG["LOG_FILE"], encoding='utf-8')
     fh.setFormatter(formatter)
@@ -184,9 +277,24 @@ for folder_config in CONFIG["SOURCE_DIRS"]:
         "interval": folder_config["scan_interval_minutes"] * 60,
         "name": folder_config["name"],
         "next_scan": 0,
-        "status": "Idle"
+        "status": "Idle",
+        "watched": False,  # Changes arrive via inotify (see start_watcher)
+        "caught_up": False  # Scanned since startup (changes made while down are picked up)
     }
 
+# ffprobe result cache (survives restarts, invalidated on file change)
+probe_cache = open_probe_cache(CONFIG["PROBE_CACHE"])
+
+# Queued jobs and folder scan times (survive restarts, see resume_jobs)
+job_store = JobStore(CONFIG["JOB_STORE"])
+
+# transcode_file result -> job store state
+JOB_RESULT_STATES = {"done": "done", "no_savings": "skipped", "skipped": "skipped",
+                     "failed": "failed", "in_use": "pending", "no_space": "pending"}
+
+# Directory mtime index for incremental scans
+scan_index = load_scan_index(CONFIG["SCAN_INDEX"]) if CONFIG["INCREMENTAL_SCAN"] else {}
+
 state = {
     "status": "Inicjalizacja",
     "current_file": "Brak",
@@ -198,40 +306,138 @@ state = {
     "processing_active": False,
     "transcode_start_time": 0,
     "transcode_file_size": 0,
-    "folder_statuses": {}  # For parallel mode: track each folder status
+    "measured_mpixels_per_sec": 0,  # Encoder throughput measured from finished encodes
+    "encode_history": load_encode_history(CONFIG["ENCODE_HISTORY"]),
+    "compression_model": {},        # Learned from encode_history (see model_history)
+    "host_profile": None,           # AUTO_PRESET calibration result (see calibrate_host)
+    "calibrating": False,           # Encodes are held while calibrate_host measures this host
+    "throttle": {"mode": "", "reason": "", "threads": 0},  # Load / QUIET_HOURS policy (see policy_loop)
+    "folder_statuses": {},  # For parallel mode: track each folder status
+    "workers": []           # Encode worker slots (see init_workers)
 }
 
+# Candidates waiting for an encode worker (priority + per-folder fairness)
+job_queue = FairPriorityQueue()
+queued_files = set()    # Paths queued or encoding (watcher must not queue them twice)
+stats_lock = threading.Lock()
+
+# Files not ready yet (still being written): [(retry_at, path)], see defer_job
+deferred_jobs = []
+deferred_lock = threading.Lock()
+stability_seen = {}     # path -> ((size, mtime_ns), first seen) for file_quiet_for
+NO_SPACE_RETRY_SECONDS = 600
+VERIFY_MAX_FAILURES = 3  # Failed output verifications before a file is skipped for good
+
+# Temp space held by running jobs: worker id -> (st_dev, GB), see reserve_space
+space_reserved = {}
+space_lock = threading.Lock()
+
+# Suspended FFmpeg processes per worker (chunks suspend together), see pause_options
+suspend_lock = threading.Lock()
+
+# Prometheus histograms (see /metrics); ffprobe latency lives in watchdog_core
+SCAN_SECONDS = Histogram("watchdog_scan_duration_seconds", "Folder scan duration (walk + probe)",
+                         [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800], label="folder")
+ENCODE_FPS = Histogram("watchdog_encode_fps", "Average frames per second of finished encodes",
+                       [1, 2, 5, 10, 20, 30, 50, 100, 200, 400])
+ENCODE_SPEED = Histogram("watchdog_encode_speed", "Average speed (x realtime) of finished encodes",
+                         [0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16])
+ENCODE_SECONDS_PER_GB = Histogram("watchdog_encode_seconds_per_gb", "Encode wall time per GB of source",
+                                  [30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400])
+QUEUE_BACKLOG = Histogram("watchdog_queue_backlog", "Jobs still queued when a worker takes a job",
+                          [0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000])
+
+# inotify watcher for local SOURCE_DIRS (None = scheduled scans only)
+watcher = None
+WATCH_SETTLE_SECONDS = 5  # Quiet time after a file's last event before it is picked up
+WATCHED_RESCAN_FACTOR = 24  # Watched folders are still fully rescanned every interval x this
+
+# Coordinator: jobs claimed by remote workers, by job id (see lease_job)
+leases = {}
+lease_lock = threading.Lock()
+REMOTE_POLL_SECONDS = 10  # Worker: wait before asking again when the coordinator has no job
+
+POLICY_CHECK_SECONDS = 15  # Throttle policy: how often load and QUIET_HOURS are checked
+THROTTLE_REPEAT_SECONDS = 600  # Busy again this soon after resuming: back off (see policy_loop)
+THROTTLE_BACKOFF_MAX = 16
+
+CALIBRATION_RETRY_SECONDS = 6 * 3600  # After a failed calibration, keep the configured preset this long
+calibration_retry_at = 0
+calibration_lock = threading.Lock()  # Worker: one slot calibrates, see ensure_host_profile
+
+def init_workers():
+    """Create encode worker slots, splitting CPU budget in parallel mode"""
+    count = max(1, int(CONFIG["ENCODE_WORKERS"])) if CONFIG["PARALLEL_PROCESSING"] else 1
+    threads, cpu_sets = 0, [None] * count
+    if count > 1 or CONFIG["CPU_BUDGET"]:
+        threads, cpu_sets = split_cpu_budget(count, CONFIG["CPU_BUDGET"])
+        if not CONFIG["PIN_WORKERS"]:
+            cpu_sets = [None] * count
+    state['workers'] = [{
+        "id": i,
+        "threads": threads,
+        "cpu_set": cpu_sets[i],
+        "file": None,
+        "folder": "",
+        "status": "Idle",
+        "start_time": 0,
+        "paused_seconds": 0,  # Time this job spent suspended (excluded from ETA/throughput)
+        "suspended": 0,     # FFmpeg processes of this job currently suspended
+        "suspended_at": 0,
+        "file_size": 0,
+        "duration": 0,
+        "progress": {},
+        "outcome": {},      # Sizes of the last finished encode (reported to the coordinator)
+        "pid": None,
+        "enc": None,        # Current job's encoder settings (remote jobs), see job_settings
+        "source": None,     # Current job's source folder on this host (remote jobs), see job_source
+        "paused": False,
+        "skip": False
+    } for i in range(count)]
+
+# Write-behind persistence for stats.json / processed_files.json
+journal = WriteBehindJournal(CONFIG["PROCESSED_FILES"], CONFIG["STATS_FILE"],
+                             state['processed_files'], state['stats'],
+                             flush_interval=CONFIG["FLUSH_INTERVAL_SECONDS"],
+                             flush_count=CONFIG["FLUSH_BATCH_SIZE"])
+
 app = Flask(__name__)
 
-def format_time_remaining():
-    """Calculate and format estimated time remaining for current transcode"""
-    if not state['processing_active'] or state['transcode_start_time'] == 0:
+def format_time_remaining(worker=None):
+    """Format estimated time remaining for a worker's transcode (default: first active job)"""
+    if worker is None:
+        active = [w for w in state['workers'] if w['file']]
+        if not active:
+            return ""
+        worker = active[0]
+    if not worker['file'] or worker['start_time'] == 0:
         return ""
     
-    elapsed = time.time() - state['transcode_start_time']
-    if elapsed < 10:  # Too early to estimate
+    elapsed = encode_seconds(worker)
+    # Based on FFmpeg progress (out_time, speed) against known source duration
+    remaining = estimate_remaining_seconds(worker['progress'], worker['duration'], elapsed)
+    if elapsed < 10 or remaining is None:  # Too early to estimate
         return "Calculating..."
     
-    # Rough estimate: assume ~0.5 GB per minute (very approximate)
-    # Better would be to parse FFmpeg progress, but this is MVP
-    minutes_elapsed = elapsed / 60
-    gb_per_minute = state['transcode_file_size'] / minutes_elapsed if minutes_elapsed > 0 else 0
-    
-    if gb_per_minute > 0:
-        # Estimate based on rough 50% compression
-        estimated_output_size = state['transcode_file_size'] * 0.5
-        # Rough time estimate
-        estimated_total_minutes = state['transcode_file_size'] / gb_per_minute if gb_per_minute > 0 else 0
-        remaining_minutes = max(0, estimated_total_minutes - minutes_elapsed)
-        
-        if remaining_minutes > 60:
-            hours = int(remaining_minutes // 60)
-            mins = int(remaining_minutes % 60)
-            return f"~{hours}h {mins}m"
-        else:
-            return f"~{int(remaining_minutes)}m"
-    
-    return "Calculating..."
+    remaining_minutes = remaining / 60
+    if remaining_minutes > 60:
+        hours = int(remaining_minutes // 60)
+        mins = int(remaining_minutes % 60)
+        return f"~{hours}h {mins}m"
+    else:
+        return f"~{int(remaining_minutes)}m"
+
+def format_progress(worker):
+    """Format live FFmpeg progress: percent, fps, speed"""
+    progress = worker.get('progress') or {}
+    parts = []
+    if worker.get('duration') and progress.get('out_time'):
+        parts.append(f"{min(100.0, progress['out_time'] / worker['duration'] * 100):.1f}%")
+    if progress.get('fps'):
+        parts.append(f"{progress['fps']:.1f} fps")
+    if progress.get('speed'):
+        parts.append(f"{progress['speed']:.2f}x")
+    return " • ".join(parts)
 
 def should_scan_folder(folder_path):
     """Check if a folder is due for scanning based on its schedule"""
@@ -245,92 +451,126 @@ def should_scan_folder(folder_path):
     if schedule["last_scan"] == 0:
         return True
     
+    # Watched folders get changes from the watcher; a slow safety rescan retries
+    # failed/skipped encodes and catches events the watcher missed
+    # (until the first scan after a restart, which catches up on changes made while down)
+    interval = schedule["interval"]
+    if schedule["watched"] and schedule["caught_up"]:
+        interval *= WATCHED_RESCAN_FACTOR
+    
     time_since_last = current_time - schedule["last_scan"]
-    return time_since_last >= schedule["interval"]
+    return time_since_last >= interval
 
 def scan_folder(folder_path):
     """
     Scan a single folder for video files that need transcoding.
-    Returns list of (file_path, codec, estimated_size) tuples.
+    Returns list of (file_path, codec, estimated_size, info) tuples.
     """
     if not os.path.exists(folder_path):
         logger.error(f"Directory unreachable: {folder_path}")
         return []
     
-    all_videos = []
-    for dirpath, _, filenames in os.walk(folder_path):
-        for f in filenames:
-            if f.lower().endswith(('.mkv', '.mp4', '.avi')) and not f.endswith(CONFIG["OUTPUT_SUFFIX"]):
-                all_videos.append(os.path.join(dirpath, f))
+    suffix = CONFIG["OUTPUT_SUFFIX"]
+    files, folder_index, dirs_listed = scan_video_files(
+        folder_path, scan_index.get(folder_path), extra_suffix=suffix)
+    if CONFIG["INCREMENTAL_SCAN"]:
+        scan_index[folder_path] = folder_index
+        save_scan_index(CONFIG["SCAN_INDEX"], scan_index)
+    logger.info(f"Scanned {len(folder_index)} dirs ({dirs_listed} changed), {len(files)} files")
     
-    all_videos.sort()
+    existing = {path for path, _ in files}
+    all_videos = sorted(((path, st) for path, st in files 
+                         if path.lower().endswith(VIDEO_EXTENSIONS) and not path.endswith(suffix)),
+                        key=lambda item: item[0])
     
+    # Filter out files that don't need probing (cheap, no I/O)
+    to_probe = [(vid, st) for vid, st in all_videos
+                if vid + suffix not in existing and vid not in state['processed_files']
+                and vid not in queued_files]
+    return probe_candidates(to_probe)
+
+def probe_candidates(to_probe):
+    """
+    Probe (file_path, FileStat) pairs, log and record skips.
+    Returns list of (file_path, codec, estimated_size, info) tuples worth encoding.
+    """
+    # Probe concurrently; map() yields results in input order, so skip stats and
+    # processed_files are only ever updated from the calling thread, deterministically
     candidates = []
-    for vid in all_videos:
-        # Skip if output file already exists
-        if os.path.exists(vid + CONFIG["OUTPUT_SUFFIX"]): 
-            continue
-        
-        # Skip if already processed (file path in history)
-        if vid in state['processed_files']:
-            continue
-        
-        codec = get_video_codec(vid)
-        file_size_gb = os.path.getsize(vid) / (1024**3)
-        
-        # Skip if already in efficient codec
-        if codec and codec.lower() in ['hevc', 'h265', 'av1']:
-            # Detailed skip logging
-            skip_type = codec.lower()
-            if skip_type in ['h265', 'hevc']:
-                skip_type = 'hevc'
-                reason_detail = "already optimal format"
-            elif skip_type == 'av1':
-                reason_detail = "better than HEVC, no conversion benefit"
-            
-            logger.info(f"SKIP ({codec.upper()}): {os.path.basename(vid)} - {file_size_gb:.1f}GB, {reason_detail}")
-            
-            # Track skip statistics
-            state['stats']['files_skipped'] += 1
-            state['stats']['gb_skipped'] += file_size_gb
-            if skip_type in state['stats']['skip_reasons']:
-                state['stats']['skip_reasons'][skip_type] += 1
-            save_stats(CONFIG["STATS_FILE"], state['stats'])
+    workers = max(1, int(CONFIG["PROBE_WORKERS"]))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        model = state['compression_model']
+        results = pool.map(lambda item: probe_video(probe_cache, item[0], item[1], model,
+                                                    CONFIG["MIN_SAVINGS_GB"]), to_probe)
+        for (vid, st), (codec, estimated_size, worth_it, info) in zip(to_probe, results):
+            file_size_gb = st.st_size / (1024**3)
             
-            state['processed_files'].add(vid)
-            save_processed_files(CONFIG["PROCESSED_FILES"], state['processed_files'])
-            continue
-        
-        if codec:
-            # Estimate if conversion is worth it
-            estimated_size, worth_it = estimate_hevc_size(vid, codec)
-            if worth_it:
-                candidates.append((vid, codec, estimated_size))
-            else:
-                # Detailed skip logging with reasons
-                if codec.lower() == 'vp9':
-                    reason_detail = "efficient codec, minimal benefit from HEVC conversion"
-                    skip_type = 'vp9'
-                else:
-                    savings_gb = file_size_gb - estimated_size
-                    reason_detail = f"estimated savings {savings_gb:.2f}GB < {CONFIG['MIN_SAVINGS_GB']}GB threshold"
-                    skip_type = 'too_small'
+            # Skip if already in efficient codec
+            if codec and codec.lower() in ['hevc', 'h265', 'av1']:
+                # Detailed skip logging
+                skip_type = codec.lower()
+                if skip_type in ['h265', 'hevc']:
+                    skip_type = 'hevc'
+                    reason_detail = "already optimal format"
+                elif skip_type == 'av1':
+                    reason_detail = "better than HEVC, no conversion benefit"
                 
                 logger.info(f"SKIP ({codec.upper()}): {os.path.basename(vid)} - {file_size_gb:.1f}GB, {reason_detail}")
-                
-                # Track skip statistics
-                state['stats']['files_skipped'] += 1
-                state['stats']['gb_skipped'] += file_size_gb
-                if skip_type in state['stats']['skip_reasons']:
-                    state['stats']['skip_reasons'][skip_type] += 1
-                save_stats(CONFIG["STATS_FILE"], state['stats'])
-                
-                # Mark as processed so we don't check again
-                state['processed_files'].add(vid)
-                save_processed_files(CONFIG["PROCESSED_FILES"], state['processed_files'])
+                book_skip(skip_type, file_size_gb)
+                journal.add_processed(vid)
+                continue
+            
+            if codec:
+                # Estimate if conversion is worth it (cached with the probe)
+                if worth_it:
+                    candidates.append((vid, codec, estimated_size, info))
+                else:
+                    # Detailed skip logging with reasons
+                    if codec.lower() == 'vp9':
+                        reason_detail = "efficient codec, minimal benefit from HEVC conversion"
+                        skip_type = 'vp9'
+                    else:
+                        savings_gb = file_size_gb - estimated_size
+                        reason_detail = f"estimated savings {savings_gb:.2f}GB < {CONFIG['MIN_SAVINGS_GB']}GB threshold"
+                        skip_type = 'too_small'
+                    
+                    logger.info(f"SKIP ({codec.upper()}): {os.path.basename(vid)} - {file_size_gb:.1f}GB, {reason_detail}")
+                    book_skip(skip_type, file_size_gb)
+                    
+                    # Mark as processed so we don't check again
+                    journal.add_processed(vid)
     
+    # Persist this batch of skips at once
+    journal.flush()
     return candidates
 
+def book_skip(reason, file_size_gb):
+    """Count a skipped file in the skip statistics"""
+    with stats_lock:
+        state['stats']['files_skipped'] += 1
+        state['stats']['gb_skipped'] += file_size_gb
+        reasons = state['stats']['skip_reasons']
+        reasons[reason] = reasons.get(reason, 0) + 1
+    journal.stats_changed()
+
+def verify_failed(file_path, file_size_gb):
+    """
+    Count a failed output verification. After VERIFY_MAX_FAILURES the file is
+    skipped for good (skip reason "verify") instead of being re-encoded on every
+    scan. Returns True if it was given up on.
+    """
+    try:
+        failures = job_store.add_failure(file_path, os.stat(file_path))
+    except OSError:
+        return False
+    if failures < VERIFY_MAX_FAILURES:
+        return False
+    book_skip("verify", file_size_gb)
+    journal.add_processed(file_path)
+    journal.flush()
+    logger.warning(f"SKIPPED: {os.path.basename(file_path)} (verify failed {failures} times, will not retry)")
+    return True
+
 def get_next_scan_time(folder_path):
     """Get formatted time until next scan for a folder"""
     if folder_path not in scan_schedule:
@@ -342,6 +582,9 @@ def get_next_scan_time(folder_path):
     if schedule["last_scan"] == 0:
         return "Now"
     
+    if schedule["watched"]:
+        return "Watching"
+    
     next_scan_time = schedule["last_scan"] + schedule["interval"]
     time_until = next_scan_time - current_time
     
@@ -359,6 +602,32 @@ def get_next_scan_time(folder_path):
 def worker_loop():
     logger.info("=== HEVC WATCHDOG V1.0 START ===")
     
+    init_workers()
+    if CONFIG["AUTO_PRESET"]:
+        apply_host_profile(load_host_profile(CONFIG["HOST_PROFILE"], calibration_fingerprint()))
+        if not state['host_profile'] and (CONFIG["CALIBRATION_FILE"]
+                                          or pick_calibration_file(CONFIG["CALIBRATION_SECONDS"])):
+            # Known reference video: calibrate now, before resumed jobs start encoding
+            state['status'] = "Calibrating encoder"
+            calibrate_host()
+    resume_jobs()
+    start_policy()
+    history = model_history()
+    state['compression_model'] = fit_compression_model(history)
+    if history:
+        logger.info(f"Compression model: {len(history)} encodes with current settings")
+        for line in model_accuracy_report(history):
+            logger.info(f"  {line}")
+    start_watcher()
+    if CONFIG["ROLE"] == "coordinator":
+        logger.info(f"Coordinator mode: remote workers claim jobs at /api/jobs/claim "
+                    f"(lease {CONFIG['LEASE_SECONDS']}s)")
+    if CONFIG["ROLE"] != "coordinator" or CONFIG["COORDINATOR_ENCODES"]:
+        if len(state['workers']) > 1:
+            logger.info(f"Parallel mode: {len(state['workers'])} workers x {state['workers'][0]['threads']} threads")
+        for worker in state['workers']:
+            threading.Thread(target=encode_worker, args=(worker['id'],), daemon=True).start()
+    
     while True:
         if state['paused']:
             state['status'] = "PAUSED"
@@ -375,7 +644,7 @@ def worker_loop():
         # If no folders need scanning, wait and check again
         if not folders_to_scan:
             state['status'] = "Idle"
-            time.sleep(60)  # Check every minute
+            wait_for_changes(60)  # Check every minute
             continue
         
         # Scan folders that are due
@@ -391,406 +660,1867 @@ def worker_loop():
             logger.info(f"Scanning folder: {folder_name} ({folder_path})")
             push_kuma(CONFIG["KUMA_URL"])
             
+            scan_started = time.time()
             folder_candidates = scan_folder(folder_path)
-            candidates.extend(folder_candidates)
+            SCAN_SECONDS.observe(time.time() - scan_started, folder_name)
+            candidates.extend((folder_config, c) for c in folder_candidates)
             
             # Update schedule
             scan_schedule[folder_path]["last_scan"] = time.time()
+            job_store.save_scan(folder_path, scan_schedule[folder_path]["last_scan"])
+            scan_schedule[folder_path]["caught_up"] = True
             scan_schedule[folder_path]["next_scan"] = time.time() + scan_schedule[folder_path]["interval"]
             scan_schedule[folder_path]["status"] = "Idle"
             
             logger.info(f"Folder {folder_name}: Found {len(folder_candidates)} files to process")
         
+        if (candidates and CONFIG["AUTO_PRESET"] and not state['host_profile']
+                and time.time() >= calibration_retry_at):
+            state['status'] = "Calibrating encoder"
+            calibrate_host()
+        
         if candidates:
             logger.info(f"Total queue: {len(candidates)} files (pre-checked for worthwhile savings)")
         else:
             logger.info("No files need transcoding")
             state['status'] = "Idle"
             state['current_folder'] = ""
-            time.sleep(60)
+            wait_for_changes(60)
             continue
 
-        for file_path, codec, estimated_size in candidates:
-            # Check for skip before processing
-            if state['skip']:
-                state['skip'] = False
-                logger.info(f"Skipped file (queued): {os.path.basename(file_path)}")
-                continue
-            
-            while state['paused']:
-                state['status'] = "PAUSED"
-                state['current_file'] = "Waiting..."
-                time.sleep(2)
-                # Allow skip during pause
-                if state['skip']:
-                    state['skip'] = False
-                    logger.info(f"Skipped file (paused): {os.path.basename(file_path)}")
-                    break
-            
-            # If skipped during pause, continue to next file  
-            if not state['paused'] and state.get('skip'):
-                continue
+        # Hand candidates to the encode workers and wait for the batch to finish
+        for folder_config, candidate in candidates:
+            queue_candidate(folder_config, candidate)
+        wait_for_queue()
+
+        state['status'] = "Idle"
+        state['current_folder'] = ""
+        logger.info("Processing complete. Checking schedules...")
+        time.sleep(10)  # Brief pause before checking schedules again
+
+def resume_jobs():
+    """
+    Warm restart from JOB_STORE: restore folder scan times, clean up after a crash
+    and queue unfinished jobs right away (no rescan needed to get encoding again).
+    Jobs that were running, or whose file changed, are probed again first.
+    Jobs leased to remote workers keep their lease: the worker is still encoding them.
+    """
+    for folder_path, last_scan in job_store.last_scans().items():
+        if folder_path in scan_schedule:
+            scan_schedule[folder_path]["last_scan"] = last_scan
+            scan_schedule[folder_path]["next_scan"] = last_scan + scan_schedule[folder_path]["interval"]
+    
+    with lease_lock:
+        remote = {lease["job"][0] for lease in leases.values()}  # See restore_leases
+    jobs = [job for job in job_store.unfinished() if job["path"] not in remote]
+    for job in jobs:
+        if job["state"] == "running":
+            try:
+                action = recover_interrupted_replace(job["path"])
+                if action:
+                    logger.warning(f"Recovered {os.path.basename(job['path'])}: {action}")
+            except OSError as e:
+                logger.error(f"Cannot recover {job['path']}: {e}")
+    
+    # Encode leftovers in every temp dir (chunk checkpoints of unfinished jobs stay)
+    keep = {job["path"] for job in jobs} | remote
+    sources = {f["path"] for f in CONFIG["SOURCE_DIRS"]}
+    temp_dirs = {CONFIG["TEMP_FOLDER"]}
+    for folder_config in CONFIG["SOURCE_DIRS"]:
+        temp_dirs.add(folder_config["temp_folder"] or os.path.join(folder_config["path"], SOURCE_TEMP_DIR))
+    removed = sum(clean_temp_dir(d, CONFIG["OUTPUT_SUFFIX"], keep) for d in temp_dirs if d and d not in sources)
+    if removed:
+        logger.info(f"Removed {removed} leftover temp files")
+    
+    resumed = 0
+    to_probe = {}
+    for job in jobs:
+        path = job["path"]
+        folder_config = folder_for_path(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if folder_config is None or st is None or path in state['processed_files']:
+            job_store.remove(path)
+            continue
+        if job["state"] == "running" or (st.st_size, st.st_mtime_ns) != (job["size"], job["mtime_ns"]):
+            job_store.remove(path)  # Queued again below if it still needs encoding
+            to_probe.setdefault(folder_config["path"], (folder_config, []))[1].append(
+                (path, FileStat(st.st_size, st.st_mtime_ns, st.st_ino)))
+            continue
+        queue_candidate(folder_config, (path, job["codec"], job["estimated_gb"], job["info"]))
+        resumed += 1
+    for folder_config, files in to_probe.values():
+        resumed += queue_files(folder_config, files)
+    if jobs:
+        logger.info(f"Resumed {resumed} of {len(jobs)} unfinished jobs from {CONFIG['JOB_STORE']}")
+
+def restore_leases():
+    """
+    Coordinator: re-create the leases of running remote jobs after a restart, with a
+    fresh LEASE_SECONDS for the worker's next heartbeat. Runs before the web server
+    starts, so no heartbeat of a still-encoding worker is turned away.
+    """
+    running = {job["path"]: job for job in job_store.unfinished() if job["state"] == "running"}
+    restored = set()
+    for lease in job_store.leases():
+        job = running.get(lease["path"]) if CONFIG["ROLE"] == "coordinator" else None
+        if job is None or job["path"] in restored:
+            job_store.drop_lease(lease["job_id"])
+            continue
+        with lease_lock:
+            leases[lease["job_id"]] = {
+                "job": (job["path"], job["codec"], job["estimated_gb"], job["info"]),
+                "worker": lease["worker"],
+                "claimed_at": lease["claimed_at"],
+                "expires": time.time() + CONFIG["LEASE_SECONDS"],
+                "progress": {},
+                "queued": False
+            }
+        queued_files.add(job["path"])
+        restored.add(job["path"])
+    if restored:
+        logger.info(f"Restored {len(restored)} remote job leases")
+
+def start_watcher():
+    """Watch local SOURCE_DIRS with inotify; network mounts and other platforms keep scheduled scans"""
+    global watcher
+    if not CONFIG["WATCH_FOLDERS"]:
+        return
+    if not InotifyWatcher.available():
+        logger.info("Folder watching not available on this platform - using scheduled scans")
+        return
+    try:
+        watcher = InotifyWatcher()
+    except OSError as e:
+        logger.warning(f"Folder watching unavailable ({e}) - using scheduled scans")
+        return
+    
+    for folder_config in CONFIG["SOURCE_DIRS"]:
+        folder_path = folder_config["path"]
+        folder_name = folder_config["name"]
+        if not os.path.isdir(folder_path):
+            continue
+        if is_network_filesystem(folder_path):
+            logger.info(f"Watcher: {folder_name} is on {filesystem_type(folder_path)} - using scheduled scans")
+            continue
+        try:
+            watcher.add_tree(folder_path)
+        except OSError as e:
+            # Typically fs.inotify.max_user_watches reached
+            logger.warning(f"Watcher: cannot watch {folder_name} ({e}) - using scheduled scans")
+            continue
+        scan_schedule[folder_path]["watched"] = True
+        logger.info(f"Watching folder: {folder_name}")
+    watcher.start()
 
-            file_name = os.path.basename(file_path)
+def process_watch_events():
+    """Probe and queue video files reported by the watcher"""
+    if watcher is None:
+        return
+    events, overflowed = watcher.drain(WATCH_SETTLE_SECONDS)
+    if overflowed:
+        # Events were lost: fall back to one full scan of the watched folders
+        logger.warning("Watcher: event queue overflowed - rescanning watched folders")
+        for schedule in scan_schedule.values():
+            if schedule["watched"]:
+                schedule["last_scan"] = 0
+    
+    suffix = CONFIG["OUTPUT_SUFFIX"]
+    for folder_config in CONFIG["SOURCE_DIRS"]:
+        to_probe = []
+        for root, path in events:
+            if (root != folder_config["path"] or path.endswith(suffix) or path in queued_files
+                    or path in state['processed_files'] or os.path.exists(path + suffix)):
+                continue
             try:
-                os.rename(file_path, file_path)
-            except:
-                logger.info(f"File in use: {file_name}")
+                st = os.stat(path)
+                settled = file_quiet_for(path, CONFIG["STABLE_SECONDS"], stability_seen)
+            except OSError:
+                continue  # Already gone again
+            if not settled:
+                # Still being written: a probe now could skip it for good (e.g. as too small)
+                queued_files.add(path)
+                defer_job(path, CONFIG["STABLE_SECONDS"])
                 continue
+            to_probe.append((path, FileStat(st.st_size, st.st_mtime_ns, st.st_ino)))
+        if to_probe:
+            queued = queue_files(folder_config, to_probe)
+            logger.info(f"Watcher: {folder_config['name']}: {len(to_probe)} new files, {queued} to process")
 
-            state['status'] = "Transcoding..."
-            state['current_file'] = file_name
-            state['processing_active'] = True
-            state['transcode_start_time'] = time.time()
-            orig_size_gb = os.path.getsize(file_path) / (1024**3)
-            state['transcode_file_size'] = orig_size_gb
-            logger.info(f"START: {file_name} ({codec}) - {orig_size_gb:.2f} GB → est. {estimated_size:.2f} GB")
-            
-            output_file = os.path.join(CONFIG["TEMP_FOLDER"], file_name + CONFIG["OUTPUT_SUFFIX"])
-            
-            # Build FFmpeg command from config
-            enc = CONFIG["ENCODE_SETTINGS"]
-            codec = enc["codec"]
-            is_gpu = "nvenc" in codec or "qsv" in codec or "amf" in codec
-            
-            cmd = [
-                "ffmpeg", "-i", file_path,
-                "-c:v", codec,
-            ]
-            
-            # GPU encoders use different parameter names
-            if is_gpu:
-                # GPU encoding (NVIDIA/Intel/AMD)
-                if "nvenc" in codec:
-                    # NVIDIA NVENC
-                    cmd.extend(["-cq", str(enc["crf"])])  # CQ for NVENC
-                    cmd.extend(["-preset", enc["preset"]])  # p1-p7 for NVENC
-                    if enc.get("gpu_device") is not None:
-                        cmd.extend(["-gpu", str(enc["gpu_device"])])
-                elif "qsv" in codec:
-                    # Intel Quick Sync
-                    cmd.extend(["-global_quality", str(enc["crf"])])
-                    cmd.extend(["-preset", enc["preset"]])
-                elif "amf" in codec:
-                    # AMD AMF
-                    cmd.extend(["-qp", str(enc["crf"])])
-                    cmd.extend(["-quality", enc["preset"]])
+def queue_files(folder_config, to_probe):
+    """Probe (file_path, FileStat) pairs outside a folder scan and queue the candidates"""
+    candidates = probe_candidates(to_probe)
+    for candidate in candidates:
+        queue_candidate(folder_config, candidate)
+    return len(candidates)
+
+def folder_for_path(file_path):
+    """SOURCE_DIRS entry containing file_path (deepest match), or None"""
+    matches = [f for f in CONFIG["SOURCE_DIRS"] if file_path.startswith(os.path.join(f["path"], ""))]
+    return max(matches, key=lambda f: len(f["path"]), default=None)
+
+def file_busy(file_path):
+    """Why a file can't be encoded yet (still being written or locked), or None if ready"""
+    try:
+        if not file_quiet_for(file_path, CONFIG["STABLE_SECONDS"], stability_seen):
+            return f"changed within the last {CONFIG['STABLE_SECONDS']}s"
+    except OSError:
+        return "not accessible"
+    if CONFIG["CHECK_OPEN_WRITERS"]:
+        writers = open_writers(file_path)
+        if writers:
+            return f"open for writing by PID {', '.join(map(str, writers))}"
+    try:
+        os.rename(file_path, file_path)  # Fails while another process holds a lock (Windows)
+    except OSError:
+        return "locked by another process"
+    return None
+
+def defer_job(file_path, seconds):
+    """Retry a file that couldn't start after `seconds` (it stays in queued_files meanwhile)"""
+    with deferred_lock:
+        deferred_jobs.append((time.time() + seconds, file_path))
+
+def temp_dir_for(file_path, source=None):
+    """
+    Temp directory for a file's encode output. SOURCE_DIRS "temp_folder" wins;
+    otherwise TEMP_FOLDER if it is on the source's filesystem, else a hidden
+    SOURCE_TEMP_DIR in the source folder, so the final replace is a rename
+    instead of a multi-GB copy. Falls back to TEMP_FOLDER.
+    source: the coordinator's folder entry for a remote job (see job_source).
+    """
+    folder_config = folder_for_path(file_path) or source
+    try:
+        if folder_config and folder_config["temp_folder"]:
+            os.makedirs(folder_config["temp_folder"], exist_ok=True)
+            return folder_config["temp_folder"]
+        if CONFIG["SOURCE_TEMP_DIRS"] and folder_config:
+            source_dev = os.stat(os.path.dirname(file_path)).st_dev
+            if os.stat(CONFIG["TEMP_FOLDER"]).st_dev == source_dev:
+                return CONFIG["TEMP_FOLDER"]
+            temp_dir = os.path.join(folder_config["path"], SOURCE_TEMP_DIR)
+            os.makedirs(temp_dir, exist_ok=True)
+            if os.stat(temp_dir).st_dev == source_dev:
+                return temp_dir
+    except OSError as e:
+        logger.warning(f"Cannot use source temp dir for {os.path.basename(file_path)}: {e}")
+    return CONFIG["TEMP_FOLDER"]
+
+def reserve_space(worker, temp_dir, need_gb):
+    """
+    Admission control: reserve need_gb on temp_dir's filesystem for this worker.
+    Space already reserved by other running jobs on the same filesystem counts as used.
+    Returns None if the job fits, else a reason string.
+    """
+    try:
+        dev = os.stat(temp_dir).st_dev
+        free_gb = shutil.disk_usage(temp_dir).free / (1024**3)
+    except OSError:
+        return None  # Can't tell - let FFmpeg try
+    with space_lock:
+        reserved = sum(gb for d, gb in space_reserved.values() if d == dev)
+        available = free_gb - reserved - CONFIG["FREE_SPACE_HEADROOM_GB"]
+        if available < need_gb:
+            return (f"needs {need_gb:.1f} GB + {CONFIG['FREE_SPACE_HEADROOM_GB']} GB headroom, "
+                    f"{free_gb - reserved:.1f} GB free in {temp_dir}")
+        space_reserved[worker['id']] = (dev, need_gb)
+    return None
+
+def release_space(worker):
+    with space_lock:
+        space_reserved.pop(worker['id'], None)
+
+def requeue_deferred():
+    """Re-probe and queue deferred files that are due for another try"""
+    now = time.time()
+    with deferred_lock:
+        due = [path for retry_at, path in deferred_jobs if retry_at <= now]
+        deferred_jobs[:] = [job for job in deferred_jobs if job[0] > now]
+    for path in due:
+        queued_files.discard(path)
+        folder_config = folder_for_path(path)
+        try:
+            st = os.stat(path)
+            settled = file_quiet_for(path, CONFIG["STABLE_SECONDS"], stability_seen)
+        except OSError:
+            stability_seen.pop(path, None)
+            logger.info(f"Deferred file gone: {os.path.basename(path)}")
+            continue
+        if folder_config is None:
+            continue
+        if not settled:
+            queued_files.add(path)
+            defer_job(path, CONFIG["STABLE_SECONDS"])
+            continue
+        # Probe again - codec/duration read while the file was still growing may be wrong
+        queue_files(folder_config, [(path, FileStat(st.st_size, st.st_mtime_ns, st.st_ino))])
+
+def wait_for_changes(seconds):
+    """Sleep up to `seconds`, queueing watched-folder changes as they arrive"""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        process_watch_events()
+        expire_leases()
+        requeue_deferred()
+        if not state['processing_active'] and not state['paused']:
+            state['status'] = "Idle"
+        time.sleep(1)
+
+def wait_for_queue():
+    """Wait until all queued jobs are done, queueing watched-folder changes meanwhile"""
+    while True:
+        with job_queue.all_tasks_done:
+            if not job_queue.unfinished_tasks:
+                return
+            job_queue.all_tasks_done.wait(1)
+        process_watch_events()
+        expire_leases()
+        requeue_deferred()
+
+def sample_settings(enc=None):
+    """Encoder settings a sample result is valid for"""
+    enc = enc or CONFIG["ENCODE_SETTINGS"]
+    return [enc["codec"], enc["crf"], enc["preset"], enc.get("x265_params", ""),
+            int(CONFIG["SAMPLE_COUNT"]), CONFIG["SAMPLE_SECONDS"]]
+
+def cached_sample(info, enc=None):
+    """SAMPLE_PRECHECK result stored with the probe, if made with the current settings"""
+    sample = (info or {}).get("sample")
+    if sample and sample.get("settings") == sample_settings(enc):
+        return sample
+    return None
+
+def sample_job(worker, file_path, info):
+    """
+    SAMPLE_PRECHECK for a job about to start: encode SAMPLE_COUNT short clips with
+    ENCODE_SETTINGS in the worker's slot and extrapolate output size and encode
+    speed. The result is kept in the file's probe cache entry, so a file is only
+    sampled once per encoder settings.
+    Returns {"estimated_gb", "ratio", "speed"} or None (too short, failed or interrupted).
+    """
+    enc = job_settings(worker)
+    sample = cached_sample(info, enc)
+    if sample:
+        return sample
+    try:
+        st = os.stat(file_path)
+        worker['status'] = "Sampling..."
+        sample = sample_encode(file_path, os.path.join(CONFIG["TEMP_FOLDER"], "samples"),
+                               enc, (info or {}).get("duration", 0), st.st_size,
+                               count=int(CONFIG["SAMPLE_COUNT"]), seconds=CONFIG["SAMPLE_SECONDS"],
+                               threads=encode_threads(worker), cpu_set=worker['cpu_set'],
+                               check_interrupt=lambda: worker_interrupt(worker), **ffmpeg_priority())
+    except OSError:
+        return None
+    finally:
+        worker['status'] = "Transcoding..."
+    if sample is None:
+        return None
+    
+    sample = dict(sample, settings=sample_settings(enc))
+    file_stat = FileStat(st.st_size, st.st_mtime_ns, st.st_ino)
+    entry = probe_cache_get(probe_cache, file_path, file_stat)
+    if entry is not None:
+        probe_cache_put(probe_cache, file_path, file_stat, dict(entry, sample=sample))
+    return sample
+
+def calibration_fingerprint(enc=None):
+    """Host/encoder/CPU budget the cached HOST_PROFILE must match"""
+    return host_fingerprint(enc or CONFIG["ENCODE_SETTINGS"], sum(w['threads'] for w in state['workers']))
+
+def apply_host_profile(profile):
+    """Use the calibrated preset and seed the scheduler's throughput estimate"""
+    if not profile:
+        return
+    state['host_profile'] = profile
+    CONFIG["ENCODE_SETTINGS"]["preset"] = profile["preset"]
+    if not state['measured_mpixels_per_sec'] and profile.get("mpixels_per_sec"):
+        # Calibration used the whole CPU budget; each worker gets its share
+        state['measured_mpixels_per_sec'] = profile["mpixels_per_sec"] / len(state['workers'])
+    logger.info(f"Host profile: preset {profile['preset']} "
+                f"({profile['gb_per_day']:.0f} GB/day, target {profile['target_gb_per_day']} GB/day)")
+
+def pick_calibration_file(seconds):
+    """Typical encode candidate from the probe cache: median bitrate among non-HEVC files"""
+    entries = [(info.get("bitrate_kbps", 0), path) for path, info in probe_cache_entries(probe_cache)
+               if info.get("codec", "").lower() not in ("hevc", "h265", "av1", "vp9")
+               and info.get("bitrate_kbps", 0) > 0 and info.get("duration", 0) >= seconds * 2]
+    entries = [e for e in sorted(entries) if os.path.exists(e[1])]
+    return entries[len(entries) // 2][1] if entries else None
+
+def calibrate_host(reference=None, enc=None):
+    """
+    Calibrate libx265 presets on this host (see calibrate_encoder) with a reference
+    clip and save the chosen preset to HOST_PROFILE. Returns the profile or None.
+    enc defaults to ENCODE_SETTINGS (workers pass the coordinator's settings).
+    """
+    global calibration_retry_at
+    enc = enc or CONFIG["ENCODE_SETTINGS"]
+    if is_gpu_codec(enc["codec"]):
+        logger.info(f"Preset calibration is for CPU encoders - keeping preset {enc['preset']} for {enc['codec']}")
+        calibration_retry_at = float("inf")
+        return None
+    seconds = CONFIG["CALIBRATION_SECONDS"]
+    reference = reference or CONFIG["CALIBRATION_FILE"] or pick_calibration_file(seconds)
+    info = get_video_info(reference) if reference else None
+    if not info:
+        logger.warning("Preset calibration: no reference video (set CALIBRATION_FILE or wait for the first scan)")
+        calibration_retry_at = time.time() + CALIBRATION_RETRY_SECONDS
+        return None
+    
+    target = CONFIG["TARGET_GB_PER_DAY"]
+    crfs = CONFIG["CALIBRATION_CRFS"] or [enc["crf"]]
+    threads = sum(w['threads'] for w in state['workers'])
+    logger.info(f"Calibrating presets on {os.path.basename(reference)} "
+                f"({describe_video(info)}, {info.get('bitrate_kbps', 0):.0f} kbps), "
+                f"{seconds}s clip, target {target} GB/day")
+    
+    def log_result(r):
+        logger.info(f"  {r['preset']:>9} crf {r['crf']}: {r['fps']:.1f} fps, {r['speed']:.2f}x, "
+                    f"{r['gb_per_day']:.0f} GB/day, size ratio {r['ratio']:.2f}")
+    # Hold encode workers (running encodes are suspended) so throughput is measured on an idle host
+    state['calibrating'] = True
+    try:
+        if any(w['file'] for w in state['workers']):
+            time.sleep(3)  # Let running encodes reach their suspend point
+        results = calibrate_encoder(reference, info, os.path.join(CONFIG["TEMP_FOLDER"], "calibration"),
+                                    enc, CONFIG["CALIBRATION_PRESETS"], crfs, seconds=seconds,
+                                    target_gb_per_day=target, threads=threads,
+                                    check_interrupt=lambda: "pause" if state['paused'] or throttled() else None,
+                                    on_result=log_result)
+    finally:
+        state['calibrating'] = False
+    chosen = choose_preset(results, enc["crf"], target)
+    if not chosen:
+        logger.warning("Preset calibration failed or was interrupted - keeping configured preset")
+        calibration_retry_at = time.time() + CALIBRATION_RETRY_SECONDS
+        return None
+    if chosen["gb_per_day"] < target:
+        logger.warning(f"No preset reaches {target} GB/day on this host - using fastest measured")
+    
+    profile = {
+        "fingerprint": calibration_fingerprint(enc),
+        "calibrated_at": time.time(),
+        "reference": {"file": os.path.basename(reference), "codec": info.get("codec", ""),
+                      "width": info.get("width", 0), "height": info.get("height", 0),
+                      "bitrate_kbps": round(info.get("bitrate_kbps", 0), 1)},
+        "target_gb_per_day": target,
+        "results": results,
+        "preset": chosen["preset"],
+        "gb_per_day": chosen["gb_per_day"],
+        "mpixels_per_sec": chosen["mpixels_per_sec"]
+    }
+    save_host_profile(CONFIG["HOST_PROFILE"], profile)
+    apply_host_profile(profile)
+    return profile
+
+def queue_candidate(folder_config, candidate):
+    """
+    Queue a candidate ranked by estimated GB saved per predicted encode hour.
+    Folders share workers according to their SOURCE_DIRS weight.
+    """
+    file_path, codec, estimated_size, info = candidate
+    queued_files.add(file_path)
+    try:
+        job_store.put(file_path, folder_config["path"], codec, estimated_size, info, os.stat(file_path))
+    except OSError:
+        pass
+    if not CONFIG["PRIORITY_SCHEDULING"]:
+        # Plain FIFO: folder order, then alphabetical
+        job_queue.put_job(candidate)
+        return
+    
+    try:
+        size_gb = os.path.getsize(file_path) / (1024**3)
+    except OSError:
+        size_gb = 0
+    throughput = state['measured_mpixels_per_sec'] or CONFIG["ENCODE_MPIXELS_PER_SEC"]
+    hours = predict_encode_hours(info, size_gb, throughput)
+    sample = cached_sample(info)
+    if sample:
+        estimated_size = sample["estimated_gb"]
+        if sample["speed"] and info.get("duration"):
+            hours = info["duration"] / sample["speed"] / 3600  # Measured by SAMPLE_PRECHECK
+    saved_gb = max(0.0, size_gb - estimated_size)
+    score = saved_gb / max(hours, 1 / 60)
+    job_queue.put_job(candidate, folder=folder_config["path"], weight=folder_config["weight"],
+                      score=score, hours=hours)
+
+def record_encode_result(file_path, codec, info, size_gb, estimated_gb, actual_gb, enc=None):
+    """Append finished encode to ENCODE_HISTORY and refit the compression model"""
+    info = info or {}
+    enc = enc or CONFIG["ENCODE_SETTINGS"]
+    features = source_features(info, size_gb * 1024**3)
+    record = {
+        "file": os.path.basename(file_path),
+        "codec": codec,
+        "width": info.get("width", 0),
+        "height": info.get("height", 0),
+        "fps": info.get("fps", 0),
+        "duration": info.get("duration", 0),
+        "bit_depth": info.get("bit_depth", 0),
+        "hdr": info.get("hdr", ""),
+        "bitrate_kbps": round(features["bitrate_kbps"], 1),
+        "bpp": round(features["bpp"], 5),
+        "size_gb": size_gb,
+        "estimated_gb": estimated_gb,
+        "actual_gb": actual_gb,
+        "encoder": enc["codec"],
+        "crf": enc["crf"],
+        "preset": enc["preset"],
+        "time": time.time()
+    }
+    append_encode_history(CONFIG["ENCODE_HISTORY"], record)
+    with stats_lock:
+        state['encode_history'].append(record)
+        state['compression_model'] = fit_compression_model(model_history())
+
+def model_history():
+    """Encode history recorded with the current encoder and CRF (other settings compress differently)"""
+    enc = CONFIG["ENCODE_SETTINGS"]
+    return [r for r in state['encode_history']
+            if r.get("encoder") == enc["codec"] and r.get("crf") == enc["crf"]]
+
+def record_throughput(worker, info):
+    """
+    Measure this encode's throughput (avg fps, speed, megapixels/s) and fold it
+    into the running estimate used by the scheduler. Returns summary for the log.
+    """
+    elapsed = encode_seconds(worker)
+    frames = worker['progress'].get('frame', 0)
+    if elapsed <= 0 or not frames:
+        return f"{elapsed / 60:.0f} min"
+    avg_fps = frames / elapsed
+    summary = f"{elapsed / 60:.0f} min @ {avg_fps:.1f} fps"
+    ENCODE_FPS.observe(avg_fps)
+    if worker['file_size']:
+        ENCODE_SECONDS_PER_GB.observe(elapsed / worker['file_size'])
+    if worker['duration']:
+        summary += f", {worker['duration'] / elapsed:.2f}x"
+        ENCODE_SPEED.observe(worker['duration'] / elapsed)
+    
+    info = info or {}
+    if info.get('width') and info.get('height'):
+        mpix = info['width'] * info['height'] * avg_fps / 1e6
+        previous = state['measured_mpixels_per_sec']
+        # Exponential moving average, per-worker throughput
+        state['measured_mpixels_per_sec'] = mpix if not previous else previous * 0.7 + mpix * 0.3
+        summary += f", {mpix:.1f} Mpx/s"
+    return summary
+
+def update_active_state():
+    """Mirror active worker jobs into the top-level (single-job) state fields"""
+    active = [w for w in state['workers'] if w['file']]
+    state['processing_active'] = bool(active)
+    state['current_file'] = ", ".join(w['file'] for w in active) if active else "None"
+    if active:
+        state['transcode_start_time'] = active[0]['start_time']
+        state['transcode_file_size'] = active[0]['file_size']
+        state['status'] = "Transcoding..."
+
+def run_job(worker, file_path, codec, estimated_size, info):
+    """
+    Encode one job in a worker slot, waiting out pauses and restarting the file
+    after a mid-encode pause. Returns the transcode_file result ("skipped" if
+    skipped while queued or paused).
+    """
+    # Check for skip before processing
+    if state['skip']:
+        state['skip'] = False
+        logger.info(f"Skipped file (queued): {os.path.basename(file_path)}")
+        return "skipped"
+    
+    while True:
+        while state['paused'] or worker['paused'] or throttled() or state['calibrating']:
+            state['status'] = pause_label(worker)
+            worker['status'] = pause_label(worker)
+            time.sleep(2)
+            # Allow skip during pause
+            if state['skip'] or worker['skip']:
+                state['skip'] = False
+                worker['skip'] = False
+                logger.info(f"Skipped file (paused): {os.path.basename(file_path)}")
+                return "skipped"
+        
+        result = transcode_file(worker, file_path, codec, estimated_size, info)
+        if result != "paused":
+            return result
+        # Paused mid-encode: wait, then restart this file in the same slot
+
+def encode_worker(slot):
+    """Encode worker: takes jobs from job_queue until the process exits"""
+    worker = state['workers'][slot]
+    while True:
+        file_path, codec, estimated_size, info = job_queue.get()
+        QUEUE_BACKLOG.observe(job_queue.qsize())
+        result = None
+        job_store.set_state(file_path, "running")
+        try:
+            result = run_job(worker, file_path, codec, estimated_size, info)
+            if result == "in_use":
+                defer_job(file_path, CONFIG["STABLE_SECONDS"])
+            elif result == "no_space":
+                defer_job(file_path, NO_SPACE_RETRY_SECONDS)
+        except Exception as e:
+            # Keep the slot alive - an unexpected error must not shrink the worker pool
+            logger.error(f"Exception: {e}")
+        finally:
+            job_store.set_state(file_path, JOB_RESULT_STATES.get(result, "failed"), result or "")
+            if result not in ("in_use", "no_space"):
+                queued_files.discard(file_path)
+            worker.update({"file": None, "folder": "", "status": "Idle", "pid": None, "skip": False})
+            update_active_state()
+            push_kuma(CONFIG["KUMA_URL"])
+            job_queue.task_done()
+
+def worker_interrupt(worker):
+    """Pending interrupt for a worker's job: "skip", "pause" or None"""
+    if worker['skip']:
+        return "skip"
+    if state['paused'] or worker['paused'] or throttled():
+        return "pause"
+    if state['calibrating'] and CONFIG["SUSPEND_ON_PAUSE"]:
+        return "pause"  # Suspended, not killed - calibration must not lose encode work
+    return None
+
+def pause_label(worker):
+    """Status while a worker waits: "PAUSED" (by hand), "CALIBRATING" or "THROTTLED" (policy)"""
+    if state['paused'] or worker['paused']:
+        return "PAUSED"
+    return "CALIBRATING" if state['calibrating'] else "THROTTLED"
+
+def print_progress(worker):
+    """Console progress line, at most every 10 s per worker"""
+    if time.time() - worker.get('last_console', 0) >= 10:
+        worker['last_console'] = time.time()
+        print(f"\rProgress [{worker['id']}]: {format_progress(worker)} ETA {format_time_remaining(worker)}", end="", flush=True)
+
+def encode_seconds(worker):
+    """Wall time of the worker's current job, minus the time FFmpeg spent suspended"""
+    now = time.time()
+    with suspend_lock:
+        paused = worker['paused_seconds']
+        if worker['suspended']:
+            paused += now - worker['suspended_at']
+    return now - worker['start_time'] - paused
+
+def pause_options(worker):
+    """run_ffmpeg kwargs: suspend (SIGSTOP) on pause instead of killing, if enabled"""
+    def on_suspend(suspended):
+        # Parallel chunks suspend and resume together: count the pause once
+        with suspend_lock:
+            if suspended:
+                worker['suspended'] += 1
+                if worker['suspended'] == 1:
+                    worker['suspended_at'] = time.time()
             else:
-                # CPU encoding (libx265/libx264)
-                cmd.extend(["-crf", str(enc["crf"])])
-                cmd.extend(["-preset", enc["preset"]])
-            
-            # Common parameters
-            cmd.extend([
-                "-c:a", "copy", "-c:s", "copy", "-map", "0",
-                "-max_muxing_queue_size", "1024"
-            ])
-            
-            # Add x265-specific params if specified (CPU only)
-            if not is_gpu and enc.get("x265_params"):
-                cmd.extend(["-x265-params", enc["x265_params"]])
-            
-            cmd.extend(["-y", output_file])
+                worker['suspended'] -= 1
+                if worker['suspended'] == 0:
+                    worker['paused_seconds'] += time.time() - worker['suspended_at']
+            paused = worker['suspended'] > 0
+        worker['status'] = pause_label(worker) if paused else "Transcoding..."
+        state['status'] = pause_label(worker) if paused else "Transcoding..."
+    return dict(ffmpeg_priority(), **{
+        "suspend_on_pause": CONFIG["SUSPEND_ON_PAUSE"],
+        "pause_kill_seconds": CONFIG["PAUSE_KILL_MINUTES"] * 60,
+        "on_suspend": on_suspend
+    })
+
+def ffmpeg_priority():
+    """run_ffmpeg kwargs: CPU/disk priority of FFmpeg (NICE, IONICE)"""
+    return {"nice": int(CONFIG["NICE"]), "ionice": CONFIG["IONICE"]}
+
+def job_settings(worker):
+    """Encoder settings for the worker's current job: ENCODE_SETTINGS, or the coordinator's for a remote job"""
+    return worker['enc'] or CONFIG["ENCODE_SETTINGS"]
+
+def encode_threads(worker):
+    """FFmpeg threads for a new encode: the worker's share, capped in a QUIET_HOURS threads window"""
+    limit = state['throttle']['threads']
+    if not limit:
+        return worker['threads']
+    return min(worker['threads'] or os.cpu_count() or 1, limit)
+
+# --- THROTTLE POLICY ---
+def throttled():
+    """True while the policy suspends encodes (host busy or a QUIET_HOURS pause window)"""
+    return state['throttle']['mode'] == "pause"
+
+def own_encode_load():
+    """Load per CPU of this watchdog's running encodes (x265 keeps about one thread per CPU of its share busy)"""
+    if throttled() or state['calibrating']:
+        return 0.0  # Suspended
+    cpus = os.cpu_count() or 1
+    threads = sum(w['threads'] or cpus for w in state['workers'] if w['file'])
+    return min(threads, cpus) / cpus
+
+def load_over_limits(load):
+    """
+    What is over LOAD_MAX / PRESSURE_MAX, e.g. "cpu pressure 42%" ("" = nothing).
+    The load average is compared without this watchdog's own encodes.
+    """
+    over = []
+    other_load = None if load["load"] is None else max(0.0, load["load"] - own_encode_load())
+    if CONFIG["LOAD_MAX"] and other_load is not None and other_load > CONFIG["LOAD_MAX"]:
+        over.append(f"load {other_load:.2f}/CPU")
+    for resource in ("cpu", "io"):
+        value = load[resource]
+        if CONFIG["PRESSURE_MAX"] and value is not None and value > CONFIG["PRESSURE_MAX"]:
+            over.append(f"{resource} pressure {value:.0f}%")
+    return ", ".join(over)
+
+def throttle_decision(busy, window):
+    """(mode, reason, threads) for the host load and the active QUIET_HOURS window"""
+    if busy:
+        return "pause", f"busy: {busy}", 0
+    if window:
+        reason = f"quiet hours {window['start']}-{window['end']}"
+        if window.get("action", "pause") == "threads":
+            return "threads", reason, max(1, int(window.get("threads", 2)))
+        return "pause", reason, 0
+    return "", "", 0
+
+def start_policy():
+    """Start policy_loop if load limits or QUIET_HOURS are configured"""
+    if not (CONFIG["LOAD_MAX"] or CONFIG["PRESSURE_MAX"] or CONFIG["QUIET_HOURS"]):
+        return
+    try:
+        active_window(CONFIG["QUIET_HOURS"])
+        for window in CONFIG["QUIET_HOURS"]:
+            throttle_decision("", window)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid QUIET_HOURS ({e}) - quiet hours disabled")
+        CONFIG["QUIET_HOURS"] = []
+    can_suspend = CONFIG["SUSPEND_ON_PAUSE"] and platform.system() != 'Windows'
+    if (CONFIG["LOAD_MAX"] or CONFIG["PRESSURE_MAX"]) and not can_suspend:
+        # Every busy spell would kill the running encodes and restart them from zero
+        logger.error("LOAD_MAX/PRESSURE_MAX need SUSPEND_ON_PAUSE (Linux/macOS) - load throttling disabled")
+        CONFIG["LOAD_MAX"] = CONFIG["PRESSURE_MAX"] = 0
+    if not can_suspend and any(w.get("action", "pause") == "pause" for w in CONFIG["QUIET_HOURS"]):
+        logger.warning("QUIET_HOURS: encodes running when a pause window starts are killed and restart later "
+                       "(SUSPEND_ON_PAUSE is off)")
+    if CONFIG["PRESSURE_MAX"] and read_pressure("cpu") is None:
+        logger.warning("PRESSURE_MAX: /proc/pressure not available (needs Linux 4.20+ with PSI) - only LOAD_MAX is checked")
+    if not (CONFIG["LOAD_MAX"] or CONFIG["PRESSURE_MAX"] or CONFIG["QUIET_HOURS"]):
+        return
+    threading.Thread(target=policy_loop, daemon=True).start()
+
+def policy_loop():
+    """
+    Throttle policy: suspend encodes while the host is busy (LOAD_MAX, PRESSURE_MAX)
+    and apply QUIET_HOURS windows (suspend, or fewer threads for new encodes).
+    A busy host counts as calm again once it stayed below the limits for
+    THROTTLE_RESUME_SECONDS, so a short dip doesn't restart encodes. If the host
+    gets busy again soon after encodes resumed (e.g. the encodes themselves push
+    the pressure over the limit), that calm time doubles, up to THROTTLE_BACKOFF_MAX x.
+    """
+    busy, calm_since = "", None
+    resumed_at, backoff = 0, 1
+    while True:
+        over = load_over_limits(system_load())
+        if over:
+            if not busy:
+                recent = time.time() - resumed_at < THROTTLE_REPEAT_SECONDS
+                backoff = min(backoff * 2, THROTTLE_BACKOFF_MAX) if recent else 1
+                if recent:
+                    logger.info(f"Throttle: busy again soon after resuming - waiting "
+                                f"{CONFIG['THROTTLE_RESUME_SECONDS'] * backoff}s of calm next time")
+            busy = busy or over
+            calm_since = None
+        elif busy:
+            calm_since = calm_since or time.time()
+            if time.time() - calm_since >= CONFIG["THROTTLE_RESUME_SECONDS"] * backoff:
+                busy, calm_since = "", None
+                resumed_at = time.time()
+        
+        mode, reason, threads = throttle_decision(busy, active_window(CONFIG["QUIET_HOURS"]))
+        current = state['throttle']
+        if (mode, reason, threads) != (current['mode'], current['reason'], current['threads']):
+            if mode == "pause":
+                logger.info(f"Throttle: encodes suspended ({reason})")
+            elif mode == "threads":
+                logger.info(f"Throttle: new encodes limited to {threads} threads ({reason})")
+            else:
+                logger.info("Throttle: off - encodes run at full speed")
+            state['throttle'] = {"mode": mode, "reason": reason, "threads": threads}
+        time.sleep(POLICY_CHECK_SECONDS)
+
+def use_chunked_encoding(info):
+    """Chunk only long files with a known duration"""
+    duration = (info or {}).get("duration", 0)
+    return (CONFIG["CHUNKED_ENCODING"] and duration
+            and duration >= CONFIG["CHUNK_MIN_MINUTES"] * 60
+            and duration > CONFIG["CHUNK_SECONDS"])
+
+def encode_chunked(worker, file_path, output_file, info):
+    """
+    Encode a file as time-range chunks in parallel, then concat losslessly.
+    Finished chunks are checkpointed next to output_file, so pause, skip-back or a crash
+    only re-encode the chunks that were in progress.
+    Returns (returncode, interrupt_reason, chunk_dir).
+    """
+    enc = job_settings(worker)
+    duration = info["duration"]
+    chunk_dir, chunks = plan_chunks(os.path.dirname(output_file), file_path, os.stat(file_path),
+                                    duration, CONFIG["CHUNK_SECONDS"], enc)
+    
+    worker_threads = encode_threads(worker)
+    total_threads = worker_threads or os.cpu_count() or 1
+    parallel = int(CONFIG["CHUNK_WORKERS"]) or max(1, round(total_threads / 8))
+    parallel = max(1, min(parallel, len(chunks)))
+    threads = max(1, total_threads // parallel) if parallel > 1 or worker_threads else 0
+    
+    todo = [c for c in chunks if not os.path.exists(c[3])]
+    done_seconds = sum((c[2] or duration - c[1]) for c in chunks if os.path.exists(c[3]))
+    logger.info(f"Chunked encode: {len(chunks)} x {CONFIG['CHUNK_SECONDS']}s, {parallel} parallel")
+    if len(todo) < len(chunks):
+        logger.info(f"Resuming: {len(chunks) - len(todo)}/{len(chunks)} chunks already encoded")
+    
+    lock = threading.Lock()
+    inflight = {}   # chunk index -> progress dict
+    stop = []       # first interrupt reason, shared by all chunk encodes
+    frames_done = 0
+    
+    def aggregate():
+        # Whole-file progress: finished chunks + chunks in flight
+        with lock:
+            current = list(inflight.values())
+            worker['progress'] = {
+                "out_time": done_seconds + sum(p.get("out_time", 0) for p in current),
+                "fps": sum(p.get("fps", 0) for p in current),
+                "speed": sum(p.get("speed", 0) for p in current),
+                "frame": frames_done + sum(p.get("frame", 0) for p in current)
+            }
+        print_progress(worker)
+    
+    def check():
+        # Once one chunk stops for good, every other chunk stops for the same reason
+        return stop[0] if stop else worker_interrupt(worker)
+    
+    def encode_chunk(chunk):
+        nonlocal done_seconds, frames_done
+        index, start, length, chunk_path = chunk
+        # Paused between chunks: wait here (running chunks are suspended, not killed)
+        if not stop and worker_interrupt(worker) == "pause" and CONFIG["SUSPEND_ON_PAUSE"]:
+            on_suspend = pause_options(worker)["on_suspend"]
+            on_suspend(True)
+            while not stop and worker_interrupt(worker) == "pause":
+                time.sleep(1)
+            on_suspend(False)
+        reason = check()
+        if reason:
+            with lock:
+                if not stop:
+                    stop.append(reason)
+            return 0
+        part_file = chunk_path + ".part.mkv"
+        cmd = build_encode_cmd(file_path, part_file, enc, threads=threads,
+                               start=start, length=length, video_only=True)
+        progress = {}
+        with lock:
+            inflight[index] = progress
+        returncode, reason = run_ffmpeg(cmd, progress, check, cpu_set=worker['cpu_set'],
+                                        on_progress=aggregate, on_start=lambda p: worker.update({"pid": p.pid}),
+                                        **pause_options(worker))
+        with lock:
+            del inflight[index]
+            if returncode == 0 and not reason and os.path.exists(part_file):
+                os.replace(part_file, chunk_path)  # Checkpoint: chunk done
+                done_seconds += length or (duration - start)
+                frames_done += progress.get("frame", 0)
+            elif not stop:
+                stop.append(reason or "failed")
+        if returncode != 0 or reason:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            if not reason:
+                logger.error(f"Chunk {index} failed (code {returncode})")
+        return returncode
+    
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="chunk") as pool:
+        list(pool.map(encode_chunk, todo))
+    
+    if stop and stop[0] != "failed":
+        return 1, stop[0], chunk_dir
+    if stop or any(not os.path.exists(c[3]) for c in chunks):
+        return 1, None, chunk_dir
+    
+    # Lossless join + audio/subtitles/chapters from source
+    list_file = os.path.join(chunk_dir, "concat.txt")
+    write_concat_list(list_file, [c[3] for c in chunks])
+    returncode, reason = run_ffmpeg(build_concat_cmd(list_file, file_path, output_file), {},
+                                    lambda: worker_interrupt(worker),
+                                    on_start=lambda p: worker.update({"pid": p.pid}), **pause_options(worker))
+    return returncode, reason, chunk_dir
+
+def transcode_file(worker, file_path, codec, estimated_size, info=None):
+    """
+    Transcode one file in the given worker slot.
+    Returns "done", "no_savings", "skipped", "paused", "failed", "in_use" or "no_space".
+    """
+    file_name = os.path.basename(file_path)
+    busy = file_busy(file_path)
+    if busy:
+        logger.info(f"Not ready: {file_name} ({busy}) - retrying in {CONFIG['STABLE_SECONDS']}s")
+        return "in_use"
+
+    try:
+        orig_size_gb = os.path.getsize(file_path) / (1024**3)
+    except OSError as e:
+        logger.error(f"Cannot read {file_name}: {e}")
+        return "failed"
+    
+    # Output (and chunks) must fit next to everything else running on that disk
+    temp_dir = temp_dir_for(file_path, worker['source'])
+    chunked = use_chunked_encoding(info)
+    need_gb = (estimated_size or orig_size_gb) * 1.25 * (2 if chunked else 1)
+    no_space = reserve_space(worker, temp_dir, need_gb)
+    if no_space:
+        logger.warning(f"Not enough space: {file_name} ({no_space}) - retrying in {NO_SPACE_RETRY_SECONDS // 60} min")
+        return "no_space"
+    
+    worker.update({
+        "file": file_name,
+        "folder": os.path.dirname(file_path),
+        "status": "Transcoding...",
+        "start_time": time.time(),
+        "paused_seconds": 0,
+        "suspended": 0,
+        "file_size": orig_size_gb,
+        "duration": (info or {}).get("duration", 0),
+        "progress": {},
+        "outcome": {},
+        "skip": False
+    })
+    update_active_state()
+    
+    if CONFIG["SAMPLE_PRECHECK"]:
+        sample = sample_job(worker, file_path, info)
+        if sample:
+            savings_gb = orig_size_gb - sample["estimated_gb"]
+            if savings_gb < CONFIG["MIN_SAVINGS_GB"]:
+                logger.info(f"SKIP ({codec.upper()}): {file_name} - {orig_size_gb:.1f}GB, "
+                            f"sample encode projects {sample['estimated_gb']:.2f}GB "
+                            f"(savings {savings_gb:.2f}GB < {CONFIG['MIN_SAVINGS_GB']}GB threshold)")
+                book_skip("sample", orig_size_gb)
+                journal.add_processed(file_path)
+                journal.flush()
+                worker['outcome'] = {"orig_gb": orig_size_gb, "skip_reason": "sample"}
+                release_space(worker)
+                return "no_savings"
+            logger.info(f"Sample: {file_name} - est. {estimated_size:.2f}GB → "
+                        f"{sample['estimated_gb']:.2f}GB, speed {sample['speed']:.2f}x")
+            estimated_size = sample["estimated_gb"]
+    
+    details = describe_video(info)
+    logger.info(f"START: {file_name} ({codec}{', ' + details if details else ''}) - "
+                f"{orig_size_gb:.2f} GB → est. {estimated_size:.2f} GB")
+    
+    # Parallel workers get their own temp name (same file name can exist in two folders)
+    temp_name = file_name + CONFIG["OUTPUT_SUFFIX"]
+    if len(state['workers']) > 1:
+        temp_name = f"w{worker['id']}_{temp_name}"
+    output_file = os.path.join(temp_dir, temp_name)
+    
+    # Build FFmpeg command from config (or the coordinator's settings for a remote job)
+    enc = job_settings(worker)
+    threads = encode_threads(worker)
+    cmd = build_encode_cmd(file_path, output_file, enc, threads=threads)
+    
+    # Log encoding settings
+    is_gpu = is_gpu_codec(enc["codec"])
+    encoder_type = "GPU" if is_gpu else "CPU"
+    params_info = enc.get('x265_params', 'none') if not is_gpu else 'GPU defaults'
+    threads_info = f", Threads={threads}" if threads else ""
+    logger.info(f"Encoding ({encoder_type}): {enc['codec']}, CRF={enc['crf']}, Preset={enc['preset']}, Params={params_info}{threads_info}")
+
+    try:
+        # Ensure temp file doesn't exist from previous failed run
+        if os.path.exists(output_file):
+            logger.warning(f"Removing stale temp file: {output_file}")
+            os.remove(output_file)
+        
+        chunk_dir = None
+        if chunked:
+            returncode, reason, chunk_dir = encode_chunked(worker, file_path, output_file, info)
+        else:
+            returncode, reason = run_ffmpeg(
+                cmd, worker['progress'], lambda: worker_interrupt(worker),
+                cpu_set=worker['cpu_set'], on_progress=lambda: print_progress(worker),
+                on_start=lambda p: worker.update({"pid": p.pid}), **pause_options(worker))
+        
+        if reason:
+            # Clean up temp file
+            if os.path.exists(output_file): 
+                os.remove(output_file)
             
-            # Log encoding settings
-            encoder_type = "GPU" if is_gpu else "CPU"
-            params_info = enc.get('x265_params', 'none') if not is_gpu else 'GPU defaults'
-            logger.info(f"Encoding ({encoder_type}): {codec}, CRF={enc['crf']}, Preset={enc['preset']}, Params={params_info}")
+            if reason == "skip":
+                worker['skip'] = False
+                if chunk_dir:
+                    shutil.rmtree(chunk_dir, ignore_errors=True)
+                logger.info(f"Skipped file: {file_name}")
+                return "skipped"
+            else:
+                # Finished chunks stay checkpointed in chunk_dir
+                logger.info(f"Paused - will resume on: {file_name}")
+                return "paused"
 
-            try:
-                # Ensure temp file doesn't exist from previous failed run
-                if os.path.exists(output_file):
-                    logger.warning(f"Removing stale temp file: {output_file}")
+        if returncode == 0 and os.path.exists(output_file):
+            if chunk_dir:
+                shutil.rmtree(chunk_dir, ignore_errors=True)  # Joined - checkpoints no longer needed
+
+            orig_s = os.path.getsize(file_path) / (1024**3)
+            new_s = os.path.getsize(output_file) / (1024**3)
+            worker['outcome'] = {"orig_gb": orig_s, "new_gb": new_s}
+            record_encode_result(file_path, codec, info, orig_s, estimated_size, new_s, enc)
+            
+            if new_s < orig_s and CONFIG["VERIFY_OUTPUT"]:
+                worker['status'] = "Verifying..."
+                verify_started = time.time()
+                problems = verify_output(info, output_file, samples=int(CONFIG["VERIFY_SAMPLES"]),
+                                         seconds=CONFIG["VERIFY_SAMPLE_SECONDS"],
+                                         duration_tolerance=CONFIG["VERIFY_DURATION_TOLERANCE"],
+                                         threads=threads, **ffmpeg_priority())
+                if problems:
                     os.remove(output_file)
+                    logger.error(f"VERIFY FAILED: {file_name} - {'; '.join(problems)} (original kept)")
+                    worker['outcome']["verify_failed"] = True
+                    # Remote workers leave the failure count to the coordinator
+                    if CONFIG["ROLE"] != "worker" and verify_failed(file_path, orig_s):
+                        return "no_savings"
+                    return "failed"
+                logger.info(f"Verified: {file_name} ({time.time() - verify_started:.1f}s)")
+            
+            if new_s < orig_s:
+                # Atomic file replacement to prevent corruption
+                # 1. Move new file to temp name in same directory
+                temp_replace = file_path + ".tmp_replace"
+                try:
+                    shutil.move(output_file, temp_replace)
+                    # 2. Atomic replace (overwrites original safely)
+                    os.replace(temp_replace, file_path)
+                    logger.info(f"File replaced atomically: {file_name}")
+                except Exception as e:
+                    # If atomic replace fails, fall back to old method with backup
+                    logger.warning(f"Atomic replace failed, using backup method: {e}")
+                    backup_path = file_path + ".backup"
+                    try:
+                        shutil.move(file_path, backup_path)
+                        shutil.move(output_file, file_path)
+                        os.remove(backup_path)
+                    except Exception as e2:
+                        logger.error(f"File replacement failed critically: {e2}")
+                        # Restore backup if it exists
+                        if os.path.exists(backup_path):
+                            shutil.move(backup_path, file_path)
+                        raise
                 
-                # Cross-platform subprocess
-                popen_kwargs = {
-                    'stdout': subprocess.PIPE,
-                    'stderr': subprocess.STDOUT,
-                    'text': True,
-                    'encoding': 'utf-8',
-                    'errors': 'replace'
-                }
-                if platform.system() == 'Windows':
-                    popen_kwargs['creationflags'] = 0x08000000  # CREATE_NO_WINDOW
-                else:
-                    # Linux: create new process group for easier cleanup
-                    if hasattr(os, 'setpgrp'):
-                        popen_kwargs['preexec_fn'] = os.setpgrp
-                
-                process = subprocess.Popen(cmd, **popen_kwargs)
-                
-                was_interrupted = False
-                was_skipped = False
-                
-                for line in process.stdout:
-                    # Check for skip/pause during transcoding
-                    if state['skip']:
-                        logger.info(f"Skip requested - stopping FFmpeg (PID: {process.pid})...")
-                        kill_process_tree(process.pid)
-                        was_interrupted = True
-                        was_skipped = True
-                        state['skip'] = False
-                        break
-                    
-                    if state['paused']:
-                        logger.info(f"Pause requested - stopping FFmpeg (PID: {process.pid})...")
-                        kill_process_tree(process.pid)
-                        was_interrupted = True
-                        break
-
-                    clean_line = line.strip()
-                    if clean_line and ("frame=" in clean_line or "time=" in clean_line):
-                        if "frame=" in clean_line and "fps=" in clean_line:
-                             if time.time() % 10 < 0.5:
-                                 print(f"\rProgress: {clean_line}", end="", flush=True)
-                    elif clean_line:
-                        logger.info(f"FFmpeg: {clean_line}")
-
-                process.wait() # Wait for the process to complete
+                # Add to processed files list
+                journal.add_processed(file_path)
                 
-                if was_interrupted:
-                    # Clean up temp file
-                    if os.path.exists(output_file): 
-                        os.remove(output_file)
-                    
-                    if was_skipped:
-                        logger.info(f"Skipped file: {file_name}")
-                        continue  # Move to next file
-                    else:
-                        logger.info(f"Paused - will resume on: {file_name}")
-                        break  # Break from candidates loop, will retry this file later
+                with stats_lock:
+                    state['stats']['processed'] += 1
+                    state['stats']['gb_proc'] += orig_s
+                    state['stats']['gb_saved'] += (orig_s - new_s)
+                journal.stats_changed()
+                journal.flush()
+                logger.info(f"SUCCESS: {file_name} (-{orig_s-new_s:.2f} GB) | Est: {estimated_size:.2f} GB, Actual: {new_s:.2f} GB | {record_throughput(worker, info)}")
+                return "done"
+            else:
+                os.remove(output_file)
+                # Mark as processed even if no savings (don't retry)
+                journal.add_processed(file_path)
+                journal.flush()
+                logger.info(f"SKIPPED: {file_name} (No actual savings, will not retry)")
+                return "no_savings"
+        else:
+            # Finished chunks stay checkpointed, so a retry only redoes what failed
+            logger.error(f"FFMPEG ERROR: {file_name}")
+            if os.path.exists(output_file): os.remove(output_file)
+    except Exception as e:
+        logger.error(f"Exception: {e}")
+    finally:
+        release_space(worker)
+    return "failed"
 
-                if process.returncode == 0 and os.path.exists(output_file):
-                    orig_s = os.path.getsize(file_path) / (1024**3)
-                    new_s = os.path.getsize(output_file) / (1024**3)
-                    
-                    if new_s < orig_s:
-                        # Atomic file replacement to prevent corruption
-                        # 1. Move new file to temp name in same directory
-                        temp_replace = file_path + ".tmp_replace"
-                        try:
-                            shutil.move(output_file, temp_replace)
-                            # 2. Atomic replace (overwrites original safely)
-                            os.replace(temp_replace, file_path)
-                            logger.info(f"File replaced atomically: {file_name}")
-                        except Exception as e:
-                            # If atomic replace fails, fall back to old method with backup
-                            logger.warning(f"Atomic replace failed, using backup method: {e}")
-                            backup_path = file_path + ".backup"
-                            try:
-                                shutil.move(file_path, backup_path)
-                                shutil.move(output_file, file_path)
-                                os.remove(backup_path)
-                            except Exception as e2:
-                                logger.error(f"File replacement failed critically: {e2}")
-                                # Restore backup if it exists
-                                if os.path.exists(backup_path):
-                                    shutil.move(backup_path, file_path)
-                                raise
-                        
-                        # Add to processed files list
-                        state['processed_files'].add(file_path)
-                        save_processed_files(CONFIG["PROCESSED_FILES"], state['processed_files'])
-                        
-                        state['stats']['processed'] += 1
-                        state['stats']['gb_proc'] += orig_s
-                        state['stats']['gb_saved'] += (orig_s - new_s)
-                        save_stats(CONFIG["STATS_FILE"], state['stats'])
-                        logger.info(f"SUCCESS: {file_name} (-{orig_s-new_s:.2f} GB) | Est: {estimated_size:.2f} GB, Actual: {new_s:.2f} GB")
-                    else:
-                        os.remove(output_file)
-                        # Mark as processed even if no savings (don't retry)
-                        state['processed_files'].add(file_path)
-                        save_processed_files(CONFIG["PROCESSED_FILES"], state['processed_files'])
-                        logger.info(f"SKIPPED: {file_name} (No actual savings, will not retry)")
-                else:
-                    if not was_interrupted:
-                        logger.error(f"FFMPEG ERROR: {file_name}")
-                    if os.path.exists(output_file): os.remove(output_file)
-            except Exception as e:
-                logger.error(f"Exception: {e}")
-
-            state['current_file'] = "None"
-            state['processing_active'] = False
-            state['current_folder'] = ""
-            push_kuma(CONFIG["KUMA_URL"])
+# --- CLUSTER (coordinator / remote workers) ---
+# The coordinator scans and owns job_queue; remote workers claim jobs over HTTP.
+# A claimed job is leased: workers renew the lease with heartbeats while encoding,
+# and a job whose lease runs out is probed again and re-queued for anyone to take.
 
-        state['status'] = "Idle"
-        logger.info("Processing complete. Checking schedules...")
-        time.sleep(10)  # Brief pause before checking schedules again
+def lease_job(candidate, worker_name):
+    """Coordinator: lease a job taken from job_queue to a remote worker. Returns job id"""
+    job_id = uuid.uuid4().hex
+    claimed_at = time.time()
+    with lease_lock:
+        leases[job_id] = {
+            "job": candidate,
+            "worker": worker_name,
+            "claimed_at": claimed_at,
+            "expires": time.time() + CONFIG["LEASE_SECONDS"],
+            "progress": {},
+            "queued": True      # Taken from job_queue (False: restored by resume_jobs)
+        }
+    job_store.set_state(candidate[0], "running", worker_name)
+    job_store.save_lease(job_id, candidate[0], worker_name, claimed_at)
+    logger.info(f"Leased to {worker_name}: {os.path.basename(candidate[0])}")
+    return job_id
 
-@app.route('/')
-def dashboard():
-    s = state['stats']
-    logs = get_last_logs(CONFIG["LOG_FILE"])
-    pause_icon = "fa-play" if state['paused'] else "fa-pause"
-    pause_color = "#fcc419" if state['paused'] else "#fa5252"
-    
-    # Encode settings summary
-    enc = CONFIG["ENCODE_SETTINGS"]
-    settings_display = f"CRF {enc['crf']} • {enc['preset'].title()}"
-    if enc.get('x265_params'):
-        if 'constrained-intra' in enc['x265_params']:
-            settings_display += " • CI"
-    
-    # Build folder schedule HTML with collapse button
-    folder_schedule_html = ""
-    if len(CONFIG["SOURCE_DIRS"]) >= 1:  # Show even for single folder
-        folder_schedule_html = "<div id='folderScheduleContainer' style='margin-top:10px;background:#25262b;border:1px solid #373a40;border-radius:8px;padding:15px'>"
-        folder_schedule_html += """
-        <div style='display:flex;justify-content:space-between;align-items:center;margin-bottom:10px'>
-            <div style='color:#868e96;font-size:0.8em;text-transform:uppercase'>Folder Schedules</div>
-            <button onclick='toggleFolderSchedule()' style='background:#2c2e33;border:1px solid #373a40;color:#868e96;padding:4px 8px;border-radius:4px;cursor:pointer;font-size:0.7em;transition:all 0.2s' id='folderToggleBtn'>
-                <i class='fa-solid fa-chevron-up'></i> Hide
-            </button>
-        </div>
-        """
-        folder_schedule_html += "<div id='folderScheduleContent' style='display:flex;flex-direction:column;gap:8px'>"
+def finish_remote_job(lease, result, report):
+    """Coordinator: book a remote worker's result like a local encode_worker would"""
+    file_path, codec, estimated_size, info = lease["job"]
+    file_name = os.path.basename(file_path)
+    # Settings the worker actually encoded with (its calibrated preset, not ours)
+    enc = report.get("encode_settings")
+    enc = {**CONFIG["ENCODE_SETTINGS"], **(enc if isinstance(enc, dict) else {})}
+    try:
+        if report.get("orig_gb") and report.get("new_gb"):
+            record_encode_result(file_path, codec, info, report["orig_gb"], estimated_size, report["new_gb"], enc)
+        if result == "done":
+            orig_s, new_s = report.get("orig_gb", 0), report.get("new_gb", 0)
+            journal.add_processed(file_path)
+            with stats_lock:
+                state['stats']['processed'] += 1
+                state['stats']['gb_proc'] += orig_s
+                state['stats']['gb_saved'] += (orig_s - new_s)
+            journal.stats_changed()
+            journal.flush()
+            logger.info(f"SUCCESS ({lease['worker']}): {file_name} (-{orig_s - new_s:.2f} GB) | "
+                        f"Est: {estimated_size:.2f} GB, Actual: {new_s:.2f} GB")
+        elif result == "no_savings":
+            if report.get("skip_reason"):
+                book_skip(report["skip_reason"], report.get("orig_gb", 0))
+            journal.add_processed(file_path)
+            journal.flush()
+            logger.info(f"SKIPPED ({lease['worker']}): {file_name} (No actual savings, will not retry)")
+        elif result in ("in_use", "no_space"):
+            defer_job(file_path, CONFIG["STABLE_SECONDS"] if result == "in_use" else NO_SPACE_RETRY_SECONDS)
+        else:
+            logger.info(f"Remote job {result} ({lease['worker']}): {file_name}")
+            if result == "failed" and report.get("verify_failed") and verify_failed(file_path, report.get("orig_gb", 0)):
+                result = "no_savings"
+    finally:
+        job_store.set_state(file_path, JOB_RESULT_STATES.get(result, "failed"), result)
+        if result not in ("in_use", "no_space"):
+            queued_files.discard(file_path)
+        if lease["queued"]:
+            job_queue.task_done()
+
+def expire_leases():
+    """Coordinator: re-queue jobs whose worker stopped sending heartbeats"""
+    now = time.time()
+    with lease_lock:
+        expired = [job_id for job_id, lease in leases.items() if lease["expires"] <= now]
+        expired = [(job_id, leases.pop(job_id)) for job_id in expired]
+    for job_id, lease in expired:
+        file_path = lease["job"][0]
+        logger.warning(f"Lease expired ({lease['worker']}): {os.path.basename(file_path)} - re-queueing")
+        job_store.drop_lease(job_id)
+        job_store.set_state(file_path, "pending", "lease expired")
+        defer_job(file_path, 0)  # Re-probed first: the worker may have replaced it after all
+        if lease["queued"]:
+            job_queue.task_done()
+
+def cluster_authorized():
+    """Job API request carries the CLUSTER_TOKEN (if one is set)"""
+    token = CONFIG["CLUSTER_TOKEN"]
+    return not token or hmac.compare_digest(request.headers.get("X-Watchdog-Token", ""), token)
+
+def worker_name(worker):
+    return f"{CONFIG['WORKER_NAME'] or socket.gethostname()}#{worker['id']}"
+
+def map_path(path, path_map):
+    """Translate a coordinator path to this host's mount (longest matching prefix wins)"""
+    for prefix in sorted(path_map, key=len, reverse=True):
+        if path == prefix or path.startswith(os.path.join(prefix, "")):
+            return path_map[prefix] + path[len(prefix):]
+    return path
+
+def coordinator_post(path, payload):
+    """Worker: POST JSON to the coordinator's job API. Returns Response or None on network error"""
+    headers = {"X-Watchdog-Token": CONFIG["CLUSTER_TOKEN"]} if CONFIG["CLUSTER_TOKEN"] else {}
+    try:
+        return requests.post(CONFIG["COORDINATOR_URL"].rstrip("/") + path, json=payload,
+                             headers=headers, timeout=15)
+    except requests.RequestException as e:
+        logger.warning(f"Coordinator unreachable: {e}")
+        return None
+
+def heartbeat_job(worker, job, stop):
+    """Worker: renew the job lease until stop is set; skip the encode if the lease is lost"""
+    interval = max(1, job["lease_seconds"] / 3)
+    while not stop.wait(interval):
+        response = coordinator_post(f"/api/jobs/{job['job_id']}/heartbeat",
+                                    {"progress": worker['progress'], "status": worker['status']})
+        if response is not None and response.status_code == 404:
+            logger.warning(f"Lease lost: {os.path.basename(job['file'])} - stopping encode")
+            worker['skip'] = True
+            return
+
+def remote_encode_worker(slot):
+    """Worker: claim jobs from the coordinator, encode them and report the result"""
+    worker = state['workers'][slot]
+    name = worker_name(worker)
+    while True:
+        if state['paused'] or worker['paused'] or throttled() or state['calibrating']:
+            worker['status'] = pause_label(worker)
+            time.sleep(2)
+            continue
+        response = coordinator_post("/api/jobs/claim", {"worker": name})
+        if response is None or response.status_code != 200:
+            if response is not None and response.status_code not in (200, 204):
+                logger.warning(f"Claim refused by coordinator: HTTP {response.status_code}")
+            worker['status'] = "Waiting for jobs"
+            time.sleep(REMOTE_POLL_SECONDS)
+            continue
         
-        for folder_config in CONFIG["SOURCE_DIRS"]:
-            folder_path = folder_config["path"]
-            folder_name = folder_config["name"]
-            next_scan = get_next_scan_time(folder_path)
-            interval = folder_config["scan_interval_minutes"]
-            
-            status_color = "#4dabf7" if scan_schedule[folder_path]["status"] == "Scanning" else "#909296"
-            
-            folder_schedule_html += f"""
-            <div style='display:flex;justify-content:space-between;align-items:center;padding:8px;background:#2c2e33;border-radius:4px'>
-                <div style='flex:1'>
-                    <div style='color:#fff;font-size:0.9em'>{folder_name}</div>
-                    <div style='color:#606266;font-size:0.7em;margin-top:2px'>{folder_path}</div>
-                </div>
-                <div style='text-align:right'>
-                    <div style='color:{status_color};font-size:0.75em;font-weight:bold'>{scan_schedule[folder_path]["status"]}</div>
-                    <div style='color:#868e96;font-size:0.7em;margin-top:2px'>Every {interval}m | Next: {next_scan}</div>
-                </div>
-            </div>
-            """
+        job = response.json()
+        file_path = map_path(job["file"], CONFIG["PATH_MAP"])
+        # Per-job copy: slots may run jobs with different settings at the same time
+        settings = {**CONFIG["ENCODE_SETTINGS"], **job["encode_settings"]}
         
-        folder_schedule_html += "</div></div>"
-    
-    return f"""
-    <!DOCTYPE html><html><head>
-    <meta charset="UTF-8"><meta http-equiv="refresh" content="5">
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>
-    body{{background:#1a1b1e;color:#fff;font-family:sans-serif;margin:0;padding:10px;height:100vh;display:flex;flex-direction:column;box-sizing:border-box}}
-    .card{{background:#25262b;border:1px solid #373a40;border-radius:8px;padding:15px;display:flex;justify-content:space-between;align-items:center;flex-shrink:0;position:relative;gap:15px}}
-    .info-section{{display:flex;align-items:center;gap:20px;flex:1;min-width:0}}
-    .status-group{{display:flex;flex-direction:column;flex:1;min-width:0}}
-    .status{{color:#4dabf7;font-weight:bold;text-transform:uppercase;font-size:1.1em;line-height:1}}
-    .file{{color:#909296;font-size:0.75em;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;margin-top:4px}}
-    .val{{color:#69db7c;font-weight:bold;font-size:1.2em}}
-    .lbl{{color:#868e96;font-size:0.7em;text-transform:uppercase}}
-    .controls{{display:flex;gap:8px}}
-    .btn{{
-        background:#2c2e33;color:#ced4da;border:1px solid #373a40;
-        width:36px;height:36px;border-radius:50%;display:flex;align-items:center;justify-content:center;
-        cursor:pointer;text-decoration:none;transition:all 0.2s;font-size:0.9em;
-    }}
-    .btn:hover{{background:#383a40;color:#fff;border-color:#4dabf7}}
-    .btn-pause{{color:{pause_color};border-color:{pause_color}44}}
-    .btn-pause:hover{{background:{pause_color}22;border-color:{pause_color}}}
-    .log-container{{
-        background:#000;color:#0f0;font-family:'Consolas',monospace;font-size:0.75em;
-        margin-top:10px;padding:10px;border-radius:4px;border:1px solid #333;
-        flex-grow:1;overflow-y:auto;white-space:pre-wrap;word-break:break-all;
-    }}
-    #confirmModal{{
-        display:none;position:fixed;top:0;left:0;width:100%;height:100%;
-        background:rgba(0,0,0,0.8);z-index:1000;justify-content:center;align-items:center;
-    }}
-    .modal-content{{ 
-        background:#25262b;padding:20px;border-radius:8px;border:1px solid #373a40;
-        text-align:center;max-width:280px;box-shadow:0 10px 25px rgba(0,0,0,0.5);
-    }}
-    .modal-btns{{display:flex;gap:10px;justify-content:center;margin-top:20px}}
-    .m-btn{{
-        padding:8px 20px;border-radius:4px;cursor:pointer;font-weight:bold;font-size:0.8em;border:none;
-    }}
-    .m-btn-yes{{background:#fa5252;color:#fff}}
-    .m-btn-no{{background:#373a40;color:#ced4da}}
-    </style></head><body>
-
-    <div id="confirmModal">
-        <div class="modal-content">
-            <div style="font-weight:bold;margin-bottom:10px">Skip file?</div>
-            <div style="font-size:0.8em;color:#909296">Current transcoding will be terminated.</div>
-            <div class="modal-btns">
-                <button class="m-btn m-btn-yes" onclick="window.location.href='/skip'">YES</button>
-                <button class="m-btn m-btn-no" onclick="document.getElementById('confirmModal').style.display='none'">NO</button>
-            </div>
+        stop = threading.Event()
+        threading.Thread(target=heartbeat_job, args=(worker, job, stop), daemon=True).start()
+        result = "failed"
+        try:
+            if os.path.exists(file_path):
+                if CONFIG["AUTO_PRESET"]:
+                    ensure_host_profile(file_path, settings)
+                if state['host_profile']:
+                    settings["preset"] = state['host_profile']["preset"]
+                worker['enc'] = settings
+                worker['source'] = job_source(job)
+                result = run_job(worker, file_path, job["codec"], job["estimated_gb"], job["info"])
+            else:
+                logger.error(f"Not found on this host: {file_path} (check PATH_MAP)")
+        except Exception as e:
+            logger.error(f"Exception: {e}")
+        finally:
+            stop.set()
+            report = dict(worker['outcome'], result=result, encode_settings=settings)
+            worker.update({"file": None, "folder": "", "status": "Idle", "pid": None,
+                           "skip": False, "outcome": {}, "enc": None, "source": None})
+            update_active_state()
+            coordinator_post(f"/api/jobs/{job['job_id']}/result", report)
+
+def job_source(job):
+    """
+    Worker: the coordinator's SOURCE_DIRS entry of a claimed job, mapped to this
+    host's mounts, so temp output stays on the source filesystem (see temp_dir_for)
+    """
+    if not job.get("folder"):
+        return None
+    path_map = CONFIG["PATH_MAP"]
+    temp_folder = job.get("temp_folder") or ""
+    mapped_temp = map_path(temp_folder, path_map)
+    return {
+        "path": map_path(job["folder"], path_map),
+        # A temp_folder outside the mapped mounts is local to the coordinator
+        "temp_folder": mapped_temp if mapped_temp != temp_folder or not path_map else ""
+    }
+
+def ensure_host_profile(reference, enc):
+    """
+    Worker: AUTO_PRESET profile for the coordinator's encoder - loaded from HOST_PROFILE,
+    or calibrated on the first claimed job's file (a worker has no probe cache to pick
+    a reference from). Other slots are held while it runs.
+    """
+    fingerprint = calibration_fingerprint(enc)
+    with calibration_lock:
+        if state['host_profile'] and state['host_profile'].get("fingerprint") == fingerprint:
+            return
+        profile = load_host_profile(CONFIG["HOST_PROFILE"], fingerprint)
+        if profile:
+            apply_host_profile(profile)
+        elif time.time() >= calibration_retry_at:
+            calibrate_host(reference, enc)
+
+def remote_worker_loop():
+    """Worker role: no scanning - encode slots take jobs from COORDINATOR_URL"""
+    logger.info(f"=== HEVC WATCHDOG V1.0 WORKER START === coordinator {CONFIG['COORDINATOR_URL']}")
+    init_workers()
+    start_policy()
+    state['status'] = "Worker"
+    for worker in state['workers']:
+        threading.Thread(target=remote_encode_worker, args=(worker['id'],), daemon=True).start()
+
+# --- WEB API ---
+def encode_settings_display():
+    enc = CONFIG["ENCODE_SETTINGS"]
+    display = f"CRF {enc['crf']} • {enc['preset'].title()}"
+    if enc.get('x265_params') and 'constrained-intra' in enc['x265_params']:
+        display += " • CI"
+    return display
+
+def worker_status(w):
+    """JSON-friendly view of a worker slot"""
+    progress = w['progress'] or {}
+    percent = 0.0
+    if w['file'] and w['duration'] and progress.get('out_time'):
+        percent = min(100.0, progress['out_time'] / w['duration'] * 100)
+    return {
+        "id": w['id'],
+        "file": w['file'] or "",
+        "folder": w['folder'],
+        "status": "PAUSED" if w['paused'] else w['status'],
+        "paused": w['paused'],
+        "threads": w['threads'],
+        "file_size_gb": round(w['file_size'], 2) if w['file'] else 0,
+        "percent": round(percent, 1),
+        "fps": round(progress.get('fps', 0), 1),
+        "speed": round(progress.get('speed', 0), 2),
+        "eta": format_time_remaining(w) if w['file'] else "",
+        "progress": format_progress(w) if w['file'] else ""
+    }
+
+def status_snapshot():
+    """Overall status, stats and workers (/api/status)"""
+    eta = format_time_remaining()
+    active = [w for w in state['workers'] if w['file']]
+    if len(active) == 1 and format_progress(active[0]):
+        eta += " • " + format_progress(active[0])
+    s = state['stats']
+    return {
+        "status": state['status'],
+        "paused": state['paused'],
+        "processing_active": state['processing_active'],
+        "current_file": state['current_file'],
+        "eta": eta,
+        "settings": encode_settings_display(),
+        "queued": job_queue.qsize(),
+        "deferred": len(deferred_jobs),
+        "jobs": job_store.counts(),
+        "throttle": dict(state['throttle']),
+        "stats": {
+            "processed": s['processed'],
+            "gb_proc": round(s['gb_proc'], 2),
+            "gb_saved": round(s['gb_saved'], 2),
+            "files_skipped": s.get('files_skipped', 0),
+            "gb_skipped": round(s.get('gb_skipped', 0), 2),
+            "skip_reasons": dict(s.get('skip_reasons', {}))
+        },
+        "workers": [worker_status(w) for w in state['workers']]
+    }
+
+def folders_snapshot():
+    """Per-folder scan schedule (/api/folders)"""
+    folders = []
+    for folder_config in CONFIG["SOURCE_DIRS"]:
+        folder_path = folder_config["path"]
+        schedule = scan_schedule[folder_path]
+        folders.append({
+            "name": folder_config["name"],
+            "path": folder_path,
+            "status": schedule["status"],
+            "interval_minutes": folder_config["scan_interval_minutes"],
+            "next_scan": get_next_scan_time(folder_path),
+            "last_scan": schedule["last_scan"],
+            "watched": schedule["watched"]
+        })
+    return folders
+
+def queue_snapshot(limit=None):
+    """Pending jobs in dispatch order (/api/queue)"""
+    pending = job_queue.snapshot()
+    items = [{
+        "file": file_path,
+        "codec": codec,
+        "estimated_gb": round(estimated_size, 2),
+        "duration": (info or {}).get("duration", 0),
+        "height": (info or {}).get("height", 0),
+        "hdr": (info or {}).get("hdr", "")
+    } for file_path, codec, estimated_size, info in pending[:limit]]
+    with deferred_lock:
+        deferred = [{"file": path, "retry_in": max(0, int(retry_at - time.time()))}
+                    for retry_at, path in sorted(deferred_jobs)]
+    return {"total": len(pending), "items": items, "deferred": deferred}
+
+def recent_logs(n=120):
+    """Last log lines from the in-memory buffer (no log file reads)"""
+    return "\n".join(log_buffer.lines(n))
+
+# One snapshot per second shared by all dashboard viewers
+_snapshot_cache = {"time": 0, "data": None}
+_snapshot_lock = threading.Lock()
+
+def dashboard_snapshot():
+    with _snapshot_lock:
+        if time.time() - _snapshot_cache["time"] >= 1 or _snapshot_cache["data"] is None:
+            _snapshot_cache["data"] = {
+                "status": status_snapshot(),
+                "folders": folders_snapshot(),
+                "logs": recent_logs()
+            }
+            _snapshot_cache["time"] = time.time()
+        return _snapshot_cache["data"]
+
+@app.route('/api/status')
+def api_status():
+    return jsonify(status_snapshot())
+
+@app.route('/api/folders')
+def api_folders():
+    return jsonify(folders_snapshot())
+
+@app.route('/api/queue')
+def api_queue():
+    limit = request.args.get("limit", 200, type=int)
+    return jsonify(queue_snapshot(limit if limit > 0 else None))
+
+@app.route('/api/logs')
+def api_logs():
+    lines = request.args.get("lines", 120, type=int)
+    return jsonify({"lines": log_buffer.lines(max(1, lines))})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition"""
+    s = state['stats']
+    lines = []
+    lines += render_metric("watchdog_files_processed_total", "counter", "Files transcoded and replaced",
+                           [({}, s['processed'])])
+    lines += render_metric("watchdog_processed_gigabytes_total", "counter", "Source GB transcoded",
+                           [({}, s['gb_proc'])])
+    lines += render_metric("watchdog_saved_gigabytes_total", "counter", "GB saved by transcoding",
+                           [({}, s['gb_saved'])])
+    lines += render_metric("watchdog_files_skipped_total", "counter", "Files skipped",
+                           [({}, s.get('files_skipped', 0))])
+    lines += render_metric("watchdog_skipped_gigabytes_total", "counter", "GB in skipped files",
+                           [({}, s.get('gb_skipped', 0))])
+    lines += render_metric("watchdog_files_skipped_by_reason_total", "counter", "Files skipped by reason",
+                           [({"reason": r}, n) for r, n in sorted(s.get('skip_reasons', {}).items())])
+    lines += render_metric("watchdog_queue_jobs", "gauge", "Jobs waiting for an encode worker",
+                           [({}, job_queue.qsize())])
+    lines += render_metric("watchdog_deferred_jobs", "gauge", "Jobs waiting for a file to settle or for disk space",
+                           [({}, len(deferred_jobs))])
+    lines += render_metric("watchdog_workers_active", "gauge", "Workers currently encoding",
+                           [({}, sum(1 for w in state['workers'] if w['file']))])
+    lines += render_metric("watchdog_workers", "gauge", "Encode worker slots", [({}, len(state['workers']))])
+    lines += render_metric("watchdog_jobs", "gauge", "Jobs in the job store by state",
+                           [({"state": k}, n) for k, n in job_store.counts().items()])
+    lines += render_metric("watchdog_leased_jobs", "gauge", "Jobs being encoded by remote workers",
+                           [({}, len(leases))])
+    lines += render_metric("watchdog_paused", "gauge", "1 when processing is paused", [({}, int(state['paused']))])
+    lines += render_metric("watchdog_throttled", "gauge", "1 while the load / quiet hours policy is active",
+                           [({"mode": mode}, int(state['throttle']['mode'] == mode)) for mode in ("pause", "threads")])
+    lines += render_metric("watchdog_encode_mpixels_per_second", "gauge", "Measured encoder throughput (moving average)",
+                           [({}, state['measured_mpixels_per_sec'])])
+    for histogram in (FFPROBE_SECONDS, SCAN_SECONDS, ENCODE_FPS, ENCODE_SPEED,
+                      ENCODE_SECONDS_PER_GB, QUEUE_BACKLOG):
+        lines += histogram.render()
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events: full "snapshot" event on connect, then only what changed"""
+    def stream():
+        last = dashboard_snapshot()
+        yield f"event: snapshot\ndata: {json.dumps(last)}\n\n"
+        quiet = 0
+        while True:
+            time.sleep(1)
+            current = dashboard_snapshot()
+            diff = dict_diff(last, current)
+            if diff:
+                last = current
+                quiet = 0
+                yield f"data: {json.dumps(diff)}\n\n"
+            else:
+                quiet += 1
+                if quiet >= 15:
+                    quiet = 0
+                    yield ": keepalive\n\n"  # Keeps proxies from closing an idle stream
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def cluster_snapshot():
+    """Jobs leased to remote workers (/api/cluster)"""
+    now = time.time()
+    with lease_lock:
+        items = list(leases.items())
+    jobs = []
+    for job_id, lease in sorted(items, key=lambda item: item[1]["claimed_at"]):
+        file_path, codec, estimated_size, info = lease["job"]
+        progress = lease["progress"]
+        duration = (info or {}).get("duration", 0)
+        percent = min(100.0, progress.get("out_time", 0) / duration * 100) if duration else 0.0
+        jobs.append({
+            "job_id": job_id,
+            "worker": lease["worker"],
+            "file": os.path.basename(file_path),
+            "percent": round(percent, 1),
+            "fps": round(progress.get("fps", 0), 1),
+            "running_for": int(now - lease["claimed_at"]),
+            "lease_expires_in": max(0, int(lease["expires"] - now))
+        })
+    return {"role": CONFIG["ROLE"], "jobs": jobs}
+
+@app.route('/api/cluster')
+def api_cluster():
+    return jsonify(cluster_snapshot())
+
+@app.route('/api/jobs/claim', methods=['POST'])
+def api_claim_job():
+    """Remote worker takes the next job (204 when there is none or processing is paused)"""
+    if CONFIG["ROLE"] != "coordinator":
+        return jsonify({"error": "not a coordinator"}), 404
+    if not cluster_authorized():
+        return jsonify({"error": "bad token"}), 403
+    if state['paused']:
+        return Response(status=204)
+    try:
+        candidate = job_queue.get_nowait()
+    except Empty:
+        return Response(status=204)
+    QUEUE_BACKLOG.observe(job_queue.qsize())
+    payload = request.get_json(silent=True) or {}
+    job_id = lease_job(candidate, str(payload.get("worker", request.remote_addr)))
+    file_path, codec, estimated_size, info = candidate
+    folder_config = folder_for_path(file_path) or {}
+    return jsonify({
+        "job_id": job_id,
+        "file": file_path,
+        "folder": folder_config.get("path", ""),
+        "temp_folder": folder_config.get("temp_folder", ""),
+        "codec": codec,
+        "estimated_gb": estimated_size,
+        "info": info or {},
+        "encode_settings": CONFIG["ENCODE_SETTINGS"],
+        "lease_seconds": CONFIG["LEASE_SECONDS"]
+    })
+
+@app.route('/api/jobs/<job_id>/heartbeat', methods=['POST'])
+def api_job_heartbeat(job_id):
+    """Renew a lease and record the remote encode's progress (404 = lease lost, stop)"""
+    if not cluster_authorized():
+        return jsonify({"error": "bad token"}), 403
+    payload = request.get_json(silent=True) or {}
+    with lease_lock:
+        lease = leases.get(job_id)
+        if lease is None:
+            return jsonify({"error": "unknown or expired lease"}), 404
+        lease["expires"] = time.time() + CONFIG["LEASE_SECONDS"]
+        lease["progress"] = payload.get("progress") or {}
+    return jsonify({"ok": True})
+
+@app.route('/api/jobs/<job_id>/result', methods=['POST'])
+def api_job_result(job_id):
+    """Remote worker reports how a job ended ({"result", "orig_gb", "new_gb", "encode_settings"})"""
+    if not cluster_authorized():
+        return jsonify({"error": "bad token"}), 403
+    payload = request.get_json(silent=True) or {}
+    with lease_lock:
+        lease = leases.pop(job_id, None)
+    if lease is None:
+        return jsonify({"error": "unknown or expired lease"}), 404
+    job_store.drop_lease(job_id)
+    finish_remote_job(lease, payload.get("result", "failed"), payload)
+    return jsonify({"ok": True})
+
+@app.route('/')
+def dashboard():
+    # Static shell - content is filled in from /api/events
+    return DASHBOARD_HTML
+
+DASHBOARD_HTML = r"""<!DOCTYPE html><html><head>
+<meta charset="UTF-8">
+<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+<style>
+body{background:#1a1b1e;color:#fff;font-family:sans-serif;margin:0;padding:10px;height:100vh;display:flex;flex-direction:column;box-sizing:border-box}
+.card{background:#25262b;border:1px solid #373a40;border-radius:8px;padding:15px;display:flex;justify-content:space-between;align-items:center;flex-shrink:0;position:relative;gap:15px}
+.panel{margin-top:10px;background:#25262b;border:1px solid #373a40;border-radius:8px;padding:15px}
+.row{display:flex;justify-content:space-between;align-items:center;padding:8px;background:#2c2e33;border-radius:4px;gap:10px}
+.info-section{display:flex;align-items:center;gap:20px;flex:1;min-width:0}
+.status-group{display:flex;flex-direction:column;flex:1;min-width:0}
+.status{color:#4dabf7;font-weight:bold;text-transform:uppercase;font-size:1.1em;line-height:1}
+.file{color:#909296;font-size:0.75em;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;margin-top:4px}
+.val{color:#69db7c;font-weight:bold;font-size:1.2em}
+.lbl{color:#868e96;font-size:0.7em;text-transform:uppercase}
+.controls{display:flex;gap:8px}
+.btn{
+    background:#2c2e33;color:#ced4da;border:1px solid #373a40;
+    width:36px;height:36px;border-radius:50%;display:flex;align-items:center;justify-content:center;
+    cursor:pointer;text-decoration:none;transition:all 0.2s;font-size:0.9em;
+}
+.btn:hover{background:#383a40;color:#fff;border-color:#4dabf7}
+.btn-pause{color:#fa5252;border-color:#fa525244}
+.btn-pause:hover{background:#fa525222;border-color:#fa5252}
+.btn-pause.paused{color:#fcc419;border-color:#fcc41944}
+.btn-pause.paused:hover{background:#fcc41922;border-color:#fcc419}
+.log-container{
+    background:#000;color:#0f0;font-family:'Consolas',monospace;font-size:0.75em;
+    margin-top:10px;padding:10px;border-radius:4px;border:1px solid #333;
+    flex-grow:1;overflow-y:auto;white-space:pre-wrap;word-break:break-all;
+}
+#confirmModal{
+    display:none;position:fixed;top:0;left:0;width:100%;height:100%;
+    background:rgba(0,0,0,0.8);z-index:1000;justify-content:center;align-items:center;
+}
+.modal-content{
+    background:#25262b;padding:20px;border-radius:8px;border:1px solid #373a40;
+    text-align:center;max-width:280px;box-shadow:0 10px 25px rgba(0,0,0,0.5);
+}
+.modal-btns{display:flex;gap:10px;justify-content:center;margin-top:20px}
+.m-btn{padding:8px 20px;border-radius:4px;cursor:pointer;font-weight:bold;font-size:0.8em;border:none}
+.m-btn-yes{background:#fa5252;color:#fff}
+.m-btn-no{background:#373a40;color:#ced4da}
+</style></head><body>
+
+<div id="confirmModal">
+    <div class="modal-content">
+        <div style="font-weight:bold;margin-bottom:10px">Skip file?</div>
+        <div style="font-size:0.8em;color:#909296">Current transcoding will be terminated.</div>
+        <div class="modal-btns">
+            <button class="m-btn m-btn-yes" onclick="action('/skip');document.getElementById('confirmModal').style.display='none'">YES</button>
+            <button class="m-btn m-btn-no" onclick="document.getElementById('confirmModal').style.display='none'">NO</button>
         </div>
     </div>
+</div>
 
-    <div class="card">
-        <div class="info-section">
-            <div class="status-group">
-                <div class="status">{state['status']}</div>
-                <div class="file">{state['current_file']}</div>
-                {'<div class="file"><i class="fa-solid fa-clock"></i> ETA: ' + format_time_remaining() + '</div>' if state['processing_active'] else ''}
-                {'<div class="file"><i class="fa-solid fa-cog"></i> ' + settings_display + '</div>' if state['processing_active'] else ''}
-            </div>
-            <div class="controls">
-                <a href="/toggle_pause" class="btn btn-pause" title="Pause/Start"><i class="fa-solid {pause_icon}"></i></a>
-                <a href="javascript:void(0)" class="btn" title="Skip current file" onclick="document.getElementById('confirmModal').style.display='flex'"><i class="fa-solid fa-forward-step"></i></a>
-            </div>
+<div class="card">
+    <div class="info-section">
+        <div class="status-group">
+            <div class="status" id="status">...</div>
+            <div class="file" id="currentFile"></div>
+            <div class="file" id="eta" style="display:none"><i class="fa-solid fa-clock"></i> ETA: <span></span></div>
+            <div class="file" id="settings" style="display:none"><i class="fa-solid fa-cog"></i> <span></span></div>
         </div>
-        <div style="display:flex;gap:20px;flex-shrink:0">
-            <div style="text-align:center"><span class="val">{s['processed']}</span><br><span class="lbl">Files</span></div>
-            <div style="text-align:center"><span class="val">{s['gb_proc']:.1f}</span><br><span class="lbl">GB Proc</span></div>
-            <div style="text-align:center"><span class="val">{s['gb_saved']:.1f}</span><br><span class="lbl">Savings</span></div>
-            <div style="text-align:center"><span class="val">{s.get('files_skipped', 0)}</span><br><span class="lbl">Skipped</span></div>
+        <div class="controls">
+            <a href="javascript:void(0)" class="btn btn-pause" id="pauseBtn" title="Pause/Start" onclick="action('/toggle_pause')"><i class="fa-solid fa-pause"></i></a>
+            <a href="javascript:void(0)" class="btn" title="Skip current file" onclick="document.getElementById('confirmModal').style.display='flex'"><i class="fa-solid fa-forward-step"></i></a>
         </div>
     </div>
-    {folder_schedule_html}
-    <div class="log-container">{logs}</div>
-    <script>
-        var objDiv = document.querySelector(".log-container");
-        if(objDiv) objDiv.scrollTop = objDiv.scrollHeight;
+    <div style="display:flex;gap:20px;flex-shrink:0">
+        <div style="text-align:center"><span class="val" id="statProcessed">0</span><br><span class="lbl">Files</span></div>
+        <div style="text-align:center"><span class="val" id="statProc">0.0</span><br><span class="lbl">GB Proc</span></div>
+        <div style="text-align:center"><span class="val" id="statSaved">0.0</span><br><span class="lbl">Savings</span></div>
+        <div style="text-align:center"><span class="val" id="statSkipped">0</span><br><span class="lbl">Skipped</span></div>
+    </div>
+</div>
+<div id="workersContainer" class="panel" style="display:none;flex-direction:column;gap:8px"></div>
+<div id="folderScheduleContainer" class="panel" style="display:none">
+    <div style='display:flex;justify-content:space-between;align-items:center;margin-bottom:10px'>
+        <div style='color:#868e96;font-size:0.8em;text-transform:uppercase'>Folder Schedules</div>
+        <button onclick='toggleFolderSchedule()' style='background:#2c2e33;border:1px solid #373a40;color:#868e96;padding:4px 8px;border-radius:4px;cursor:pointer;font-size:0.7em;transition:all 0.2s' id='folderToggleBtn'>
+            <i class='fa-solid fa-chevron-up'></i> Hide
+        </button>
+    </div>
+    <div id='folderScheduleContent' style='display:flex;flex-direction:column;gap:8px'></div>
+</div>
+<div class="log-container" id="logs"></div>
+<script>
+    var model = {};
+    
+    function esc(text) {
+        var div = document.createElement('div');
+        div.textContent = text == null ? '' : String(text);
+        return div.innerHTML;
+    }
+    
+    // Apply a diff from /api/events (nested objects merged, null = removed)
+    function merge(target, diff) {
+        for (var key in diff) {
+            var value = diff[key];
+            if (value === null) {
+                delete target[key];
+            } else if (typeof value === 'object' && !Array.isArray(value) &&
+                       typeof target[key] === 'object' && target[key] !== null && !Array.isArray(target[key])) {
+                merge(target[key], value);
+            } else {
+                target[key] = value;
+            }
+        }
+    }
+    
+    function action(url) {
+        fetch(url, {redirect: 'manual'});  // New state arrives over the event stream
+    }
+    
+    function renderStatus(st) {
+        document.getElementById('status').textContent = st.status + (st.throttle.mode ? ' • ' + st.throttle.reason : '');
+        document.getElementById('currentFile').textContent = st.current_file;
+        var eta = document.getElementById('eta');
+        eta.style.display = st.processing_active ? '' : 'none';
+        eta.querySelector('span').textContent = st.eta;
+        var settings = document.getElementById('settings');
+        settings.style.display = st.processing_active ? '' : 'none';
+        settings.querySelector('span').textContent = st.settings;
         
-        // Toggle folder schedule visibility
-        function toggleFolderSchedule() {{
-            var content = document.getElementById('folderScheduleContent');
-            var btn = document.getElementById('folderToggleBtn');
-            var isHidden = content.style.display === 'none';
-            
-            if (isHidden) {{
-                content.style.display = 'flex';
-                btn.innerHTML = '<i class="fa-solid fa-chevron-up"></i> Hide';
-            }} else {{
-                content.style.display = 'none';
-                btn.innerHTML = '<i class="fa-solid fa-chevron-down"></i> Show';
-            }}
-            
-            // Save state to localStorage
-            localStorage.setItem('folderScheduleCollapsed', !isHidden);
-        }}
+        var pauseBtn = document.getElementById('pauseBtn');
+        pauseBtn.classList.toggle('paused', st.paused);
+        pauseBtn.innerHTML = '<i class="fa-solid ' + (st.paused ? 'fa-play' : 'fa-pause') + '"></i>';
+        
+        document.getElementById('statProcessed').textContent = st.stats.processed;
+        document.getElementById('statProc').textContent = st.stats.gb_proc.toFixed(1);
+        document.getElementById('statSaved').textContent = st.stats.gb_saved.toFixed(1);
+        document.getElementById('statSkipped').textContent = st.stats.files_skipped;
+        
+        // Per-worker rows (parallel mode only)
+        var container = document.getElementById('workersContainer');
+        if (st.workers.length > 1) {
+            var html = "<div style='color:#868e96;font-size:0.8em;text-transform:uppercase'>Workers</div>";
+            st.workers.forEach(function(w) {
+                var detail = w.file ? ' • ETA: ' + w.eta + ' • ' + w.progress : '';
+                html += "<div class='row'><div style='flex:1;min-width:0'>" +
+                    "<div style='color:#fff;font-size:0.9em;overflow:hidden;text-overflow:ellipsis;white-space:nowrap'>#" + w.id + ' ' + esc(w.file || '-') + "</div>" +
+                    "<div style='color:#868e96;font-size:0.7em;margin-top:2px'>" + esc(w.status) + ' • ' + w.threads + ' threads' + esc(detail) + "</div></div>" +
+                    "<div class='controls'>" +
+                    "<a href='javascript:void(0)' class='btn' title='Pause/Start worker' onclick=\"action('/toggle_pause/" + w.id + "')\"><i class='fa-solid " + (w.paused ? 'fa-play' : 'fa-pause') + "'></i></a>" +
+                    "<a href='javascript:void(0)' class='btn' title='Skip worker file' onclick=\"action('/skip/" + w.id + "')\"><i class='fa-solid fa-forward-step'></i></a>" +
+                    "</div></div>";
+            });
+            container.innerHTML = html;
+            container.style.display = 'flex';
+        } else {
+            container.style.display = 'none';
+        }
+    }
+    
+    function renderFolders(folders) {
+        document.getElementById('folderScheduleContainer').style.display = folders.length ? '' : 'none';
+        var html = '';
+        folders.forEach(function(f) {
+            var color = f.status === 'Scanning' ? '#4dabf7' : '#909296';
+            html += "<div class='row'><div style='flex:1'>" +
+                "<div style='color:#fff;font-size:0.9em'>" + esc(f.name) + "</div>" +
+                "<div style='color:#606266;font-size:0.7em;margin-top:2px'>" + esc(f.path) + "</div></div>" +
+                "<div style='text-align:right'>" +
+                "<div style='color:" + color + ";font-size:0.75em;font-weight:bold'>" + esc(f.status) + "</div>" +
+                "<div style='color:#868e96;font-size:0.7em;margin-top:2px'>Every " + f.interval_minutes + "m | Next: " + esc(f.next_scan) + "</div>" +
+                "</div></div>";
+        });
+        document.getElementById('folderScheduleContent').innerHTML = html;
+    }
+    
+    function renderLogs(text) {
+        var logs = document.getElementById('logs');
+        var atBottom = logs.scrollTop + logs.clientHeight >= logs.scrollHeight - 20;
+        logs.textContent = text;
+        if (atBottom) logs.scrollTop = logs.scrollHeight;
+    }
+    
+    function connect() {
+        var source = new EventSource('/api/events');
+        // Full state on every (re)connect, then diffs
+        source.addEventListener('snapshot', function(event) {
+            model = JSON.parse(event.data);
+            renderStatus(model.status);
+            renderFolders(model.folders);
+            renderLogs(model.logs);
+        });
+        source.onmessage = function(event) {
+            var diff = JSON.parse(event.data);
+            merge(model, diff);
+            if (diff.status) renderStatus(model.status);
+            if (diff.folders) renderFolders(model.folders);
+            if (diff.logs !== undefined) renderLogs(model.logs);
+        };
+    }
+    
+    // Toggle folder schedule visibility
+    function toggleFolderSchedule() {
+        var content = document.getElementById('folderScheduleContent');
+        var btn = document.getElementById('folderToggleBtn');
+        var isHidden = content.style.display === 'none';
+        
+        if (isHidden) {
+            content.style.display = 'flex';
+            btn.innerHTML = '<i class="fa-solid fa-chevron-up"></i> Hide';
+        } else {
+            content.style.display = 'none';
+            btn.innerHTML = '<i class="fa-solid fa-chevron-down"></i> Show';
+        }
         
-        // Restore collapse state on load
-        window.addEventListener('DOMContentLoaded', function() {{
-            var collapsed = localStorage.getItem('folderScheduleCollapsed') === 'true';
-            if (collapsed) {{
-                document.getElementById('folderScheduleContent').style.display = 'none';
-                document.getElementById('folderToggleBtn').innerHTML = '<i class="fa-solid fa-chevron-down"></i> Show';
-            }}
-        }});
-    </script>
-    </body></html>"""
+        // Save state to localStorage
+        localStorage.setItem('folderScheduleCollapsed', !isHidden);
+    }
+    
+    // Restore collapse state on load
+    window.addEventListener('DOMContentLoaded', function() {
+        var collapsed = localStorage.getItem('folderScheduleCollapsed') === 'true';
+        if (collapsed) {
+            document.getElementById('folderScheduleContent').style.display = 'none';
+            document.getElementById('folderToggleBtn').innerHTML = '<i class="fa-solid fa-chevron-down"></i> Show';
+        }
+        connect();
+    });
+</script>
+</body></html>"""
 
 @app.route('/toggle_pause')
 def toggle_pause():
     state['paused'] = not state['paused']
     return redirect(url_for('dashboard'))
 
+@app.route('/toggle_pause/<int:worker_id>')
+def toggle_pause_worker(worker_id):
+    if 0 <= worker_id < len(state['workers']):
+        state['workers'][worker_id]['paused'] = not state['workers'][worker_id]['paused']
+    return redirect(url_for('dashboard'))
+
 @app.route('/skip')
 def skip():
-    state['skip'] = True
+    # Skip every running job; with nothing running, skip the next queued file
+    active = [w for w in state['workers'] if w['file']]
+    for w in active:
+        w['skip'] = True
+    if not active:
+        state['skip'] = True
     return redirect(url_for('dashboard'))
 
+@app.route('/skip/<int:worker_id>')
+def skip_worker(worker_id):
+    if 0 <= worker_id < len(state['workers']):
+        state['workers'][worker_id]['skip'] = True
+    return redirect(url_for('dashboard'))
+
+def run_audit(args):
+    """
+    python watchdog_h265.py --audit [--deep] [FOLDER ...]
+    Check Matroska structure of every video in SOURCE_DIRS (or the given folders)
+    and write AUDIT_REPORT. Exit code 1 if corrupt files were found.
+    """
+    deep = CONFIG["AUDIT_DEEP"] or "--deep" in args
+    roots = [a for a in args if a != "--deep"] or [f["path"] for f in CONFIG["SOURCE_DIRS"]]
+    logger.info(f"Auditing {', '.join(roots)} ({CONFIG['AUDIT_WORKERS']} workers{', deep' if deep else ''})")
+    
+    def progress(done, total):
+        if done % 1000 == 0 or done == total:
+            print(f"\rAudit: {done}/{total}", end="", flush=True)
+    report = audit_library(roots, workers=int(CONFIG["AUDIT_WORKERS"]), deep=deep, on_progress=progress)
+    print()
+    
+    tmp_file = CONFIG["AUDIT_REPORT"] + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_file, CONFIG["AUDIT_REPORT"])
+    
+    summary = report["summary"]
+    for finding in report["findings"]:
+        log = logger.error if finding["status"] == "corrupt" else logger.warning
+        log(f"{finding['status'].upper()}: {finding['path']} - {'; '.join(finding['problems'])}")
+    for folder, count in report["corrupt_by_folder"].items():
+        logger.info(f"  {count:5d}  {folder}")
+    logger.info(f"Audit: {report['files']} files in {report['seconds']}s - {summary['ok']} OK, "
+                f"{summary['warning']} warnings, {summary['corrupt']} corrupt, {summary['skipped']} not Matroska "
+                f"(report: {CONFIG['AUDIT_REPORT']})")
+    return 1 if summary["corrupt"] else 0
+
 if __name__ == "__main__":
-    t = threading.Thread(target=worker_loop, daemon=True)
+    if "--audit" in sys.argv:
+        sys.exit(run_audit(sys.argv[sys.argv.index("--audit") + 1:]))
+    if "--calibrate" in sys.argv:
+        # python watchdog_h265.py --calibrate [REFERENCE_VIDEO]
+        args = sys.argv[sys.argv.index("--calibrate") + 1:]
+        init_workers()
+        sys.exit(0 if calibrate_host(args[0] if args else None) else 1)
+    journal.start()
+    atexit.register(journal.close)
+    if CONFIG["ROLE"] != "worker":
+        restore_leases()
+    t = threading.Thread(target=remote_worker_loop if CONFIG["ROLE"] == "worker" else worker_loop,
+                         daemon=True)
     t.start()
     app.run(host='0.0.0.0', port=CONFIG["PORT"])
\ No newline at end of file